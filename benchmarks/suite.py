@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of switching and timekeeping hot paths, on virtual ICSE0XXA boards
+Run from project dir:
+    python -m benchmarks.suite [--json FILE] [--compare OLD_FILE] [--only NAME,...]
+"""
+
+import argparse
+import configparser
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pt
+from devices.icse0xxa import ICSE0XXADevice
+from devices.simulator import SimulatedBus
+
+
+def percentiles(samples):
+    """Latency stats of samples (seconds) in ms"""
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.mean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        "max_ms": samples[-1] * 1000
+    }
+
+
+def bench_switch_relay(count=100):
+    """ICSE0XXADevice.switch_relay(): synchronous register writes"""
+    with SimulatedBus.from_spec("ICSE014A:1") as bus:
+        dev = bus.devices()[0]
+        dev.init_device()
+        samples = []
+        try:
+            for i in range(count):
+                started = time.perf_counter()
+                dev.switch_relay(i % 8, bool(i % 2))
+                samples.append(time.perf_counter() - started)
+        finally:
+            dev.close()
+    result = percentiles(samples)
+    result["ops_per_s"] = count / sum(samples)
+    return result
+
+
+def bench_switch_relays_async(count=10000):
+    """ICSE0XXADevice.switch_relay_async(): calls until all callbacks done, with coalescing"""
+    with SimulatedBus.from_spec("ICSE014A:1") as bus:
+        dev = bus.devices()[0]
+        dev.init_device()
+        done = threading.Semaphore(0)
+        try:
+            started = time.perf_counter()
+            for i in range(count):
+                dev.switch_relay_async(i % 8, bool(i % 2), lambda error: done.release())
+            submitted = time.perf_counter()
+            for i in range(count):
+                done.acquire()
+            finished = time.perf_counter()
+        finally:
+            dev.close()
+        writes = bus.boards[dev.port()].writes
+    return {
+        "count": count,
+        "submit_ops_per_s": count / (submitted - started),
+        "ops_per_s": count / (finished - started),
+        "register_writes": writes
+    }
+
+
+def make_plugin(bus):
+    """Activated ICSE0XXAPlugin on bus boards"""
+    from plugins.icse0xxa_plugin import ICSE0XXAPlugin
+    plugin = ICSE0XXAPlugin()
+    plugin.set_devices(bus.devices())
+    plugin.activate()
+    return plugin
+
+
+def bench_plugin_switch(boards=16, rounds=50):
+    """
+    ICSE0XXAPlugin.switch(): dispatch - time of call in caller thread,
+    complete - time from call to switch_done()
+    All channels switched in each round, next round after all switched
+    """
+    with SimulatedBus.from_spec("ICSE014A:{}".format(boards)) as bus:
+        plugin = make_plugin(bus)
+        channels = plugin.get_channels_count()
+        sent = {}
+        complete = []
+        round_done = threading.Semaphore(0)
+
+        def listener(channel, state, error):
+            complete.append(time.perf_counter() - sent[channel])
+            round_done.release()
+
+        plugin.set_switch_listener(listener)
+        dispatch = []
+        try:
+            for r in range(rounds):
+                for channel in range(channels):
+                    started = time.perf_counter()
+                    sent[channel] = started
+                    plugin.switch(channel, bool(r % 2))
+                    dispatch.append(time.perf_counter() - started)
+                for channel in range(channels):
+                    round_done.acquire()
+        finally:
+            plugin.deactivate()
+    return {
+        "channels": channels,
+        "dispatch": percentiles(dispatch),
+        "complete": percentiles(complete)
+    }
+
+
+def bench_find_devices(boards=16, latency=0.002):
+    """ICSE0XXADevice.find_devices(): scan time of ports"""
+    with SimulatedBus.from_spec("ICSE014A:{}".format(boards), latency=latency):
+        started = time.perf_counter()
+        found = ICSE0XXADevice.find_devices()
+        elapsed = time.perf_counter() - started
+    return {"ports": boards, "found": len(found), "scan_s": elapsed}
+
+
+def tick_run(app, parent, count, ticks):
+    """Ticks of bench_tick() on count running channels of parent engine"""
+    from engine.engine import Channel
+    from ui.clock import ClockDriver
+    from ui.timer_control import TimerCashControl
+
+    parent.engine.channels = [Channel(n) for n in range(count)]
+    controls = [TimerCashControl(parent, n) for n in range(count)]
+    for n in range(count):
+        parent.engine.channels[n].session.start()
+        controls[n].refresh()
+    parent.show()
+    app.processEvents()
+    clock = ClockDriver.instance()
+    clock.reset_stats()
+    display = []
+    for i in range(ticks):
+        clock._tick()
+        # Paint events of tick
+        app.processEvents()
+        started = time.perf_counter()
+        controls[i % count].displayed_values = None
+        controls[i % count].display()
+        display.append(time.perf_counter() - started)
+    stats = clock.stats()
+    for c in controls:
+        c.close()
+    parent.close()
+    app.processEvents()
+    return {
+        "tick_avg_ms": stats["avg_ms"],
+        "tick_max_ms": stats["max_ms"],
+        "display": percentiles(display)
+    }
+
+
+def bench_tick(channels_counts=(8, 32, 128), ticks=200):
+    """
+    TimerCashControl._timer_event() and display() cost per tick,
+    all channels running, ticks dispatched by ClockDriver
+    """
+    from PySide.QtGui import QApplication, QWidget
+    from engine.engine import SessionEngine
+
+    app = QApplication.instance() or QApplication([])
+    results = {}
+    tmp = tempfile.mkdtemp(prefix="pt-bench-")
+    try:
+        for count in channels_counts:
+            # Own journal and config file of each engine, engine closed before next size
+            work_dir = os.path.join(tmp, str(count))
+            parent = QWidget()
+            parent.config = configparser.ConfigParser()
+            parent.config[pt.APP_MAIN_SECTION] = {"journal_dir": os.path.join(work_dir, "journal")}
+            parent.engine = SessionEngine(parent.config, config_file=os.path.join(work_dir, "main.conf"))
+            try:
+                parent.engine.open()
+                results[str(count)] = tick_run(app, parent, count, ticks)
+            finally:
+                parent.engine.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+def bench_startup(boards=16, runs=3):
+    """
+    Startup time of pt.py: process start, imports, engine with activated plugins and built channels
+    """
+    code = (
+        "import sys, time; started = time.perf_counter()\n"
+        "import pt\n"
+        "from engine.engine import SessionEngine\n"
+        "from devices.simulator import SimulatedBus\n"
+        "config = pt.read_config(sys.argv[1])\n"
+        "engine = SessionEngine(config, config_file=sys.argv[1]); engine.open(); engine.load_plugins()\n"
+        "bus = SimulatedBus.from_spec('ICSE014A:{}'); bus.install()\n"
+        "[p.set_devices(bus.devices()) for p in engine.plugins if hasattr(p, 'set_devices')]\n"
+        "engine.activate_plugins_on_start(); engine.build_channels()\n"
+        "print(time.perf_counter() - started, len(engine.channels))\n"
+        "engine.close()\n"
+    ).format(boards)
+    tmp = tempfile.mkdtemp(prefix="pt-bench-")
+    try:
+        conf = os.path.join(tmp, "main.conf")
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        config[pt.APP_MAIN_SECTION] = {"journal_dir": os.path.join(tmp, "journal")}
+        config[pt.PLUGINS_CONF_SECTION] = {"ICSE0XXA control": "True"}
+        pt.write_config(config, conf)
+        totals, inits, channels = [], [], 0
+        for i in range(runs):
+            started = time.perf_counter()
+            out = subprocess.run([sys.executable, "-c", code, conf], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, universal_newlines=True, check=True).stdout
+            totals.append(time.perf_counter() - started)
+            init, channels = out.strip().splitlines()[-1].split()
+            inits.append(float(init))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {"channels": int(channels), "process_s": min(totals), "in_process_s": min(inits)}
+
+
+BENCHMARKS = {
+    "switch_relay": bench_switch_relay,
+    "switch_relays_async": bench_switch_relays_async,
+    "plugin_switch": bench_plugin_switch,
+    "find_devices": bench_find_devices,
+    "tick": bench_tick,
+    "startup": bench_startup,
+}
+
+
+def run(names):
+    """:return: results dict, failed benchmarks have {"error": str}"""
+    results = {}
+    for name in names:
+        print("benchmark:", name, "...", file=sys.stderr)
+        try:
+            results[name] = BENCHMARKS[name]()
+        except Exception as e:
+            print("benchmark: {} failed: {}".format(name, e), file=sys.stderr)
+            results[name] = {"error": "{}: {}".format(type(e).__name__, e)}
+    return {
+        "version": pt.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results
+    }
+
+
+def flatten(results, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}"""
+    flat = {}
+    for k, v in results.items():
+        if isinstance(v, dict):
+            flat.update(flatten(v, prefix + k + "."))
+        elif isinstance(v, (int, float)):
+            flat[prefix + k] = v
+    return flat
+
+
+def compare(old, new):
+    """Print metrics of two runs side by side"""
+    old_flat, new_flat = flatten(old["results"]), flatten(new["results"])
+    print("{:<45}{:>14}{:>14}{:>9}".format("metric", old["version"], new["version"], "ratio"))
+    for key, value in new_flat.items():
+        if key in old_flat:
+            ratio = value / old_flat[key] if old_flat[key] else float("inf")
+            print("{:<45}{:>14.4f}{:>14.4f}{:>9.2f}".format(key, old_flat[key], value, ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite", description="PowerTime benchmarks")
+    parser.add_argument("--json", metavar="FILE", help="write results to FILE, default - stdout")
+    parser.add_argument("--compare", metavar="OLD_FILE", help="compare results with previous run")
+    parser.add_argument("--only", metavar="NAME,...", help="run only: " + ", ".join(BENCHMARKS))
+    args = parser.parse_args(argv)
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: " + name)
+
+    report = run(names)
+    text = json.dumps(report, indent=2)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
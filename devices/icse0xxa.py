@@ -3,10 +3,16 @@
 
 import time
 import sys
+import threading
 
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from serial import Serial, SerialException, SerialTimeoutException
 from serial.tools import list_ports
 from configparser import ConfigParser
+from devices.io_worker import PortIOWorker
+from devices.port_identity import PortIdentityCache
+from engine.metrics import METRICS, timed
+from engine.config_store import config_text, write_config_text
 
 
 class ICSE0XXADevice:
@@ -22,6 +28,16 @@ class ICSE0XXADevice:
     MODELS = {0xAB: "ICSE012A", 0xAD: "ICSE013A", 0xAC: "ICSE014A"}
     # Relays count by device id
     RELAYS = {0xAB: 4, 0xAD: 2, 0xAC: 8}
+    # Max time for probing one port on search (seconds)
+    PROBE_DEADLINE = 1.5
+    # Time for collecting relays changes into one register write (seconds)
+    COALESCE_WINDOW = 0.005
+    # Time for device port ready after replug (seconds)
+    REPLUG_SETTLE = 0.5
+    # Serial port class with pyserial Serial interface, replaced by devices.simulator
+    SERIAL_CLASS = Serial
+    # Last known devices of USB ports
+    IDENTITY_CACHE = PortIdentityCache()
 
     def __init__(self, port, id):
         """
@@ -37,6 +53,14 @@ class ICSE0XXADevice:
         self.__initialized = False
         self.__connection = None
         self.__relays_register = 0
+        # Port removed (hot-unplug), relays changes kept in register until reinit
+        self.__unplugged = False
+        # Thread for non-blocking port I/O, started on init_device()
+        self.__worker = None
+        # Relays changes waiting for write: {relay_num: enable, ...} and their callbacks
+        self.__pending = {}
+        self.__pending_callbacks = []
+        self.__pending_lock = threading.Lock()
 
         print("Created:", self)
 
@@ -76,16 +100,141 @@ class ICSE0XXADevice:
         NOTICE:
         ON - diode on PCB is off, OFF - diodes lights!
         """
+        self.switch_relays({relay_num: enable})
+
+    @timed("switch_relay")
+    def switch_relays(self, changes):
+        """
+        Switching some relays on device by one register write
+        :arg changes  Dict {relay_num: enable, ...}
+        """
         self.__chek_init()
-        if relay_num >= self.relays_count():
-            raise Exception("Relay num mast be less than {}".format(ICSE0XXADevice.RELAYS[self.__id]))
-        if enable:
-            self.__relays_register = self.__relays_register | (1 << relay_num)
-        else:
-            self.__relays_register = self.__relays_register & ~(1 << relay_num)
+        register = self.__relays_register
+        for relay_num, enable in changes.items():
+            if relay_num >= self.relays_count():
+                raise Exception("Relay num mast be less than {}".format(ICSE0XXADevice.RELAYS[self.__id]))
+            if enable:
+                register = register | (1 << relay_num)
+            else:
+                register = register & ~(1 << relay_num)
+        self.__relays_register = register
+        if self.__unplugged:
+            raise SerialException("Device {} disconnected".format(self.name()))
         time.sleep(0.01)
         self.__connection.write(bytes([self.__relays_register]))
 
+    def switch_relay_async(self, relay_num, enable, callback=None):
+        """
+        Switching relay on device in I/O worker thread, returns immediately
+        :arg relay_num  Number of relay
+        :arg enable Switch state True - ON, False - OFF
+        :arg callback  Callable(error) called from worker thread when switched,
+                       error - None on success or raised exception
+        """
+        self.switch_relays_async({relay_num: enable}, callback)
+
+    def switch_relays_async(self, changes, callback=None):
+        """
+        Switching some relays on device in I/O worker thread, returns immediately
+        Changes coming in COALESCE_WINDOW merged and written by one register write
+        :arg changes  Dict {relay_num: enable, ...}
+        :arg callback  Callable(error) called from worker thread when switched,
+                       error - None on success or raised exception
+        """
+        self.__chek_init()
+        for relay_num in changes:
+            if relay_num >= self.relays_count():
+                raise Exception("Relay num mast be less than {}".format(ICSE0XXADevice.RELAYS[self.__id]))
+        with self.__pending_lock:
+            # Write not scheduled yet
+            schedule = not self.__pending
+            self.__pending.update(changes)
+            if callback:
+                self.__pending_callbacks.append(callback)
+        if schedule:
+            self.__worker.submit(self.__write_pending)
+
+    def __write_pending(self):
+        """Write merged relays changes, called in I/O worker thread"""
+        time.sleep(ICSE0XXADevice.COALESCE_WINDOW)
+        with self.__pending_lock:
+            changes, callbacks = self.__pending, self.__pending_callbacks
+            self.__pending, self.__pending_callbacks = {}, []
+        error = None
+        try:
+            self.switch_relays(changes)
+        except Exception as e:
+            icse0xxa_eprint("ICSE0XXADevice.switch_relays(): {}".format(e))
+            error = e
+        for callback in callbacks:
+            callback(error)
+
+    def close(self):
+        """Stop I/O worker (after queued commands) and close device port"""
+        if self.__worker:
+            self.__worker.stop()
+            self.__worker.join()
+            self.__worker = None
+        self.__initialized = False
+        self.__unplugged = False
+        if self.__connection:
+            self.__connection.close()
+            self.__connection = None
+
+    def relays_register(self):
+        """Relays states register, bit per relay"""
+        return self.__relays_register
+
+    def unplugged(self):
+        return self.__unplugged
+
+    def set_unplugged(self):
+        """
+        Device port removed (hot-unplug) or device failed on init, port closed in I/O worker thread
+        Relays changes kept in register, reported as failed and written on replug by reinit_async()
+        """
+        if self.__id not in ICSE0XXADevice.MODELS:
+            raise Exception("Unknown_device: {}".format(self.name()))
+        self.__unplugged = True
+        if not self.__worker:
+            self.__worker = PortIOWorker(self.__port)
+            self.__worker.start()
+        self.__worker.submit(self.__close_connection)
+
+    def reinit_async(self, callback=None, port=None):
+        """
+        Init device again after replug and write relays register, in I/O worker thread
+        Device identified on port again, other device on port is error
+        :arg callback  Callable(error) called from worker thread when device ready,
+                       error - None on success or raised exception
+        :arg port  New port name, when port renamed on replug
+        """
+        self.__chek_init()
+        self.__unplugged = True
+        self.__worker.submit(self.__reinit, port, callback=callback)
+
+    def __reinit(self, port=None):
+        self.__close_connection()
+        if port:
+            self.__port = port
+        time.sleep(ICSE0XXADevice.REPLUG_SETTLE)
+        try:
+            self.__identified(self.__connect(), strict=True)
+            self.__connection.write(bytes([self.__relays_register]))
+        except Exception:
+            # Device stays unplugged until next replug
+            self.__close_connection()
+            raise
+        self.__unplugged = False
+        self.__initialized = True
+        print("ICSE0XXADevice: {} reinitialized, relays register {:#04x}".format(self, self.__relays_register))
+
+    def __close_connection(self):
+        if self.__connection:
+            self.__connection.close()
+            self.__connection = None
+
+    @timed("init_device")
     def init_device(self):
         """
         Turn device to listening mode
@@ -95,9 +244,23 @@ class ICSE0XXADevice:
         :except SerialTimeoutException, SerialException
         """
         self.__initialized = False
-        self.__connection = Serial()
+        self.__identified(self.__connect())
+        # no errors - good
+        self.__initialized = True
+        self.__unplugged = False
+        if not self.__worker:
+            self.__worker = PortIOWorker(self.__port)
+            self.__worker.start()
+
+    def __connect(self):
+        """
+        Open port, identify device and turn it to listening mode
+        :return: device id answered, None if device not responding (already in listening mode)
+        """
+        self.__connection = ICSE0XXADevice.SERIAL_CLASS()
         self.__connection.port = self.__port
         self.__connection.timeout = 1
+        self.__connection.write_timeout = 1
         try:
             self.__connection.open()
             self.__connection.write(ICSE0XXADevice.ID_COMMAND)
@@ -105,24 +268,44 @@ class ICSE0XXADevice:
             answer = self.__connection.read(1)
             if len(answer) > 0 and answer[0] not in ICSE0XXADevice.MODELS:
                 raise Exception("Unknown device '" + hex(answer[0]) + "'")
-            # Port opened, but no answer
-            if len(answer) == 0:
-                print("ICSE0XXADevice.init_device():",
-                      "CAUTION: Port " + self.__port + " opened, but device not responding.",
-                      "Device may be already initialized...", file=sys.stderr)
-            else:
+            # Port opened, but no answer: device may be already initialized
+            if len(answer) > 0:
                 self.__connection.write(ICSE0XXADevice.READY_COMMAND)
             time.sleep(0.5)
         except Exception as e:
             icse0xxa_eprint("ICSE0XXADevice.init_device(): {}".format(e))
             raise e
-        # no errors - good
-        self.__initialized = True
+        return answer[0] if answer else None
+
+    def __identified(self, answer, strict=False):
+        """
+        Check device answer on identification by port identity cache, remember device of port
+        :arg answer  Device id answered or None
+        :arg strict  Other device on port is error
+        """
+        info = ICSE0XXADevice.port_info(self.__port)
+        cache = ICSE0XXADevice.IDENTITY_CACHE
+        if answer is None:
+            if cache.model(info) == self.__id:
+                print("ICSE0XXADevice.init_device():", self, "in listening mode, recognized by port")
+            else:
+                print("ICSE0XXADevice.init_device():",
+                      "CAUTION: Port " + self.__port + " opened, but device not responding.",
+                      "Device may be already initialized...", file=sys.stderr)
+            return
+        if answer != self.__id:
+            message = "Other device on port {}: {}".format(self.__port, ICSE0XXADevice.MODELS[answer])
+            if strict:
+                raise Exception(message)
+            icse0xxa_eprint("ICSE0XXADevice.init_device(): CAUTION: " + message)
+        cache.remember(info, answer)
+        cache.save()
 
     def __chek_init(self):
         if self.__id not in ICSE0XXADevice.MODELS:
             raise Exception("Unknown_device: {}".format(self.name()))
-        if not self.__initialized:
+        # Unplugged device takes relays changes until reinit
+        if not self.__initialized and not self.__unplugged:
             raise Exception("Device {} not initialized.".format(self.name()))
 
     def __str__(self):
@@ -153,38 +336,133 @@ class ICSE0XXADevice:
         c[ICSE0XXADevice.MAIN_CFG_SECTION] = {}
         for d in dev_list:
             c[ICSE0XXADevice.MAIN_CFG_SECTION][d.port()] = hex(d.id())
-        with open(file, "w") as f:
-            c.write(f)
+        write_config_text(config_text(c), file)
+
+    @staticmethod
+    @timed("probe_port")
+    def probe_port(port, deadline=PROBE_DEADLINE):
+        """
+        Probe one serial port for ICSE0XXA device
+        :arg port  Port name
+        :arg deadline  Max time for probing port (seconds)
+        :return: ICSE0XXADevice or None
+        Returned object device not initialized!
+        """
+        started = time.monotonic()
+        # Device needs some time after port opening and after ID command
+        settle = min(0.5, deadline / 4)
+        p = ICSE0XXADevice.SERIAL_CLASS()
+        p.port = port
+        p.timeout = deadline
+        p.write_timeout = deadline
+        try:
+            p.open()
+        except SerialException as e:
+            icse0xxa_eprint("probe_port(): {}".format(e))
+            return None
+        try:
+            time.sleep(settle)
+            p.write(ICSE0XXADevice.ID_COMMAND)
+            time.sleep(settle)
+            p.timeout = max(0, deadline - (time.monotonic() - started))
+            answer = p.read(1)
+            if (len(answer) > 0) and (answer[0] in ICSE0XXADevice.MODELS):
+                return ICSE0XXADevice(p.port, answer[0])
+        except SerialTimeoutException as e:
+            icse0xxa_eprint("probe_port(): {}".format(e))
+        finally:
+            p.close()
+        return None
 
     @staticmethod
-    def find_devices():
+    def iter_find_devices(deadline=PROBE_DEADLINE, ports=None):
+        """
+        Find ICSE0XXA devices on ports, all ports probed at once
+        Devices known by port identity cache yielded first without probing, only unknown ports probed
+        :arg deadline  Max time for probing one port (seconds)
+        :arg ports  Ports names to probe, by default all serial ports in system
+        :return: generator of ICSE0XXADevice, devices yielded as soon as found
+        Returned objects device not initialized!
+        """
+        cache = ICSE0XXADevice.IDENTITY_CACHE
+        infos = {info.device: info for info in ICSE0XXADevice.system_port_infos()}
+        if ports is None:
+            ports = list(infos)
+        unknown = []
+        for port in ports:
+            model_id = cache.model(infos.get(port))
+            if model_id is None:
+                unknown.append(port)
+            else:
+                yield ICSE0XXADevice(port, model_id)
+        ports = unknown
+        if not ports:
+            return
+        started = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=len(ports))
+        futures = [executor.submit(ICSE0XXADevice.probe_port, port, deadline) for port in ports]
+        try:
+            # Small gap for thread start and port closing
+            for f in as_completed(futures, timeout=deadline + 0.5):
+                try:
+                    dev = f.result()
+                except Exception as e:
+                    icse0xxa_eprint("find_devices(): {}".format(e))
+                    continue
+                if dev:
+                    cache.remember(infos.get(dev.port()), dev.id())
+                    yield dev
+        except FuturesTimeoutError:
+            not_done = [port for port, f in zip(ports, futures) if not f.done()]
+            icse0xxa_eprint("find_devices(): ports not responding: {}".format(", ".join(not_done)))
+        finally:
+            # Hung probes finished in background, don't wait it
+            executor.shutdown(wait=False)
+            cache.save()
+            METRICS.observe("find_devices", time.perf_counter() - started)
+
+    @staticmethod
+    def system_port_infos():
+        """Serial ports in system with USB attributes (pyserial ListPortInfo), replaced by devices.simulator"""
+        return list_ports.comports()
+
+    @staticmethod
+    def port_info(port):
+        """ListPortInfo of port, None if port not in system"""
+        return next((info for info in ICSE0XXADevice.system_port_infos() if info.device == port), None)
+
+    @staticmethod
+    def rebind_ports(dev_list):
+        """
+        Bind devices of missing ports to ports renamed after replug or reboot, by port identity cache
+        :arg dev_list  Not initialized devices, like loaded from config
+        :return: list of ICSE0XXADevice, devices of renamed ports replaced by new objects
+        """
+        infos = ICSE0XXADevice.system_port_infos()
+        ports = {d.port() for d in dev_list}
+        result = []
+        for d in dev_list:
+            if not any(info.device == d.port() for info in infos):
+                for info in infos:
+                    entry = ICSE0XXADevice.IDENTITY_CACHE.lookup(info)
+                    if entry and entry["port"] == d.port() and entry["model"] == d.id() and \
+                            info.device not in ports:
+                        print("ICSE0XXADevice.rebind_ports():", d, "moved to", info.device)
+                        ports.add(info.device)
+                        d = ICSE0XXADevice(info.device, d.id())
+                        break
+            result.append(d)
+        return result
+
+    @staticmethod
+    def find_devices(deadline=PROBE_DEADLINE):
         """
         Find ICSE0XXA devices on ports
+        :arg deadline  Max time for probing one port (seconds)
         :return: dev_list[ICSE0XXADevice, ...]
         Returned objects device not initialized!
         """
-        dev_list = []
-        for port in list_ports.comports():
-            p = Serial()
-            p.port = port.device
-            p.timeout = 1
-            try:
-                p.open()
-            except SerialException as e:
-                icse0xxa_eprint("find_devices(): {}".format(e))
-                continue
-            try:
-                time.sleep(0.5)
-                p.write(ICSE0XXADevice.ID_COMMAND)
-                time.sleep(0.5)
-                answer = p.read(1)
-                if (len(answer) > 0) and (answer[0] in ICSE0XXADevice.MODELS):
-                    dev_list.append(ICSE0XXADevice(p.port, answer[0]))
-            except SerialTimeoutException as e:
-                icse0xxa_eprint("find_devices(): {}".format(e))
-            finally:
-                p.close()
-        return dev_list
+        return list(ICSE0XXADevice.iter_find_devices(deadline))
 
 
 def icse0xxa_eprint(err):
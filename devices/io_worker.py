@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import queue
+import sys
+import threading
+
+
+class PortIOWorker(threading.Thread):
+    """
+    Thread for I/O on one serial port
+    Commands executed one by one in order of submitting,
+    so caller (UI) thread never waits for port
+    """
+
+    def __init__(self, port):
+        """
+        Create worker for port
+        :arg port  Port name, used in thread name
+        """
+        super().__init__(name="PortIOWorker@{}".format(port), daemon=True)
+        self.__queue = queue.Queue()
+
+    def submit(self, func, *args, callback=None):
+        """
+        Put command to queue
+        :arg func  Callable executed in worker thread
+        :arg args  Arguments for func
+        :arg callback  Callable(error), called in worker thread after func,
+                       error - None on success or raised exception
+        """
+        self.__queue.put((func, args, callback))
+
+    def pending(self):
+        """Return count of not executed commands"""
+        return self.__queue.qsize()
+
+    def stop(self):
+        """Stop worker after all submitted commands executed"""
+        self.__queue.put(None)
+
+    def run(self):
+        while True:
+            cmd = self.__queue.get()
+            if cmd is None:
+                break
+            func, args, callback = cmd
+            error = None
+            try:
+                func(*args)
+            except Exception as e:
+                print("PortIOWorker.run():", self.name, e, file=sys.stderr)
+                error = e
+            if callback:
+                try:
+                    callback(error)
+                except Exception as e:
+                    print("PortIOWorker.run(): callback error:", e, file=sys.stderr)
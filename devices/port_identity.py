@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import threading
+
+
+class PortIdentityCache:
+    """
+    Last known devices on serial ports by stable USB attributes of port
+    USB ports renamed after replug or reboot (ttyUSB0 -> ttyUSB1, COM3 -> COM5), USB attributes not:
+    port identified by VID:PID with serial number of adapter, or with USB path (by-path) when no serial number
+    Known devices bound without probing, so boards in listening mode (not answering identification)
+    recognized too. Ports without USB attributes (not USB or simulated) are not cached
+    """
+
+    # Cache file, in work dir near device config
+    FILE = "icse0xxa_ports.json"
+    # Version of cache format
+    VERSION = 1
+
+    def __init__(self, file=FILE):
+        """
+        :param file  Cache file
+        """
+        self.file = file
+        # {identity key: {"model": device id, "port": last port name}, ...}, loaded on first use
+        self.__entries = None
+        self.__changed = False
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def keys(port_info):
+        """
+        Identity keys of port: adapter with serial number identified wherever plugged,
+        adapter without serial number - by USB path
+        :param port_info  pyserial ListPortInfo or None
+        :return: list of str, empty for port without USB attributes
+        """
+        vid = getattr(port_info, "vid", None)
+        if vid is None:
+            return []
+        usb = "{:04x}:{:04x}".format(vid, getattr(port_info, "pid", None) or 0)
+        serial_number = getattr(port_info, "serial_number", None)
+        if serial_number:
+            return [usb + " serial " + serial_number]
+        location = getattr(port_info, "location", None)
+        if location:
+            return [usb + " path " + location]
+        return []
+
+    def lookup(self, port_info):
+        """
+        Last known device of port
+        :return: dict {"model": device id, "port": last port name} or None
+        """
+        with self.__lock:
+            entries = self.__load()
+            for key in PortIdentityCache.keys(port_info):
+                if key in entries:
+                    return dict(entries[key])
+        return None
+
+    def model(self, port_info):
+        """Device id last known on port, None for unknown port"""
+        entry = self.lookup(port_info)
+        return entry["model"] if entry else None
+
+    def remember(self, port_info, model_id):
+        """Device identified on port"""
+        entry = {"model": model_id, "port": port_info.device if port_info is not None else None}
+        with self.__lock:
+            entries = self.__load()
+            for key in PortIdentityCache.keys(port_info):
+                if entries.get(key) != entry:
+                    entries[key] = entry
+                    self.__changed = True
+
+    def save(self):
+        """Write cache, if changed"""
+        with self.__lock:
+            if not self.__changed:
+                return
+            self.__changed = False
+            tmp_file = self.file + ".tmp"
+            try:
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump({"version": PortIdentityCache.VERSION, "ports": self.__entries}, f, indent=1)
+                os.replace(tmp_file, self.file)
+            except OSError as e:
+                # Devices probed again on next start
+                print("PortIdentityCache: can't write {}: {}".format(self.file, e), file=sys.stderr)
+
+    def __load(self):
+        if self.__entries is None:
+            self.__entries = {}
+            try:
+                with open(self.file, encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == PortIdentityCache.VERSION:
+                    self.__entries = data["ports"]
+            except (OSError, ValueError, KeyError):
+                pass
+        return self.__entries
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from serial import SerialException, SerialTimeoutException
+from devices.icse0xxa import ICSE0XXADevice
+
+
+class VirtualICSE0XXA:
+    """
+    Virtual ICSE0XXA board
+    After power on board answers model id on ID command (0x50),
+    after READY command (0x51) board in listening mode: each received byte is relays register,
+    board doesn't answer in listening mode, only power off (unplug) resets it
+    """
+
+    def __init__(self, port, model_id):
+        """
+        :arg port  Port name of board
+        :arg model_id  Model id: 0xAB - ICSE012A, 0xAD - ICSE013A, 0xAC - ICSE014A
+        """
+        if model_id not in ICSE0XXADevice.MODELS:
+            raise ValueError("Unknown model id: {}".format(hex(model_id)))
+        self.port = port
+        self.model_id = model_id
+        self.plugged = True
+        self.listening = False
+        self.register = 0
+        # Registers writes count
+        self.writes = 0
+        self.__output = bytearray()
+        self.__cond = threading.Condition()
+
+    def power_on(self):
+        """Board state after power on"""
+        with self.__cond:
+            self.plugged = True
+            self.listening = False
+            self.register = 0
+            self.__output.clear()
+
+    def receive(self, data):
+        """Bytes from host"""
+        with self.__cond:
+            for b in data:
+                if self.listening:
+                    self.register = b
+                    self.writes += 1
+                elif b == ICSE0XXADevice.ID_COMMAND[0]:
+                    self.__output.append(self.model_id)
+                    self.__cond.notify_all()
+                elif b == ICSE0XXADevice.READY_COMMAND[0]:
+                    self.listening = True
+
+    def send(self, size, timeout):
+        """
+        Bytes to host
+        :arg timeout  Max wait time (seconds), None - wait forever
+        """
+        with self.__cond:
+            self.__cond.wait_for(lambda: self.__output or not self.plugged, timeout)
+            data = bytes(self.__output[:size])
+            del self.__output[:size]
+            return data
+
+    def unplug(self):
+        with self.__cond:
+            self.plugged = False
+            self.__cond.notify_all()
+
+    def relays(self):
+        """Relays states list"""
+        return [bool(self.register & (1 << r)) for r in range(ICSE0XXADevice.RELAYS[self.model_id])]
+
+    def __str__(self):
+        return "Virtual{}@{}".format(ICSE0XXADevice.MODELS[self.model_id], self.port)
+
+
+class SimulatedBus:
+    """
+    Serial ports with virtual ICSE0XXA boards
+    install() replaces serial ports of ICSE0XXADevice by VirtualSerial ports of bus
+    """
+
+    # Model ids by names
+    MODEL_IDS = {name: model_id for model_id, name in ICSE0XXADevice.MODELS.items()}
+    # Ports names format
+    PORT_NAME = "/dev/ttySIM{}"
+
+    def __init__(self, latency=0.0, drop_rate=0.0, seed=None):
+        """
+        :arg latency  Delay of each write and read (seconds)
+        :arg drop_rate  Probability of lost byte on write, 0..1
+        :arg seed  Random seed for dropped bytes
+        """
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.boards = {}
+        self.__saved = None
+
+    @staticmethod
+    def from_spec(spec, **kwargs):
+        """
+        Create bus by boards spec
+        :arg spec  "MODEL:COUNT,..." e.g. "ICSE014A:16,ICSE012A:2"
+        """
+        bus = SimulatedBus(**kwargs)
+        for item in spec.split(","):
+            name, _, count = item.strip().partition(":")
+            if name.upper() not in SimulatedBus.MODEL_IDS:
+                raise ValueError("Unknown model '{}', known: {}".format(
+                    name, ", ".join(SimulatedBus.MODEL_IDS)))
+            for i in range(int(count or 1)):
+                bus.add(SimulatedBus.MODEL_IDS[name.upper()])
+        return bus
+
+    def add(self, model_id, port=None):
+        """
+        Connect new board
+        :return: VirtualICSE0XXA
+        """
+        if port is None:
+            port = SimulatedBus.PORT_NAME.format(len(self.boards))
+        board = VirtualICSE0XXA(port, model_id)
+        self.boards[port] = board
+        return board
+
+    def unplug(self, port):
+        """Disconnect board, opened port fails on I/O"""
+        self.boards[port].unplug()
+
+    def plug(self, port):
+        """Connect board back, board powered on"""
+        self.boards[port].power_on()
+
+    def ports(self):
+        """Names of ports with connected boards"""
+        return [port for port, board in self.boards.items() if board.plugged]
+
+    def port_infos(self):
+        """Ports with connected boards like pyserial ListPortInfo, without USB attributes"""
+        return [SimpleNamespace(device=port, vid=None, pid=None, serial_number=None, location=None)
+                for port in self.ports()]
+
+    def devices(self):
+        """
+        ICSE0XXADevice's for connected boards, like loaded from config
+        Returned objects device not initialized!
+        """
+        return [ICSE0XXADevice(port, board.model_id) for port, board in self.boards.items() if board.plugged]
+
+    def install(self):
+        """Use bus ports in ICSE0XXADevice instead of system serial ports"""
+        if self.__saved is None:
+            self.__saved = (ICSE0XXADevice.SERIAL_CLASS, ICSE0XXADevice.system_port_infos)
+        bus = self
+        ICSE0XXADevice.SERIAL_CLASS = lambda: VirtualSerial(bus)
+        ICSE0XXADevice.system_port_infos = staticmethod(self.port_infos)
+
+    def uninstall(self):
+        if self.__saved is not None:
+            ICSE0XXADevice.SERIAL_CLASS, system_port_infos = self.__saved
+            ICSE0XXADevice.system_port_infos = staticmethod(system_port_infos)
+            self.__saved = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *args):
+        self.uninstall()
+
+
+class VirtualSerial:
+    """Port of SimulatedBus with pyserial Serial interface used by ICSE0XXADevice"""
+
+    def __init__(self, bus, port=None):
+        self.bus = bus
+        self.port = port
+        self.timeout = None
+        self.write_timeout = None
+        self.is_open = False
+        self.__board = None
+
+    def open(self):
+        board = self.bus.boards.get(self.port)
+        if board is None or not board.plugged:
+            raise SerialException("could not open port {}: No such file or directory".format(self.port))
+        self.__board = board
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        self.__board = None
+
+    def write(self, data):
+        board = self.__check_open()
+        size = len(data)
+        if self.bus.latency:
+            time.sleep(self.bus.latency)
+        if self.bus.drop_rate:
+            data = bytes(b for b in data if self.bus.random.random() >= self.bus.drop_rate)
+        if not board.plugged:
+            raise SerialTimeoutException("Write timeout")
+        board.receive(data)
+        return size
+
+    def read(self, size=1):
+        board = self.__check_open()
+        if self.bus.latency:
+            time.sleep(self.bus.latency)
+        data = board.send(size, self.timeout)
+        if not board.plugged:
+            raise SerialException("device reports readiness to read but returned no data "
+                                  "(device disconnected or multiple access on port?)")
+        return data
+
+    def __check_open(self):
+        if not self.is_open:
+            raise SerialException("Attempting to use a port that is not open")
+        return self.__board
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import sys
+import threading
+
+from engine.engine import ControlMode
+
+
+class ApiServer:
+    """
+    Local control API of SessionEngine
+    Protocol: JSON lines over Unix socket or localhost TCP port
+    Request: {"id": any, "op": str, ...args}, or list of requests (batch) - answered by list
+    Response: {"id": any, "ok": true, "result": ...} or {"id": any, "ok": false, "error": str}
+    After {"op": "subscribe"} engine events pushed as {"event": str, "channel": int or null, "data": dict}
+    Server works in own thread with asyncio loop, engine events serialized once for all subscribers
+    """
+
+    # Engine events not pushed to subscribers
+    PRIVATE_EVENTS = ("deadlines",)
+    # Max not sent bytes of subscriber, slower subscribers disconnected
+    MAX_BUFFER = 1024 * 1024
+    # Max request line length
+    MAX_LINE = 1024 * 1024
+
+    def __init__(self, engine, address):
+        """
+        :param engine  SessionEngine
+        :param address  Port number on localhost or Unix socket path
+        """
+        self.engine = engine
+        self.address = address
+        self.loop = None
+        self.__server = None
+        self.__thread = None
+        self.__started = threading.Event()
+        # Writers of connected and subscribed clients
+        self.__clients = set()
+        self.__subscribers = set()
+        self.__ops = {
+            "status": self.__status,
+            "tariffs": lambda r: self.engine.tariffs(),
+            "start": lambda r: self.__channel_op(self.engine.start, r),
+            "pause": lambda r: self.__channel_op(self.engine.pause, r),
+            "resume": lambda r: self.__channel_op(self.engine.resume, r),
+            "stop": lambda r: self.__channel_op(self.engine.stop, r),
+            "stop_all": self.__stop_all,
+            "add_time": lambda r: self.__channel_op(self.engine.add_time, r, int(r["seconds"]), r.get("cash")),
+            "set_time": lambda r: self.__channel_op(self.engine.set_time, r, int(r["seconds"])),
+            "set_cash": lambda r: self.__channel_op(self.engine.set_cash, r, r["cash"]),
+            "set_mode": lambda r: self.__channel_op(self.engine.set_mode, r, ControlMode[r["mode"]]),
+            "set_tariff": lambda r: self.__channel_op(self.engine.set_tariff, r, r["tariff"]),
+            "switch": self.__switch,
+        }
+
+    @staticmethod
+    def parse_address(text):
+        """
+        :param text  "port", "host:port" or Unix socket path
+        :return: int port, (host, port) or path
+        """
+        if text.isdigit():
+            return int(text)
+        host, sep, port = text.rpartition(":")
+        if sep and port.isdigit() and "/" not in text:
+            return host, int(port)
+        return text
+
+    def start(self):
+        """Start server thread, returns when server listening"""
+        self.__thread = threading.Thread(target=self.__run, name="ApiServer", daemon=True)
+        self.__thread.start()
+        self.__started.wait()
+        if self.__server is None:
+            raise OSError("API server not started on {}".format(self.address))
+        self.engine.add_listener(self.__engine_event)
+
+    def stop(self):
+        self.engine.remove_listener(self.__engine_event)
+        if self.loop and self.__thread:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.__thread.join()
+            self.__thread = None
+
+    def subscribers(self):
+        return len(self.__subscribers)
+
+    def __run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.__server = self.loop.run_until_complete(self.__listen())
+            print("ApiServer: listening on", self.address)
+        except Exception as e:
+            print("ApiServer: can't listen on {}: {}".format(self.address, e), file=sys.stderr)
+            self.__started.set()
+            return
+        self.__started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.__server.close()
+            # Disconnect clients, clients handlers finished by EOF
+            for writer in list(self.__clients):
+                writer.close()
+            tasks = asyncio.all_tasks(self.loop)
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.__server.wait_closed())
+            self.loop.close()
+            if isinstance(self.address, str):
+                self.__remove_socket()
+
+    async def __listen(self):
+        if isinstance(self.address, int):
+            return await asyncio.start_server(self.__client, "127.0.0.1", self.address, limit=ApiServer.MAX_LINE)
+        if isinstance(self.address, tuple):
+            return await asyncio.start_server(self.__client, *self.address, limit=ApiServer.MAX_LINE)
+        self.__remove_socket()
+        return await asyncio.start_unix_server(self.__client, self.address, limit=ApiServer.MAX_LINE)
+
+    def __remove_socket(self):
+        try:
+            os.unlink(self.address)
+        except FileNotFoundError:
+            pass
+
+    async def __client(self, reader, writer):
+        self.__clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                writer.write(self.__handle_line(line, writer))
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+            print("ApiServer: client error:", e, file=sys.stderr)
+        finally:
+            self.__clients.discard(writer)
+            self.__subscribers.discard(writer)
+            writer.close()
+
+    def __handle_line(self, line, writer):
+        """Handle request line, :return: response line (bytes)"""
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError as e:
+            return ApiServer.__dump({"id": None, "ok": False, "error": "Wrong JSON: {}".format(e)})
+        if isinstance(request, list):
+            # Batch, relays switched at once
+            with self.engine.switch_batch():
+                response = [self.__handle(r, writer) for r in request]
+        else:
+            response = self.__handle(request, writer)
+        return ApiServer.__dump(response)
+
+    def __handle(self, request, writer):
+        if not isinstance(request, dict):
+            return {"id": None, "ok": False, "error": "Request must be object"}
+        rid = request.get("id")
+        op = request.get("op")
+        try:
+            if op == "subscribe":
+                self.__subscribers.add(writer)
+                result = True
+            elif op == "unsubscribe":
+                self.__subscribers.discard(writer)
+                result = True
+            elif op in self.__ops:
+                result = self.__ops[op](request)
+            else:
+                return {"id": rid, "ok": False, "error": "Unknown op: {}".format(op)}
+        except (KeyError, IndexError, ValueError, TypeError) as e:
+            return {"id": rid, "ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+        except Exception as e:
+            # Error in engine or plugin, client stays connected
+            print("ApiServer: op {}: {}: {}".format(op, type(e).__name__, e), file=sys.stderr)
+            return {"id": rid, "ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+        return {"id": rid, "ok": True, "result": result}
+
+    def __channel(self, request):
+        channel = int(request["channel"])
+        if not 0 <= channel < len(self.engine.channels):
+            raise IndexError("No channel {}".format(channel))
+        return channel
+
+    def __channel_op(self, op, request, *args):
+        """Call engine operation on channel, :return: channel status"""
+        channel = self.__channel(request)
+        op(channel, *args)
+        return self.engine.status(channel)
+
+    def __status(self, request):
+        if "channel" in request:
+            return self.engine.status(self.__channel(request))
+        return self.engine.status()
+
+    def __stop_all(self, request):
+        self.engine.stop_all()
+        return self.engine.status()
+
+    def __switch(self, request):
+        """Switch relay without session, like PTBasePlugin.switch()"""
+        self.engine.switch(self.__channel(request), bool(request["state"]))
+        return True
+
+    def __engine_event(self, event, channel, data):
+        """Engine listener, called in engine or UI thread"""
+        if event in ApiServer.PRIVATE_EVENTS or not self.__subscribers:
+            return
+        if event == "switch_result":
+            data = {"plugin": data["plugin"].get_info()["plugin_name"], "plugin_channel": data["plugin_channel"],
+                    "state": data["state"],
+                    "error": data["error"] and str(data["error"])}
+        line = ApiServer.__dump({"event": event, "channel": channel, "data": data})
+        self.loop.call_soon_threadsafe(self.__broadcast, line)
+
+    def __broadcast(self, line):
+        for writer in list(self.__subscribers):
+            if writer.transport.is_closing():
+                self.__subscribers.discard(writer)
+            elif writer.transport.get_write_buffer_size() > ApiServer.MAX_BUFFER:
+                print("ApiServer: slow subscriber disconnected", file=sys.stderr)
+                self.__subscribers.discard(writer)
+                writer.close()
+            else:
+                writer.write(line)
+
+    @staticmethod
+    def __dump(obj):
+        return (json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
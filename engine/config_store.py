@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import threading
+import time
+
+from engine.metrics import timed
+
+
+def config_text(config):
+    """ConfigParser as text"""
+    buf = io.StringIO()
+    config.write(buf)
+    return buf.getvalue()
+
+
+@timed("write_config")
+def write_config_text(text, filename):
+    """
+    Write config file atomically: temp file, fsync, rename over old file,
+    so crash while writing never leaves partial file
+    """
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+class ConfigStore:
+    """
+    Debounced background saving of ConfigParser
+    save() serializes config in caller thread (config not shared with writer thread),
+    writer thread writes last saved text after DELAY without new saves,
+    so bursts of changes written once
+    """
+
+    # Quiet time before writing (seconds)
+    DELAY = 1.0
+
+    def __init__(self, config, filename, delay=DELAY):
+        """
+        :param config  ConfigParser
+        :param filename  Config file
+        :param delay  Quiet time before writing (seconds)
+        """
+        self.config = config
+        self.filename = filename
+        self.delay = delay
+        # Text waiting for write and time of last save()
+        self.__pending = None
+        self.__saved_at = 0.0
+        self.__written = None
+        self.__closed = False
+        self.__cond = threading.Condition()
+        self.__writer = threading.Thread(target=self.__write_loop, name="ConfigStore", daemon=True)
+        self.__writer.start()
+
+    def save(self):
+        """Schedule config writing, returns immediately"""
+        text = config_text(self.config)
+        with self.__cond:
+            if text == self.__written and self.__pending is None:
+                # Nothing changed
+                return
+            self.__pending = text
+            self.__saved_at = time.monotonic()
+            self.__cond.notify_all()
+
+    def flush(self):
+        """Write pending changes now and wait for it"""
+        with self.__cond:
+            self.__saved_at = 0.0
+            self.__cond.notify_all()
+            self.__cond.wait_for(lambda: self.__pending is None or not self.__writer.is_alive())
+
+    def close(self):
+        """Write pending changes and stop writer thread"""
+        with self.__cond:
+            self.__closed = True
+            self.__saved_at = 0.0
+            self.__cond.notify_all()
+        self.__writer.join()
+
+    def __write_loop(self):
+        while True:
+            with self.__cond:
+                while self.__pending is None and not self.__closed:
+                    self.__cond.wait()
+                if self.__pending is None:
+                    return
+                # Wait quiet time after last save()
+                delay = self.__saved_at + self.delay - time.monotonic()
+                if delay > 0 and not self.__closed:
+                    self.__cond.wait(delay)
+                    continue
+                text = self.__pending
+            written = text
+            try:
+                write_config_text(text, self.filename)
+                print("Config writen")
+            except Exception as e:
+                # Changes written with next save()
+                print("ConfigStore: can't write {}: {}".format(self.filename, e), file=sys.stderr)
+                written = None
+            with self.__cond:
+                self.__written = written
+                if self.__pending is text:
+                    self.__pending = None
+                self.__cond.notify_all()
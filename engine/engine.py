@@ -0,0 +1,706 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import enum
+import sys
+import threading
+import time
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import pt
+from engine.expiry import ExpiryQueue
+from engine.config_store import ConfigStore
+from engine.journal import SessionJournal
+from engine.metrics import METRICS
+from engine.money import Money, Rate
+from engine.plugin_host import RemotePlugin
+from engine.plugin_registry import PluginManifest, LazyPlugin
+from engine.recovery import SessionRecovery
+from engine.routing import ChannelRegistry
+from engine.session import Session
+from engine.tariffs import Tariff, TariffTable
+
+
+class ControlMode(enum.Enum):
+    """Enumeration for control modes"""
+    # Control modes:
+    # FREE - work max to 24 hours
+    # CASH - calculate time by taked cash
+    # TIME - calculating time
+    TIME = 0
+    CASH = 1
+    FREE = 2
+
+
+class Channel:
+    """State of one switchable channel"""
+
+    # Compact: channels of large installations kept for all time of app
+    __slots__ = ("number", "mode", "tariff", "price", "rate", "session", "preset", "paid", "info")
+
+    def __init__(self, number, tariff="", price=80):
+        """
+        :param number  Channel number (from 0)
+        :param tariff  Tariff name
+        :param price  Price by hour
+        """
+        self.number = number
+        self.mode = ControlMode.FREE
+        self.tariff = tariff
+        self.price = price
+        # Exact time/cash conversion by price
+        self.rate = Rate(price)
+        # Timekeeping of current session, not started while channel stopped
+        self.session = Session()
+        # Time set in stopped channel (seconds)
+        self.preset = 0
+        # Cash paid for session in CASH mode (Money), None - time paid
+        self.paid = None
+        # Plugin, device and local channel of this channel (text)
+        self.info = ""
+
+    def stopped(self):
+        return not self.session.started() or self.session.stopped_at is not None
+
+    def paused(self):
+        return self.session.paused()
+
+    def time(self):
+        """Remaining time in paid session, elapsed in free session, or time set while stopped"""
+        if self.session.started():
+            return self.session.time()
+        return self.preset
+
+    def set_price(self, price, rate=None):
+        """
+        Price by hour, fixed for session on start
+        :param rate  Precomputed Rate of price, by default created
+        """
+        self.price = price
+        self.rate = rate or Rate(price)
+
+    def cash(self):
+        """
+        Cost of time() (Money)
+        Paid cash counted down in proportion to paid time, so cash is exactly paid at start and 0 on time out
+        """
+        if self.paid is None:
+            return self.rate.cash(self.time())
+        limit = self.session.limit or self.preset
+        if not limit:
+            return Money(0)
+        return Money((self.paid * self.time() + limit // 2) // limit)
+
+    def charged(self):
+        """Cost of session elapsed time (Money)"""
+        elapsed = round(self.session.elapsed())
+        limit = self.session.limit
+        if self.paid is None or not limit:
+            return self.rate.cash(elapsed)
+        remaining = max(0, limit - elapsed)
+        return self.paid - (self.paid * remaining + limit // 2) // limit
+
+    def session_time(self):
+        """All time on current session for audit"""
+        if self.session.limit is None:
+            return int(self.session.elapsed())
+        return self.session.limit
+
+    def state(self):
+        """Channel state for journal, API and UI"""
+        return {
+            "mode": self.mode.name,
+            "tariff": self.tariff,
+            "price": self.price,
+            "paid": None if self.paid is None else self.paid.to_float(),
+            "time": self.time(),
+            "stopped": self.stopped(),
+            "paused": self.paused(),
+            "limit": self.session.limit,
+            "elapsed": round(self.session.elapsed(), 1),
+            "started": self.session.start_time and round(self.session.start_time, 3)
+        }
+
+
+class SessionEngine:
+    """
+    Headless session engine: channels, modes, tariffs, expiry, journal and relays switching
+    All operations thread safe, changes reported to listeners
+    UI (or any other front-end) is a client of engine
+    """
+
+    # Max time can be set on channel (seconds)
+    MAX_TIME = Session.MAX_TIME
+    # Interval of metrics file writing (seconds)
+    METRICS_INTERVAL = 10
+
+    def __init__(self, config, clock=time.monotonic, config_file=pt.MAIN_CONF_FILE):
+        """
+        :param config  Main ConfigParser
+        :param clock  Monotonic clock function, same as sessions clock
+        :param config_file  File of main config
+        """
+        self.config = config
+        # Config changes saved in background
+        self.config_store = ConfigStore(config, config_file)
+        # Tariffs, replaced on reload_tariffs()
+        self.tariff_table = TariffTable.from_config(config)
+        # Tariff prices and minute of week of last update_prices()
+        self.__tariff_prices = self.tariff_table.prices()
+        self.__prices_minute = None
+        self.clock = clock
+        self.lock = threading.RLock()
+        # Loaded plugins instances
+        self.plugins = []
+        self.channels = []
+        # Channels routing to plugins and devices
+        self.registry = ChannelRegistry()
+        self.expiry = ExpiryQueue()
+        self.journal = SessionJournal(pt.journal_dir(config))
+        self.recovery = SessionRecovery(self.journal)
+        # Sessions active before shutdown: {channel: last journal record, ...}
+        self.recovered = {}
+        self.__listeners = []
+        # Collected switches in switch_batch(): {channel: state, ...}
+        self.__switch_batch = None
+        self.__wakeup = threading.Condition(self.lock)
+        self.__running = False
+        # Metrics: enabled by "metrics" in [Main], dumped to "metrics_file" in Prometheus format
+        self.metrics_file = config.get(pt.APP_MAIN_SECTION, "metrics_file", fallback="")
+        METRICS.enabled = config.getboolean(pt.APP_MAIN_SECTION, "metrics", fallback=False) or \
+            bool(self.metrics_file)
+
+    # Life cycle
+
+    def open(self):
+        """Open journal and load sessions active before shutdown"""
+        self.journal.open()
+        self.recovered = self.recovery.recover()
+
+    def close(self):
+        self.shutdown()
+        for p in self.plugins:
+            if isinstance(p, RemotePlugin):
+                p.close()
+        self.config_store.close()
+        self.journal.close()
+        self.recovery.checkpoint(wait=True)
+        if self.metrics_file:
+            METRICS.write(self.metrics_file)
+
+    def run_forever(self):
+        """Expire sessions by deadlines until shutdown(), for headless mode"""
+        metrics_written = self.clock()
+        with self.lock:
+            self.__running = True
+            while self.__running:
+                deadline = self.expiry.next_deadline()
+                timeout = 1.0 if deadline is None else min(1.0, max(0.0, deadline - self.clock()))
+                self.__wakeup.wait(timeout)
+                self.expire_due()
+                self.update_prices()
+                if self.metrics_file and self.clock() - metrics_written >= SessionEngine.METRICS_INTERVAL:
+                    metrics_written = self.clock()
+                    METRICS.write(self.metrics_file)
+
+    def shutdown(self):
+        with self.lock:
+            self.__running = False
+            self.__wakeup.notify_all()
+
+    # Listeners
+
+    def add_listener(self, listener):
+        """
+        Add listener of engine events, listener may be called from any thread
+        :param listener  Callable(event: str, channel: int or None, data: dict)
+        Events: start, pause, resume, add_time, add_cash, stop, restore, time_out, preset,
+                tariff, channels, deadlines, switch_result
+        """
+        self.__listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.__listeners:
+            self.__listeners.remove(listener)
+
+    def _notify(self, event, channel, data):
+        for listener in list(self.__listeners):
+            try:
+                listener(event, channel, data)
+            except Exception as e:
+                print("SessionEngine._notify():", e, file=sys.stderr)
+
+    def _session_event(self, ch, event, notify_event=None, **data):
+        """
+        Record session event in journal and notify listeners
+        :param notify_event  Event for listeners, by default same as journal event
+        """
+        state = ch.state()
+        state.update(data)
+        self.recovery.track(self.journal.record(ch.number, event, **state))
+        self._notify(notify_event or event, ch.number, state)
+
+    # Plugins
+
+    def load_plugins(self, plugin_classes=None):
+        """
+        Create plugins
+        By default plugins found by cached manifest, without import,
+        module imported and plugin created on activation or settings (LazyPlugin),
+        with "isolate_plugins" in [Main] each plugin works in own process (RemotePlugin)
+        :param plugin_classes  Plugin classes, instances created now
+        """
+        if plugin_classes is None:
+            isolate = self.config.getboolean(pt.APP_MAIN_SECTION, "isolate_plugins", fallback=False)
+            plugin_type = RemotePlugin if isolate else LazyPlugin
+            plugins = [plugin_type.from_entry(entry) for entry in PluginManifest().entries()]
+            print("load_plugins(): {} plugin(s) in manifest".format(len(plugins)))
+        else:
+            plugins = []
+            for plugin, plug_num in zip(plugin_classes, range(len(plugin_classes))):
+                print("load plugin:", plug_num, plugin.__name__)
+                plugins.append(plugin())
+        for p in plugins:
+            p.set_switch_listener(
+                lambda channel, state, error, p=p: self.__switch_done(p, channel, state, error)
+            )
+            self.plugins.append(p)
+        return self.plugins
+
+    @staticmethod
+    def run_async(func, *args):
+        """
+        Run func in own thread, for plugins calls which may hang (activation), caller never waits
+        :return: concurrent.futures.Future of func result
+        """
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="SessionEngine-async", daemon=True).start()
+        return future
+
+    def activated_plugins(self):
+        """Returned activated plugins list"""
+        return [p for p in self.plugins if p.get_info()["activated"]]
+
+    def activate_plugins_on_start(self):
+        """
+        Activates plugins marked in main.conf
+        :return: dict {plugin name: [error str, ...], ...} of failed or partially activated plugins
+        """
+        errors = {}
+        if not self.config.has_section(pt.PLUGINS_CONF_SECTION):
+            return errors
+        for plugin, active_state in self.config[pt.PLUGINS_CONF_SECTION].items():
+            if str(active_state).lower() != "true":
+                continue
+            for p in self.plugins:
+                if p.get_info()["plugin_name"] != plugin:
+                    continue
+                try:
+                    print("activate_plugins_on_start():", plugin)
+                    p.activate()
+                    # Partially activated
+                    for dev_name, error in p.activation_errors().items():
+                        errors.setdefault(plugin, []).append("{}: {}".format(dev_name, error))
+                except Exception as e:
+                    errors.setdefault(plugin, []).append(str(e))
+        return errors
+
+    def build_channels(self):
+        """
+        Build channels by activated plugins
+        Sessions on remaining channels kept, on removed channels stopped,
+        sessions active before shutdown restored, relays switched by channels states
+        """
+        with self.lock:
+            self.registry = ChannelRegistry.from_plugins(self.activated_plugins())
+            count = len(self.registry)
+            print("total channels:", count)
+
+            for ch in self.channels[count:]:
+                self.__stop(ch)
+            self.channels = self.channels[:count]
+            for number in range(len(self.channels), count):
+                self.channels.append(self.__new_channel(number))
+            for ch in self.channels:
+                ch.info = self.registry.route(ch.number).info()
+
+            self.restore_sessions()
+            self._notify("channels", None, {"count": count})
+            self.restore_switch_states()
+
+    def __new_channel(self, number):
+        table = self.tariff_table
+        ch = Channel(number)
+        option = "tariff-channel-" + str(number)
+        tariff = self.config.get(pt.TIMER_CONTROLS_SECTION, option, fallback=None)
+        if tariff not in table and len(table):
+            # First tariff
+            tariff = table.names()[0]
+        if tariff in table:
+            ch.tariff = tariff
+            ch.set_price(table.get(tariff).price_at(), table.get(tariff).rate_at())
+        return ch
+
+    # Tariffs
+
+    def tariffs(self):
+        """
+        Current prices of tariffs
+        :return: dict {name: price by hour, ...}
+        """
+        return self.tariff_table.prices()
+
+    def reload_tariffs(self):
+        """
+        Parse tariffs from config again and replace table,
+        running sessions keep their prices, stopped channels get new prices
+        """
+        table = TariffTable.from_config(self.config)
+        with self.lock:
+            self.tariff_table = table
+            self.__tariff_prices = table.prices()
+            for ch in self.channels:
+                if ch.stopped():
+                    self.__update_price(ch)
+            self._notify("tariffs", None, table.prices())
+
+    def update_prices(self, ts=None):
+        """
+        Time of day and weekday tariffs: new prices to stopped channels when tariff prices changed,
+        checked once in minute, cash preset keeps price it was paid by
+        :param ts  Wall time, default - now
+        """
+        if ts is None:
+            ts = time.time()
+        minute = Tariff.week_minute(ts)
+        with self.lock:
+            if minute == self.__prices_minute:
+                return
+            self.__prices_minute = minute
+            prices = self.tariff_table.prices(ts)
+            if prices == self.__tariff_prices:
+                return
+            self.__tariff_prices = prices
+            for ch in self.channels:
+                if ch.stopped() and ch.paid is None:
+                    price = ch.price
+                    self.__update_price(ch, ts)
+                    if ch.price != price:
+                        self._notify("tariff", ch.number, ch.state())
+            self._notify("tariffs", None, prices)
+
+    def __update_price(self, ch, ts=None):
+        """Price of channel tariff at wall time ts (default - now) to stopped channel"""
+        table = self.tariff_table
+        if ch.tariff not in table and len(table):
+            ch.tariff = table.names()[0]
+        tariff = table.get(ch.tariff)
+        if tariff:
+            ch.set_price(tariff.price_at(ts), tariff.rate_at(ts))
+
+    def set_tariff(self, channel, tariff):
+        """Set tariff on stopped channel"""
+        with self.lock:
+            ch = self.channels[channel]
+            if not ch.stopped() or tariff not in self.tariff_table or tariff == ch.tariff:
+                return
+            print("Channel:", channel, "tariff changed to:", tariff)
+            ch.tariff = tariff
+            self.__update_price(ch)
+            # Check admin tariff
+            if ch.price == 0:
+                ch.preset = 0
+            # Save tariff to config
+            if not self.config.has_section(pt.TIMER_CONTROLS_SECTION):
+                self.config.add_section(pt.TIMER_CONTROLS_SECTION)
+            self.config[pt.TIMER_CONTROLS_SECTION]["tariff-channel-" + str(channel)] = tariff
+            self.config_store.save()
+            self._notify("tariff", channel, ch.state())
+
+    # Sessions
+
+    def set_mode(self, channel, mode):
+        """Set control mode of stopped channel"""
+        with self.lock:
+            ch = self.channels[channel]
+            if ch.stopped() and ch.mode != mode:
+                ch.mode = mode
+                if mode != ControlMode.CASH:
+                    ch.paid = None
+                self._notify("preset", channel, ch.state())
+
+    def set_time(self, channel, seconds):
+        """Set time of stopped channel (seconds)"""
+        with self.lock:
+            ch = self.channels[channel]
+            if not ch.stopped():
+                return
+            self.__update_price(ch)
+            ch.preset = max(0, min(int(seconds), SessionEngine.MAX_TIME))
+            ch.paid = None
+            self._notify("preset", channel, ch.state())
+
+    def set_cash(self, channel, cash):
+        """
+        Set paid cash of stopped channel, time calculated by current price
+        :param cash  Money or float hryvnias
+        """
+        with self.lock:
+            ch = self.channels[channel]
+            if not ch.stopped():
+                return
+            self.__update_price(ch)
+            cash = Money.from_float(cash)
+            if not cash or not ch.price:
+                ch.paid, ch.preset = None, 0
+            else:
+                ch.mode = ControlMode.CASH
+                ch.paid = max(Money(0), min(cash, ch.rate.cash(SessionEngine.MAX_TIME - 1)))
+                ch.preset = ch.rate.seconds(ch.paid)
+            self._notify("preset", channel, ch.state())
+
+    def start(self, channel):
+        """Start session on stopped channel, paused session resumed"""
+        with self.lock:
+            ch = self.channels[channel]
+            if ch.paused():
+                self.resume(channel)
+                return
+            if not ch.stopped():
+                return
+            if ch.preset == 0:
+                ch.mode = ControlMode.FREE
+            if ch.mode != ControlMode.CASH:
+                ch.paid = None
+                # Price by time of day at session start, cash preset keeps price it was paid by
+                self.__update_price(ch)
+            ch.session = Session(None if ch.mode == ControlMode.FREE else ch.preset, self.clock)
+            ch.session.start()
+            self.__schedule(ch)
+            self.switch(channel, True)
+            self._session_event(ch, "start")
+
+    def pause(self, channel):
+        with self.lock:
+            ch = self.channels[channel]
+            if not ch.session.running():
+                return
+            ch.session.pause()
+            self.__schedule(ch)
+            self.switch(channel, False)
+            self._session_event(ch, "pause")
+
+    def resume(self, channel):
+        with self.lock:
+            ch = self.channels[channel]
+            if not ch.paused():
+                return
+            ch.session.resume()
+            self.__schedule(ch)
+            self.switch(channel, True)
+            self._session_event(ch, "resume")
+
+    def toggle(self, channel):
+        """Start / pause / resume channel, like start button"""
+        with self.lock:
+            if self.channels[channel].session.running():
+                self.pause(channel)
+            else:
+                self.start(channel)
+
+    def stop(self, channel):
+        with self.lock:
+            self.__stop(self.channels[channel])
+
+    def stop_all(self):
+        """Stop sessions on all channels, relays switched at once"""
+        with self.lock, self.switch_batch():
+            for ch in self.channels:
+                self.__stop(ch)
+
+    def __stop(self, ch, reason=None):
+        """
+        :param reason  None - stopped by user, "time_out" - session time is up
+        """
+        if ch.stopped():
+            return
+        ch.session.stop()
+        self.__schedule(ch)
+        self.switch(ch.number, False)
+        data = {"charged": ch.charged().to_float()}
+        if reason:
+            data["reason"] = reason
+        self._session_event(ch, "stop", reason, **data)
+        # Set default mode to FREE
+        ch.mode = ControlMode.FREE
+        ch.session = Session()
+        ch.preset = 0
+        ch.paid = None
+        self.__update_price(ch)
+
+    def add_time(self, channel, seconds, cash=None):
+        """
+        Add paid time to running session
+        :param seconds  Added time
+        :param cash  Paid cash (Money or float hryvnias), by default calculated by price
+        """
+        # Wrong cash rejected before session changed
+        cash = None if cash is None else Money.from_float(cash)
+        with self.lock:
+            ch = self.channels[channel]
+            if ch.stopped() or ch.mode == ControlMode.FREE:
+                return
+            old_time = ch.session_time()
+            ch.session.add_time(seconds)
+            self.__schedule(ch)
+            if cash is None:
+                cash = ch.rate.cash(seconds)
+            if ch.paid is not None:
+                ch.paid += cash
+            event = "add_cash" if ch.mode == ControlMode.CASH else "add_time"
+            self._session_event(ch, event, added_time=seconds, added_cash=cash.to_float(),
+                                old_time=old_time, new_time=ch.session_time())
+
+    def restore_sessions(self):
+        """Continue sessions active before shutdown on existing channels"""
+        with self.lock:
+            for ch in self.channels:
+                record = self.recovered.pop(ch.number, None)
+                if not record or not ch.stopped():
+                    continue
+                session = SessionRecovery.restore_session(record)
+                if not session:
+                    # Time is up while app not worked, session closed with all paid time used
+                    used = Session.MAX_TIME if record["limit"] is None else record["limit"]
+                    self.recovery.track(self.journal.record(
+                        ch.number, "stop", mode=record["mode"], tariff=record["tariff"], price=record["price"],
+                        time=0, paused=False, limit=record["limit"], elapsed=used, started=record.get("started"),
+                        charged=Rate(record["price"]).cash(round(used)).to_float(), reason="expired_on_downtime"
+                    ))
+                    continue
+                ch.mode = ControlMode[record["mode"]]
+                ch.tariff = record["tariff"]
+                ch.set_price(record["price"])
+                ch.paid = None if record.get("paid") is None else Money.from_float(record["paid"])
+                ch.session = session
+                self.__schedule(ch)
+                self._session_event(ch, "restore")
+                print("restore_sessions(): channel", ch.number + 1, "restored")
+
+    # Expiry
+
+    def __schedule(self, ch):
+        """Update channel deadline"""
+        deadline = ch.session.deadline()
+        if deadline is None:
+            self.expiry.cancel(ch.number)
+        else:
+            self.expiry.schedule(ch.number, deadline)
+        self.__wakeup.notify_all()
+        self._notify("deadlines", None, {"next": self.expiry.next_deadline()})
+
+    def next_deadline(self):
+        with self.lock:
+            return self.expiry.next_deadline()
+
+    def expire_due(self, now=None):
+        """
+        Stop sessions with reached deadlines, relays switched at once
+        :return: list of expired channels numbers
+        """
+        with self.lock, self.switch_batch():
+            due = self.expiry.pop_due(self.clock() if now is None else now)
+            for number in due:
+                if number < len(self.channels):
+                    self.__stop(self.channels[number], "time_out")
+            return due
+
+    # Relays switching
+
+    @contextmanager
+    def switch_batch(self):
+        """
+        Collect switches and send them at once on exit, one call for each plugin,
+        plugin merges switches of device into one write
+        """
+        with self.lock:
+            if self.__switch_batch is not None:
+                # Already in batch
+                yield
+                return
+            self.__switch_batch = {}
+            try:
+                yield
+            finally:
+                batch, self.__switch_batch = self.__switch_batch, None
+                if batch:
+                    self.__switch_many(batch)
+
+    def __switch_many(self, batch):
+        try:
+            by_plugin = self.registry.group(batch)
+        except IndexError as e:
+            print("switch_batch():", e)
+            return
+        for plugin, changes in by_plugin.items():
+            try:
+                plugin.switch_many(changes)
+            except Exception as e:
+                # Other plugins switched
+                print("switch_batch():", plugin.get_info()["plugin_name"], e)
+                for plugin_channel, state in changes.items():
+                    self.__switch_done(plugin, plugin_channel, state, e)
+
+    def switch(self, channel, state: bool):
+        with self.lock:
+            if self.__switch_batch is not None:
+                self.__switch_batch[channel] = state
+                return
+            try:
+                route = self.registry.route(channel)
+            except IndexError as e:
+                # Channel without plugin, nothing to switch
+                print("switch():", e)
+                return
+            try:
+                route.plugin.switch(route.plugin_channel, state)
+            except Exception as e:
+                print("switch():", route.plugin.get_info()["plugin_name"], e)
+                self.__switch_done(route.plugin, route.plugin_channel, state, e)
+
+    def __switch_done(self, plugin, plugin_channel, state, error):
+        """Result of switching from plugin, may be called from plugin I/O thread"""
+        channel = self.registry.channel_of(plugin, plugin_channel)
+        self._notify("switch_result", channel, {
+            "plugin": plugin, "plugin_channel": plugin_channel, "state": state, "error": error
+        })
+
+    def restore_switch_states(self):
+        """Switch all channels by channels states, relays state unknown after start or activation"""
+        with self.lock:
+            if not self.activated_plugins():
+                return
+            with self.switch_batch():
+                for ch in self.channels:
+                    self.switch(ch.number, ch.session.running())
+
+    def status(self, channel=None):
+        """
+        :return: state dict of channel or list of states of all channels
+        """
+        with self.lock:
+            if channel is not None:
+                ch = self.channels[channel]
+                return dict(ch.state(), channel=channel, cash=ch.cash().to_float())
+            return [dict(ch.state(), channel=ch.number, cash=ch.cash().to_float()) for ch in self.channels]
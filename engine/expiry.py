@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+
+
+class ExpiryQueue:
+    """
+    Priority queue of sessions deadlines
+    Heap of [deadline, seq, key], rescheduled or canceled entries
+    only marked as removed and dropped when reach top of heap
+    """
+
+    def __init__(self):
+        self.__heap = []
+        # Actual entries: {key: [deadline, seq, key], ...}
+        self.__entries = {}
+        self.__seq = itertools.count()
+
+    def schedule(self, key, deadline):
+        """
+        Set deadline for key, previous deadline of key canceled
+        :param key  Hashable session key (channel, control, ...)
+        :param deadline  Clock value of expiry
+        """
+        self.cancel(key)
+        entry = [deadline, next(self.__seq), key]
+        self.__entries[key] = entry
+        heapq.heappush(self.__heap, entry)
+
+    def cancel(self, key):
+        entry = self.__entries.pop(key, None)
+        if entry:
+            # Mark removed
+            entry[2] = None
+
+    def deadline(self, key):
+        """Deadline of key or None"""
+        entry = self.__entries.get(key)
+        return entry[0] if entry else None
+
+    def next_deadline(self):
+        """Nearest deadline or None if queue empty"""
+        heap = self.__heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_due(self, now):
+        """
+        Remove and return keys with deadline <= now, nearest first
+        :return: list [key, ...]
+        """
+        due = []
+        heap = self.__heap
+        while heap and (heap[0][2] is None or heap[0][0] <= now):
+            entry = heapq.heappop(heap)
+            key = entry[2]
+            if key is not None:
+                del self.__entries[key]
+                due.append(key)
+        return due
+
+    def __len__(self):
+        return len(self.__entries)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from engine.metrics import METRICS
+
+class SessionJournal:
+    """
+    Append-only journal (write-ahead log) of sessions events
+    Records stored as JSON lines in segment files "journal-<first seq>.log",
+    written and fsync'ed by background thread in batches,
+    so record() never waits for disk
+    Batch failed on write (disk full, I/O error) kept and written again before new records,
+    records written before error repeated in journal and skipped on replay
+    """
+
+    # Segment file name format, number is seq of first record in segment
+    SEGMENT_NAME = "journal-{:010d}.log"
+    # Max segment size (bytes), after it new segment started
+    SEGMENT_SIZE = 4 * 1024 * 1024
+    # Max records written by one fsync
+    BATCH_SIZE = 1000
+    # Pause before writing failed batch again (seconds)
+    RETRY_DELAY = 1.0
+    # Attempts to write failed batch on close()
+    CLOSE_RETRIES = 3
+
+    def __init__(self, directory="journal"):
+        """
+        Create journal, open() must be called before recording
+        :param directory  Journal segments dir
+        """
+        self.directory = directory
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__seq = 0
+        self.__writer = None
+        self.__file = None
+        # Last write error, None when all records written
+        self.error = None
+
+    def open(self):
+        """Open journal for append, continue seq of existing records"""
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self.segments()
+        if segments:
+            self.__truncate_torn_line(segments[-1])
+            for record in self.__read_segment(segments[-1]):
+                self.__seq = record["seq"]
+            self.__file = open(segments[-1], "a", encoding="utf-8")
+        self.__writer = threading.Thread(target=self.__write_loop, name="SessionJournal", daemon=True)
+        self.__writer.start()
+
+    def close(self):
+        """Write all recorded events and close journal"""
+        if self.__writer:
+            self.__queue.put(None)
+            self.__writer.join()
+            self.__writer = None
+
+    def record(self, channel, event, **data):
+        """
+        Append event to journal, returns immediately
+        :param channel  Channel number
+        :param event  Event name: start, pause, resume, add_time, add_cash, stop, ...
+        :param data  Event data, JSON serializable values
+        :return: record dict {seq: int, ts: wall time, ch: channel, ev: event, **data}
+        """
+        with self.__lock:
+            self.__seq += 1
+            record = {"seq": self.__seq, "ts": round(time.time(), 3), "ch": channel, "ev": event}
+            record.update(data)
+            self.__queue.put(record)
+            return record
+
+    def last_seq(self):
+        return self.__seq
+
+    def segments(self):
+        """Segments files paths in order of records"""
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith("journal-") and n.endswith(".log"))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def replay(self, after_seq=0):
+        """
+        Read recorded events
+        :param after_seq  Skip records with seq <= after_seq
+        :return: generator of records dicts, in order of seq
+        """
+        last_seq = after_seq
+        segments = self.segments()
+        for i, path in enumerate(segments):
+            # Skip segments where all records before after_seq
+            if i + 1 < len(segments) and self.__segment_first_seq(segments[i + 1]) <= after_seq + 1:
+                continue
+            for record in self.__read_segment(path):
+                # Records written again after write error skipped
+                if record["seq"] > last_seq:
+                    last_seq = record["seq"]
+                    yield record
+
+    @staticmethod
+    def __segment_first_seq(path):
+        return int(os.path.basename(path)[len("journal-"):-len(".log")])
+
+    @staticmethod
+    def __truncate_torn_line(path, chunk_size=64 * 1024):
+        """
+        Cut line not completely written on crash from end of segment,
+        else next appended record joins it and both lines lost
+        """
+        with open(path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(0, end - chunk_size)
+                f.seek(start)
+                chunk = f.read(end - start)
+                pos = chunk.rfind(b"\n")
+                if pos >= 0:
+                    end = start + pos + 1
+                    break
+                end = start
+            if end < size:
+                print("SessionJournal.open(): {} bytes of torn line cut from {}".format(size - end, path),
+                      file=sys.stderr)
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def __read_segment(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Line not completely written on crash
+                    continue
+
+    def __write_loop(self):
+        stop = False
+        # Records of failed batch, written again with new records
+        failed = []
+        retries = 0
+        while not stop or (failed and retries < SessionJournal.CLOSE_RETRIES):
+            if stop:
+                # Closing, all records in failed batch
+                retries += 1
+                time.sleep(SessionJournal.RETRY_DELAY)
+                batch = []
+            else:
+                try:
+                    batch = [self.__queue.get(timeout=SessionJournal.RETRY_DELAY if failed else None)]
+                except queue.Empty:
+                    batch = []
+                # Records collected while previous batch was writing
+                while len(batch) < SessionJournal.BATCH_SIZE:
+                    try:
+                        batch.append(self.__queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in batch:
+                    stop = True
+                    batch = [r for r in batch if r is not None]
+            batch = failed + batch
+            try:
+                self.__write_batch(batch)
+                failed = []
+                self.error = None
+            except Exception as e:
+                if not failed:
+                    print("SessionJournal.__write_loop(): {}, {} record(s) kept for retry".format(e, len(batch)),
+                          file=sys.stderr)
+                METRICS.count("journal_write_errors")
+                self.error = e
+                failed = batch
+                self.__close_file()
+        if failed:
+            print("SessionJournal.close(): {} record(s) not written: {}".format(len(failed), self.error),
+                  file=sys.stderr)
+        self.__close_file()
+
+    def __close_file(self):
+        """Close segment, after write error segment opened again by next batch"""
+        if self.__file:
+            try:
+                self.__file.close()
+            except OSError as e:
+                print("SessionJournal.__close_file():", e, file=sys.stderr)
+            self.__file = None
+
+    def __write_batch(self, batch):
+        if not batch:
+            return
+        for record in batch:
+            if self.__file is None or self.__file.tell() >= SessionJournal.SEGMENT_SIZE:
+                self.__rotate(record["seq"])
+            self.__file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    def __rotate(self, first_seq):
+        """Start new segment from record with first_seq"""
+        if self.__file:
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__file.close()
+        path = os.path.join(self.directory, SessionJournal.SEGMENT_NAME.format(first_seq))
+        if os.path.exists(path):
+            # Segment of failed batch, record written partly cut
+            self.__truncate_torn_line(path)
+        self.__file = open(path, "a", encoding="utf-8")
+
+
+def test():
+    """
+    Regression checks: record after torn last line (crash in write) is not lost,
+    batch failed on write written again, records not repeated on replay
+    """
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        journal = SessionJournal(directory)
+        journal.open()
+        for i in range(3):
+            journal.record(0, "start", time=60)
+        journal.close()
+        with open(journal.segments()[-1], "a", encoding="utf-8") as f:
+            f.write('{"seq":4,"ts":1.0,"ch":0,"ev":"st')
+
+        journal = SessionJournal(directory)
+        journal.open()
+        journal.record(0, "stop", charged=12.5)
+        journal.close()
+        records = list(journal.replay())
+        assert len(records) == 4, records
+        assert [r["seq"] for r in records] == [1, 2, 3, 4], records
+        assert records[-1]["ev"] == "stop" and records[-1]["charged"] == 12.5, records
+
+        # Disk error on fsync of next batch: lines of batch are in file, batch written again
+        fsync, failures = os.fsync, [OSError(28, "No space left on device")]
+
+        def failing_fsync(fd):
+            if failures:
+                raise failures.pop()
+            fsync(fd)
+
+        SessionJournal.RETRY_DELAY = 0.05
+        os.fsync = failing_fsync
+        try:
+            journal = SessionJournal(directory)
+            journal.open()
+            for i in range(3):
+                journal.record(1, "pause")
+            journal.close()
+        finally:
+            os.fsync = fsync
+        assert journal.error is None, journal.error
+        records = list(journal.replay())
+        assert len(records) == 7, records
+        assert [r["seq"] for r in records] == list(range(1, 8)), records
+        assert list(r["seq"] for r in journal.replay(after_seq=5)) == [6, 7]
+    print("SessionJournal: OK")
+
+
+if __name__ == "__main__":
+    test()
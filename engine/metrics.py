@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect
+import functools
+import os
+import sys
+import threading
+import time
+
+
+class Histogram:
+    """Latency histogram with fixed buckets (seconds)"""
+
+    # Upper bounds of buckets (seconds), last bucket - +Inf
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(Histogram.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(Histogram.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of bucket with q-quantile (seconds), max for last bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(Histogram.BUCKETS, self.counts):
+            total += count
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """
+    Counters and latency histograms of hot paths
+    Disabled by default, disabled timed() functions cost one attribute check
+    """
+
+    # Prefix of metrics names in Prometheus dump
+    PREFIX = "pt_"
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = {}
+        self.histograms = {}
+        self.__lock = threading.Lock()
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.__lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def reset(self):
+        with self.__lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def snapshot(self):
+        """
+        Current values for status view
+        :return: list [(name, count, avg ms, p99 ms, max ms), ...] sorted by name, counters without latency
+        """
+        rows = []
+        with self.__lock:
+            for name, h in self.histograms.items():
+                rows.append((name, h.count, h.sum / h.count * 1000 if h.count else 0.0,
+                             h.quantile(0.99) * 1000, h.max * 1000))
+            for name, value in self.counters.items():
+                rows.append((name, value, None, None, None))
+        return sorted(rows)
+
+    def prometheus(self):
+        """Metrics in Prometheus text format"""
+        lines = []
+        with self.__lock:
+            for name, value in sorted(self.counters.items()):
+                metric = Metrics.PREFIX + name + "_total"
+                lines.append("# TYPE {} counter".format(metric))
+                lines.append("{} {}".format(metric, value))
+            for name, h in sorted(self.histograms.items()):
+                metric = Metrics.PREFIX + name + "_seconds"
+                lines.append("# TYPE {} histogram".format(metric))
+                total = 0
+                for bound, count in zip(Histogram.BUCKETS, h.counts):
+                    total += count
+                    lines.append('{}_bucket{{le="{}"}} {}'.format(metric, bound, total))
+                lines.append('{}_bucket{{le="+Inf"}} {}'.format(metric, h.count))
+                lines.append("{}_sum {:.6f}".format(metric, h.sum))
+                lines.append("{}_count {}".format(metric, h.count))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write Prometheus dump to file, file replaced atomically"""
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print("Metrics.write():", e, file=sys.stderr)
+
+
+# Metrics of application
+METRICS = Metrics()
+
+
+def timed(name):
+    """
+    Decorator: latency of calls in histogram name, exceptions in counter name_errors
+    :param name  Metric name
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                METRICS.count(name + "_errors")
+                raise
+            finally:
+                METRICS.observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
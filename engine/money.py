@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+
+class Money(int):
+    """
+    Amount of money in minor units (kopecks), exact integer arithmetic
+    Config, journal and API keep amounts as float hryvnias, converted on the edges
+    """
+
+    __slots__ = ()
+
+    # Minor units in major unit
+    MINOR = 100
+
+    @staticmethod
+    def parse(text):
+        """
+        Money from user input, e.g. "12", "12.", "12.5", "12.50"
+        :except ValueError  Wrong format or more than 2 decimals
+        """
+        whole, _, frac = str(text).strip().partition(".")
+        if len(frac) > 2 or not (whole + frac).isdigit():
+            raise ValueError("Wrong money amount '{}'".format(text))
+        return Money(int(whole or 0) * Money.MINOR + int(frac.ljust(2, "0")))
+
+    @staticmethod
+    def from_float(value):
+        """
+        Money from float hryvnias (config, journal, API), half up rounded to kopecks
+        :except ValueError  Not a number, not finite or negative amount
+        """
+        if isinstance(value, Money):
+            return value
+        try:
+            amount = Decimal(str(value))
+            if not amount.is_finite() or amount < 0:
+                raise ValueError("Wrong money amount '{}'".format(value))
+            return Money(amount.quantize(Decimal("0.01"), ROUND_HALF_UP) * Money.MINOR)
+        except InvalidOperation:
+            raise ValueError("Wrong money amount '{}'".format(value))
+
+    def to_float(self):
+        """Float hryvnias for journal and API"""
+        return self / Money.MINOR
+
+    def edit_text(self):
+        """Text for editing: without zero decimals, "12.50" -> "12.5", "10.00" -> "10" """
+        return str(self).rstrip("0").rstrip(".")
+
+    def __str__(self):
+        # Called on each display, no divmod()/abs() for usual non negative amounts
+        if self < 0:
+            return "-" + str(Money(-self))
+        return "{}.{:02d}".format(self // 100, self % 100)
+
+    def __repr__(self):
+        return "Money({})".format(str(self))
+
+    def __add__(self, other):
+        return Money(int(self) + other)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(int(self) - other)
+
+
+class Rate:
+    """
+    Price by hour, exact conversion between time and Money:
+    cash = seconds * price / 3600, rounded half up once, no float rounding drift
+    """
+
+    __slots__ = ("price",)
+
+    def __init__(self, price):
+        """
+        :param price  Price by hour, Money or float hryvnias
+        """
+        self.price = Money.from_float(price)
+
+    def cash(self, seconds):
+        """Cost of whole seconds"""
+        return Money((seconds * self.price + 1800) // 3600)
+
+    def seconds(self, cash):
+        """Time paid by cash (seconds), 0 for free price"""
+        if not self.price:
+            return 0
+        return (cash * 3600 + self.price // 2) // self.price
+
+    def __repr__(self):
+        return "Rate({})".format(self.price)
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import importlib
+import itertools
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from plugins.base_plugin import SwitchException
+
+
+class PluginHostException(Exception):
+    """Plugin worker process failed, hung or restarted"""
+    pass
+
+
+# Worker process
+# Protocol, pickled tuples over Pipe:
+#   host -> worker: (request id, op, args)
+#   worker -> host: ("r", request id, ok, result or error str) - reply on request
+#                   ("s", channel, state, error str or None)    - switch_done() of plugin
+
+def _worker_channels_info(plugin):
+    # Devices are not sent, only names: device objects own ports and threads of worker
+    return {ch: [str(dev), local] for ch, (dev, local) in
+            ((ch, info[:2]) for ch, info in plugin.get_channels_info().items())}
+
+
+WORKER_OPS = {
+    "ping": lambda plugin: True,
+    "activate": lambda plugin: plugin.activate(),
+    "deactivate": lambda plugin: plugin.deactivate(),
+    "activation_errors": lambda plugin: dict(plugin.activation_errors()),
+    "get_channels_info": _worker_channels_info,
+    "switch_many": lambda plugin, channels: plugin.switch_many(channels),
+    "devices": lambda plugin: [str(dev) for dev in plugin.devices()],
+    "load_devs_from_config": lambda plugin: [str(dev) for dev in plugin.load_devs_from_config()],
+}
+
+
+def plugin_worker(conn, module, class_name):
+    """
+    Main function of plugin worker process: plugin created and called by requests of host
+    :param conn  Worker end of Pipe
+    :param module  Plugin module name
+    :param class_name  Plugin class name
+    """
+    send_lock = threading.Lock()
+
+    def send(msg):
+        with send_lock:
+            conn.send(msg)
+
+    plugin = getattr(importlib.import_module(module), class_name)()
+    plugin.set_switch_listener(
+        lambda channel, state, error: send(("s", channel, state, None if error is None else str(error)))
+    )
+    while True:
+        try:
+            req_id, op, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        if op == "exit":
+            break
+        try:
+            send(("r", req_id, True, WORKER_OPS[op](plugin, *args)))
+        except Exception as e:
+            send(("r", req_id, False, str(e) or type(e).__name__))
+    try:
+        if plugin.get_info()["activated"]:
+            plugin.deactivate()
+    except Exception as e:
+        print("plugin_worker(): deactivate:", e, file=sys.stderr)
+
+
+class RemotePlugin:
+    """
+    Plugin by manifest entry working in own worker process (see plugin_worker()),
+    so plugin hung or crashed in activate() or switch() doesn't stop UI and engine
+    Worker started on activation and stopped on deactivation,
+    every request has deadline, hung or dead worker restarted by watchdog,
+    plugin activated again and relays switched by last requested states
+    Switches sent without waiting for worker, results reported to switch listener as of plugin
+    """
+
+    # Deadline of request (seconds)
+    CALL_TIMEOUT = 5.0
+    # Deadline of activation, devices initialized and checked
+    ACTIVATE_TIMEOUT = 30.0
+    # Idle worker pinged with this interval
+    PING_INTERVAL = 2.0
+    WATCHDOG_INTERVAL = 0.5
+    # Pause before restart, doubled on each restart of worker failed sooner than RESTART_MAX_DELAY
+    RESTART_DELAY = 1.0
+    RESTART_MAX_DELAY = 30.0
+
+    def __init__(self, module, class_name, info=None):
+        """
+        :param module  Module name
+        :param class_name  Plugin class name
+        :param info  Plugin info from manifest
+        """
+        self.module = module
+        self.class_name = class_name
+        self.info = {"author": "", "plugin_name": class_name, "version": "", "description": ""}
+        self.info.update(info or {})
+        # Settings of devices are built by in process plugin only
+        self.settings = None
+        self.activated = False
+        # Channels of activated plugin, devices by names: {channel: [device name, local channel], ...}
+        self.channels_info = {}
+        self.restarts = 0
+        self.__activation_errors = {}
+        self.__listener = None
+        self.__lock = threading.RLock()
+        self.__process = None
+        self.__outbox = None
+        # Requests sent to worker: {id: (deadline, Future or None, switched channels or None), ...}
+        self.__pending = {}
+        self.__ids = itertools.count(1)
+        # Last requested states of relays, switched again after restart: {channel: state, ...}
+        self.__states = {}
+        self.__last_reply = 0.0
+        self.__started = 0.0
+        self.__restart_delay = RemotePlugin.RESTART_DELAY
+        self.__watchdog = None
+        # Restart in progress, in own thread, so hung activation doesn't stop watchdog
+        self.__restarting = False
+        self.__closed = threading.Event()
+
+    @staticmethod
+    def from_entry(entry):
+        return RemotePlugin(entry["module"], entry["class"], entry["info"])
+
+    def running(self):
+        return self.__process is not None
+
+    # Worker process
+
+    def start(self):
+        """Start worker process, if not started"""
+        with self.__lock:
+            if self.__process is not None:
+                return
+            ctx = multiprocessing.get_context("spawn")
+            conn, worker_conn = ctx.Pipe()
+            process = ctx.Process(target=plugin_worker, args=(worker_conn, self.module, self.class_name),
+                                  name="plugin-" + self.class_name, daemon=True)
+            process.start()
+            worker_conn.close()
+            print("RemotePlugin: {} started, pid {}".format(self.class_name, process.pid))
+            self.__process = process
+            self.__outbox = queue.Queue()
+            self.__last_reply = self.__started = time.monotonic()
+            threading.Thread(target=self.__reader, args=(conn, process), daemon=True,
+                             name="plugin-reader-" + self.class_name).start()
+            threading.Thread(target=self.__writer, args=(conn, self.__outbox), daemon=True,
+                             name="plugin-writer-" + self.class_name).start()
+            if self.__watchdog is None:
+                self.__watchdog = threading.Thread(target=self.__watch, daemon=True,
+                                                   name="plugin-watchdog-" + self.class_name)
+                self.__watchdog.start()
+
+    def stop(self, reason="stopped"):
+        """Stop worker process, requests in progress failed"""
+        with self.__lock:
+            process, outbox = self.__process, self.__outbox
+            if process is None:
+                return
+            self.__process = None
+            self.__outbox = None
+            pending, self.__pending = self.__pending, {}
+        outbox.put((0, "exit", ()))
+        outbox.put(None)
+        process.join(1.0)
+        if process.is_alive():
+            process.terminate()
+            process.join(1.0)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        print("RemotePlugin: {} {}, exit code {}".format(self.class_name, reason, process.exitcode))
+        self.__fail(pending, PluginHostException("Plugin {}: {}".format(self.class_name, reason)))
+
+    def close(self):
+        """Stop worker and watchdog"""
+        self.__closed.set()
+        self.stop()
+        if self.__watchdog is not None:
+            self.__watchdog.join()
+
+    def __fail(self, pending, error):
+        for deadline, future, channels in pending.values():
+            if future is not None:
+                future.set_exception(error)
+            elif channels:
+                for channel, state in channels.items():
+                    self.__switch_done(channel, state, SwitchException(str(error)))
+
+    def __writer(self, conn, outbox):
+        while True:
+            msg = outbox.get()
+            if msg is None:
+                break
+            try:
+                conn.send(msg)
+            except (OSError, ValueError):
+                # Worker died, restarted by watchdog
+                break
+        conn.close()
+
+    def __reader(self, conn, process):
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg[0] == "s":
+                channel, state, error = msg[1:]
+                self.__switch_done(channel, state, None if error is None else SwitchException(error))
+                continue
+            req_id, ok, value = msg[1:]
+            with self.__lock:
+                if process is not self.__process:
+                    break
+                request = self.__pending.pop(req_id, None)
+                self.__last_reply = time.monotonic()
+            if request is None:
+                continue
+            deadline, future, channels = request
+            if future is not None:
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(PluginHostException(value))
+            elif not ok:
+                for channel, state in channels.items():
+                    self.__switch_done(channel, state, SwitchException(value))
+
+    def __watch(self):
+        """Watchdog: restart worker died or not replied in time, ping idle worker"""
+        while not self.__closed.wait(RemotePlugin.WATCHDOG_INTERVAL):
+            with self.__lock:
+                if self.__process is None or self.__restarting:
+                    continue
+                now = time.monotonic()
+                if not self.__process.is_alive():
+                    reason = "died"
+                elif any(deadline < now for deadline, future, channels in self.__pending.values()):
+                    reason = "not responding"
+                else:
+                    if not self.__pending and now - self.__last_reply >= RemotePlugin.PING_INTERVAL:
+                        self.__send("ping", (), RemotePlugin.CALL_TIMEOUT, Future())
+                    continue
+                self.__restarting = True
+            threading.Thread(target=self.__restart, args=(reason,), daemon=True,
+                             name="plugin-restart-" + self.class_name).start()
+
+    def __restart(self, reason):
+        """Restart worker, activate plugin and switch relays again, in restart thread"""
+        try:
+            self.__restart_worker(reason)
+        finally:
+            with self.__lock:
+                self.__restarting = False
+
+    def __restart_worker(self, reason):
+        print("RemotePlugin: {} {}, restart".format(self.class_name, reason), file=sys.stderr)
+        if time.monotonic() - self.__started > RemotePlugin.RESTART_MAX_DELAY:
+            # Worker worked long enough, not a restart loop
+            self.__restart_delay = RemotePlugin.RESTART_DELAY
+        self.stop(reason)
+        delay = self.__restart_delay
+        self.__restart_delay = min(delay * 2, RemotePlugin.RESTART_MAX_DELAY)
+        # Not activated worker started again by next request
+        if self.__closed.wait(delay) or not self.activated:
+            return
+        self.restarts += 1
+        self.start()
+        try:
+            self.__call("activate", timeout=RemotePlugin.ACTIVATE_TIMEOUT)
+            self.__activation_errors = self.__call("activation_errors")
+        except Exception as e:
+            print("RemotePlugin: {} activate: {}".format(self.class_name, e), file=sys.stderr)
+            return
+        with self.__lock:
+            states = dict(self.__states)
+        if states:
+            self.__send("switch_many", (states,), RemotePlugin.CALL_TIMEOUT, channels=states)
+
+    def __send(self, op, args, timeout, future=None, channels=None):
+        with self.__lock:
+            if self.__process is None:
+                raise PluginHostException("Plugin {}: worker not started".format(self.class_name))
+            req_id = next(self.__ids)
+            self.__pending[req_id] = (time.monotonic() + timeout, future, channels)
+            self.__outbox.put((req_id, op, args))
+        return future
+
+    def __call(self, op, *args, timeout=CALL_TIMEOUT):
+        """
+        Request to worker, waiting for result
+        :except PluginHostException  Error in worker or worker not replied in time (restarted by watchdog)
+        """
+        future = self.__send(op, args, timeout, Future())
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            raise PluginHostException("Plugin {}: no reply on {}() in {} s".format(self.class_name, op, timeout))
+
+    # Plugin interface
+
+    def get_info(self):
+        return dict(self.info, activated=self.activated)
+
+    def get_channels_count(self):
+        return len(self.channels_info)
+
+    def get_channels_info(self):
+        return self.channels_info
+
+    def set_switch_listener(self, listener):
+        self.__listener = listener
+
+    def __switch_done(self, channel, state, error):
+        if self.__listener:
+            self.__listener(channel, state, error)
+
+    def switch(self, channel, state):
+        self.switch_many({channel: state})
+
+    def switch_many(self, channels):
+        """Send switches to worker, don't wait for worker"""
+        if not self.activated:
+            raise SwitchException("Plugin {} not activated".format(self.class_name))
+        channels = dict(channels)
+        with self.__lock:
+            self.__states.update(channels)
+            self.__send("switch_many", (channels,), RemotePlugin.CALL_TIMEOUT, channels=channels)
+
+    def activate(self):
+        self.start()
+        result = self.__call("activate", timeout=RemotePlugin.ACTIVATE_TIMEOUT)
+        self.__activation_errors = self.__call("activation_errors")
+        # Same name objects for channels of same device, channels of device grouped by routing
+        names = {}
+        self.channels_info = {ch: [names.setdefault(name, name), local]
+                              for ch, (name, local) in self.__call("get_channels_info").items()}
+        self.__states = {}
+        self.activated = True
+        return result
+
+    def activation_errors(self):
+        return self.__activation_errors
+
+    def deactivate(self):
+        self.activated = False
+        self.channels_info = {}
+        self.__states = {}
+        try:
+            if self.running():
+                self.__call("deactivate")
+        finally:
+            self.stop()
+
+    def devices(self):
+        if not self.running():
+            return []
+        return self.__call("devices")
+
+    def load_devs_from_config(self):
+        self.start()
+        return self.__call("load_devs_from_config")
+
+    def build_settings(self, parent_widget):
+        from PySide.QtGui import QLabel, QVBoxLayout
+        label = QLabel("Плагин работает в отдельном процессе.\n"
+                       "Для настройки устройств отключите \"isolate_plugins\" в [Main]", parent_widget)
+        label.setWordWrap(True)
+        layout = QVBoxLayout(parent_widget)
+        layout.addWidget(label)
+        return label
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import ast
+import importlib
+import json
+import os
+import pkgutil
+import sys
+import threading
+
+
+class PluginManifest:
+    """
+    Plugins of plugins dir found without import: modules parsed by ast,
+    classes inherited from PTBasePlugin (directly or by other plugins) are plugins,
+    plugin info taken from dict literal returned by get_info()
+    Parsed modules cached on disk, module parsed again only when its mtime or size changed
+    """
+
+    # Cache file in plugins dir
+    CACHE_FILE = ".manifest.json"
+    # Version of cache format
+    VERSION = 1
+    BASE_CLASS = "PTBasePlugin"
+
+    def __init__(self, plugins_dir="./plugins", package="plugins", cache_file=None):
+        """
+        :param plugins_dir  Plugins modules dir
+        :param package  Package name of plugins modules
+        :param cache_file  Cache file, default - CACHE_FILE in plugins dir
+        """
+        self.plugins_dir = plugins_dir
+        self.package = package
+        self.cache_file = cache_file or os.path.join(plugins_dir, PluginManifest.CACHE_FILE)
+
+    def entries(self):
+        """
+        Plugins in order of modules
+        :return: list [{"module": str, "class": str, "info": dict}, ...]
+        """
+        cache = self.__load_cache()
+        modules = {}
+        changed = False
+        for module_info in pkgutil.iter_modules([self.plugins_dir]):
+            name = module_info[1]
+            path = os.path.join(self.plugins_dir, name, "__init__.py") if module_info[2] else \
+                os.path.join(self.plugins_dir, name + ".py")
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            cached = cache.get(name)
+            if cached and cached["mtime_ns"] == st.st_mtime_ns and cached["size"] == st.st_size:
+                modules[name] = cached
+                continue
+            modules[name] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "classes": self.parse_module(path)}
+            changed = True
+        if changed or set(modules) != set(cache):
+            self.__save_cache(modules)
+        return self.resolve(modules)
+
+    @staticmethod
+    def parse_module(path):
+        """
+        Classes of module
+        :return: list [{"class": str, "bases": [str, ...], "info": dict}, ...]
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                tree = ast.parse(f.read(), path)
+        except (OSError, SyntaxError, ValueError) as e:
+            print("PluginManifest: can't parse {}: {}".format(path, e), file=sys.stderr)
+            return []
+        classes = []
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            bases = []
+            for base in node.bases:
+                if isinstance(base, ast.Name):
+                    bases.append(base.id)
+                elif isinstance(base, ast.Attribute):
+                    bases.append(base.attr)
+            classes.append({"class": node.name, "bases": bases, "info": PluginManifest.parse_info(node)})
+        return classes
+
+    @staticmethod
+    def parse_info(class_node):
+        """Literal items of dict returned by get_info() of class"""
+        info = {}
+        for node in class_node.body:
+            if not isinstance(node, ast.FunctionDef) or node.name != "get_info":
+                continue
+            for child in ast.walk(node):
+                if isinstance(child, ast.Return) and isinstance(child.value, ast.Dict):
+                    for key, value in zip(child.value.keys, child.value.values):
+                        try:
+                            info[ast.literal_eval(key)] = ast.literal_eval(value)
+                        except (ValueError, TypeError, SyntaxError):
+                            # Not literal value, like "activated"
+                            pass
+        info.pop("activated", None)
+        return info
+
+    def resolve(self, modules):
+        """Plugin classes of parsed modules, inheritance followed across modules"""
+        plugin_classes = {PluginManifest.BASE_CLASS}
+        changed = True
+        while changed:
+            changed = False
+            for module in modules.values():
+                for cls in module["classes"]:
+                    if cls["class"] not in plugin_classes and plugin_classes.intersection(cls["bases"]):
+                        plugin_classes.add(cls["class"])
+                        changed = True
+        entries = []
+        for name, module in modules.items():
+            for cls in module["classes"]:
+                if cls["class"] != PluginManifest.BASE_CLASS and cls["class"] in plugin_classes:
+                    entries.append({"module": self.package + "." + name, "class": cls["class"], "info": cls["info"]})
+        return entries
+
+    def __load_cache(self):
+        try:
+            with open(self.cache_file, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == PluginManifest.VERSION:
+                return data["modules"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def __save_cache(self, modules):
+        tmp_file = self.cache_file + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({"version": PluginManifest.VERSION, "modules": modules}, f, ensure_ascii=False)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            # Plugins dir may be read only, manifest built again on next start
+            print("PluginManifest: can't write {}: {}".format(self.cache_file, e), file=sys.stderr)
+
+
+class LazyPlugin:
+    """
+    Plugin by manifest entry, module imported and plugin created on first use
+    (activation, settings, devices, ...), get_info() of not loaded plugin by manifest
+    """
+
+    def __init__(self, module, class_name, info=None):
+        """
+        :param module  Module name
+        :param class_name  Plugin class name
+        :param info  Plugin info from manifest
+        """
+        self.module = module
+        self.class_name = class_name
+        self.info = {"author": "", "plugin_name": class_name, "version": "", "description": ""}
+        self.info.update(info or {})
+        self.plugin = None
+        self.__listener = None
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def from_entry(entry):
+        return LazyPlugin(entry["module"], entry["class"], entry["info"])
+
+    def loaded(self):
+        return self.plugin is not None
+
+    def load(self):
+        """
+        Import module and create plugin, once
+        :return: plugin instance
+        """
+        with self.__lock:
+            if self.plugin is None:
+                print("load plugin:", self.module, self.class_name)
+                plugin = getattr(importlib.import_module(self.module), self.class_name)()
+                if self.__listener:
+                    plugin.set_switch_listener(self.__listener)
+                self.plugin = plugin
+            return self.plugin
+
+    def get_info(self):
+        if self.plugin is None:
+            return dict(self.info, activated=False)
+        return self.plugin.get_info()
+
+    def set_switch_listener(self, listener):
+        """Listener set on plugin now or when plugin loaded"""
+        self.__listener = listener
+        if self.plugin is not None:
+            self.plugin.set_switch_listener(listener)
+
+    def __getattr__(self, name):
+        # Any other use of plugin loads it
+        return getattr(self.load(), name)
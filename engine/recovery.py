@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import threading
+import time
+
+from engine.session import Session
+
+
+class SessionRecovery:
+    """
+    Recovery of running sessions after restart or crash
+    Last journal record of each active channel kept in memory and
+    periodically saved to snapshot file, so on start only journal tail
+    after snapshot is replayed
+    """
+
+    # Snapshot file name in journal dir
+    SNAPSHOT_NAME = "state.snapshot"
+    # Save snapshot after this count of tracked records
+    CHECKPOINT_EVERY = 200
+
+    def __init__(self, journal):
+        """
+        :param journal  SessionJournal
+        """
+        self.journal = journal
+        self.path = os.path.join(journal.directory, SessionRecovery.SNAPSHOT_NAME)
+        # Active sessions: {channel: last record, ...}
+        self.states = {}
+        self.__seq = 0
+        self.__tracked = 0
+        self.__saver = None
+
+    def recover(self):
+        """
+        Load snapshot and replay journal records after it
+        :return: dict {channel: last record, ...} of sessions active on shutdown
+        """
+        started = time.perf_counter()
+        self.states, self.__seq = self.load_snapshot()
+        replayed = 0
+        for record in self.journal.replay(self.__seq):
+            self.__apply(record)
+            replayed += 1
+        print("SessionRecovery.recover(): {} session(s), {} record(s) replayed in {:.3f} s".format(
+            len(self.states), replayed, time.perf_counter() - started))
+        return dict(self.states)
+
+    def track(self, record):
+        """Apply new journal record, snapshot saved every CHECKPOINT_EVERY records"""
+        self.__apply(record)
+        self.__tracked += 1
+        if self.__tracked >= SessionRecovery.CHECKPOINT_EVERY:
+            self.checkpoint()
+
+    def checkpoint(self, wait=False):
+        """
+        Save snapshot in background thread
+        :param wait  Wait for saving finished
+        """
+        if self.__saver and self.__saver.is_alive():
+            self.__saver.join()
+        self.__tracked = 0
+        data = {"seq": self.__seq, "states": dict(self.states)}
+        self.__saver = threading.Thread(target=self.__save_snapshot, args=(data,),
+                                        name="SessionRecovery", daemon=True)
+        self.__saver.start()
+        if wait:
+            self.__saver.join()
+
+    def load_snapshot(self):
+        """
+        :return: (states dict {channel: record, ...}, seq of last applied record)
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            return {int(ch): record for ch, record in data["states"].items()}, data["seq"]
+        except FileNotFoundError:
+            return {}, 0
+        except Exception as e:
+            print("SessionRecovery.load_snapshot():", e, file=sys.stderr)
+            return {}, 0
+
+    def __save_snapshot(self, data):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print("SessionRecovery.__save_snapshot():", e, file=sys.stderr)
+
+    def __apply(self, record):
+        self.__seq = max(self.__seq, record["seq"])
+        if record["ev"] == "stop":
+            self.states.pop(record["ch"], None)
+        else:
+            self.states[record["ch"]] = record
+
+    @staticmethod
+    def restore_session(record, now=None):
+        """
+        Continue session from last record, downtime counted as session time
+        :param record  Last journal record of channel
+        :param now  Current wall time
+        :return: Session or None if session time is up during downtime
+        """
+        if now is None:
+            now = time.time()
+        paused = record.get("paused", record["ev"] == "pause")
+        elapsed = record["elapsed"]
+        if not paused:
+            elapsed += max(0.0, now - record["ts"])
+        limit = record["limit"]
+        if elapsed >= (Session.MAX_TIME if limit is None else limit):
+            return None
+        return Session.resumed(limit, elapsed, paused, record.get("started"))
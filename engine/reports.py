@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import sqlite3
+import time
+
+
+class ReportStore:
+    """
+    Revenue and usage reports over finished sessions
+    Sessions loaded from journal "stop" records into SQLite database,
+    hourly and daily rollups updated on loading, so reports read
+    rollups instead of sessions, except parts of hours on range edges
+    """
+
+    # Report grouping: name -> rollup column
+    GROUPS = {"day": "day", "hour": "hour", "channel": "channel", "tariff": "tariff"}
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            seq INTEGER PRIMARY KEY,
+            channel INTEGER NOT NULL,
+            tariff TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            start_ts REAL NOT NULL,
+            end_ts REAL NOT NULL,
+            duration REAL NOT NULL,
+            charged REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS sessions_start ON sessions (start_ts);
+        CREATE INDEX IF NOT EXISTS sessions_channel ON sessions (channel, start_ts);
+        CREATE INDEX IF NOT EXISTS sessions_tariff ON sessions (tariff, start_ts);
+        CREATE TABLE IF NOT EXISTS rollup_hourly (
+            hour INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            channel INTEGER NOT NULL,
+            tariff TEXT NOT NULL,
+            sessions INTEGER NOT NULL,
+            duration REAL NOT NULL,
+            charged REAL NOT NULL,
+            PRIMARY KEY (hour, channel, tariff)
+        );
+        CREATE TABLE IF NOT EXISTS rollup_daily (
+            day INTEGER NOT NULL,
+            channel INTEGER NOT NULL,
+            tariff TEXT NOT NULL,
+            sessions INTEGER NOT NULL,
+            duration REAL NOT NULL,
+            charged REAL NOT NULL,
+            PRIMARY KEY (day, channel, tariff)
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        );
+    """
+
+    def __init__(self, path, journal=None):
+        """
+        :param path  Database file
+        :param journal  SessionJournal - source of sessions
+        """
+        self.journal = journal
+        self.db = sqlite3.connect(path)
+        self.db.executescript(ReportStore.SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def last_seq(self):
+        """Seq of last loaded journal record"""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'last_seq'").fetchone()
+        return row[0] if row else 0
+
+    def update(self):
+        """
+        Load sessions finished after last update from journal
+        :return: count of loaded sessions
+        """
+        if not self.journal:
+            return 0
+        last_seq = self.last_seq()
+        count = 0
+        with self.db:
+            for record in self.journal.replay(last_seq):
+                last_seq = record["seq"]
+                if record["ev"] == "stop" and self.__add(record):
+                    count += 1
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_seq', ?)", (last_seq,))
+        return count
+
+    def add_session(self, record):
+        """Add one finished session from journal "stop" record"""
+        with self.db:
+            self.__add(record)
+
+    def __add(self, record):
+        if record.get("charged") is None:
+            return False
+        end_ts = record["ts"]
+        start_ts = record.get("started") or (end_ts - record["elapsed"])
+        hour, day = ReportStore.hour_start(start_ts), ReportStore.day_start(start_ts)
+        key = (record["ch"], record["tariff"])
+        values = (record["elapsed"], record["charged"])
+        cur = self.db.execute(
+            "INSERT OR IGNORE INTO sessions (seq, channel, tariff, mode, start_ts, end_ts, duration, charged) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (record["seq"], record["ch"], record["tariff"], record["mode"], start_ts, end_ts) + values
+        )
+        if cur.rowcount == 0:
+            # Already loaded
+            return False
+        self.db.execute(
+            "INSERT INTO rollup_hourly (hour, day, channel, tariff, sessions, duration, charged) "
+            "VALUES (?, ?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT (hour, channel, tariff) DO UPDATE SET sessions = sessions + 1, "
+            "duration = duration + excluded.duration, charged = charged + excluded.charged",
+            (hour, day) + key + values
+        )
+        self.db.execute(
+            "INSERT INTO rollup_daily (day, channel, tariff, sessions, duration, charged) "
+            "VALUES (?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT (day, channel, tariff) DO UPDATE SET sessions = sessions + 1, "
+            "duration = duration + excluded.duration, charged = charged + excluded.charged",
+            (day,) + key + values
+        )
+        return True
+
+    def summary(self, start, end, channel=None, tariff=None, group_by="day"):
+        """
+        Sessions count, time and revenue by sessions started in [start, end)
+        Whole days read from daily rollup, whole hours from hourly,
+        parts of hours on range edges from sessions
+        :param start  Wall time of range start
+        :param end  Wall time of range end
+        :param channel  Only this channel
+        :param tariff  Only this tariff
+        :param group_by  day, hour, channel or tariff
+        :return: list [(group value, sessions, duration seconds, charged), ...] sorted by group value
+        """
+        column = ReportStore.GROUPS[group_by]
+        result = {}
+        # Whole hours inside range
+        first_hour = ReportStore.hour_start(start)
+        if first_hour < start:
+            first_hour += 3600
+        last_hour = ReportStore.hour_start(end)
+        if first_hour >= last_hour:
+            self.__sum_sessions(result, group_by, start, end, channel, tariff)
+            return ReportStore.__rows(result)
+        self.__sum_sessions(result, group_by, start, first_hour, channel, tariff)
+        self.__sum_sessions(result, group_by, last_hour, end, channel, tariff)
+
+        parts = []
+        if group_by == "hour":
+            parts.append(("rollup_hourly", "hour", first_hour, last_hour))
+        else:
+            # Whole days inside range
+            first_day = ReportStore.day_start(first_hour)
+            if first_day < first_hour:
+                first_day = ReportStore.next_day(first_day)
+            last_day = ReportStore.day_start(last_hour)
+            if first_day < last_day:
+                parts.append(("rollup_hourly", "hour", first_hour, first_day))
+                parts.append(("rollup_daily", "day", first_day, last_day))
+                parts.append(("rollup_hourly", "hour", last_day, last_hour))
+            else:
+                parts.append(("rollup_hourly", "hour", first_hour, last_hour))
+        for table, bucket, part_start, part_end in parts:
+            if part_start >= part_end:
+                continue
+            sql = "SELECT {}, SUM(sessions), SUM(duration), SUM(charged) FROM {} WHERE {} >= ? AND {} < ?".format(
+                column, table, bucket, bucket)
+            args = [part_start, part_end]
+            if channel is not None:
+                sql += " AND channel = ?"
+                args.append(channel)
+            if tariff is not None:
+                sql += " AND tariff = ?"
+                args.append(tariff)
+            sql += " GROUP BY {}".format(column)
+            for key, sessions, duration, charged in self.db.execute(sql, args):
+                ReportStore.__sum(result, key, sessions, duration, charged)
+        return ReportStore.__rows(result)
+
+    def __sum_sessions(self, result, group_by, start, end, channel, tariff):
+        """Add sessions started in [start, end) to result, for parts of hours"""
+        if start >= end:
+            return
+        for ch, tr, mode, start_ts, end_ts, duration, charged in self.sessions(start, end, channel, tariff):
+            if group_by == "day":
+                key = ReportStore.day_start(start_ts)
+            elif group_by == "hour":
+                key = ReportStore.hour_start(start_ts)
+            elif group_by == "channel":
+                key = ch
+            else:
+                key = tr
+            ReportStore.__sum(result, key, 1, duration, charged)
+
+    @staticmethod
+    def __sum(result, key, sessions, duration, charged):
+        row = result.setdefault(key, [0, 0.0, 0.0])
+        row[0] += sessions
+        row[1] += duration
+        row[2] += charged
+
+    @staticmethod
+    def __rows(result):
+        return [(key, row[0], row[1], round(row[2], 2)) for key, row in sorted(result.items())]
+
+    def sessions(self, start, end, channel=None, tariff=None):
+        """
+        Sessions started in [start, end)
+        :return: list [(channel, tariff, mode, start_ts, end_ts, duration, charged), ...]
+        """
+        sql = "SELECT channel, tariff, mode, start_ts, end_ts, duration, charged FROM sessions " \
+              "WHERE start_ts >= ? AND start_ts < ?"
+        args = [start, end]
+        if channel is not None:
+            sql += " AND channel = ?"
+            args.append(channel)
+        if tariff is not None:
+            sql += " AND tariff = ?"
+            args.append(tariff)
+        return self.db.execute(sql + " ORDER BY start_ts", args).fetchall()
+
+    def tariffs(self):
+        """Names of tariffs in loaded sessions"""
+        return [row[0] for row in self.db.execute("SELECT DISTINCT tariff FROM rollup_daily ORDER BY tariff")]
+
+    @staticmethod
+    def hour_start(ts):
+        return int(ts // 3600 * 3600)
+
+    @staticmethod
+    def day_start(ts):
+        """Wall time of local midnight of day with ts"""
+        d = datetime.datetime.fromtimestamp(ts)
+        return int(time.mktime(d.replace(hour=0, minute=0, second=0, microsecond=0).timetuple()))
+
+    @staticmethod
+    def next_day(day):
+        d = datetime.datetime.fromtimestamp(day) + datetime.timedelta(days=1)
+        return int(time.mktime(d.replace(hour=0, minute=0, second=0, microsecond=0).timetuple()))
+
+    @staticmethod
+    def format_group(group_by, value):
+        """Group value as text for display"""
+        if group_by == "day":
+            return datetime.datetime.fromtimestamp(value).strftime("%Y-%m-%d")
+        if group_by == "hour":
+            return datetime.datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:00")
+        if group_by == "channel":
+            return str(value + 1)
+        return str(value)
+
+
+def parse_date(text):
+    """Date "YYYY-MM-DD" or "YYYY-MM-DD HH:MM" to wall time"""
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(datetime.datetime.strptime(text, fmt).timetuple())
+        except ValueError:
+            continue
+    raise ValueError("Wrong date '{}', format: YYYY-MM-DD [HH:MM]".format(text))
+
+
+def print_report(store, start, end, channel=None, tariff=None, group_by="day"):
+    """Print summary report as text table"""
+    store.update()
+    rows = store.summary(start, end, channel, tariff, group_by)
+    print("{:<20}{:>10}{:>14}{:>14}".format(group_by, "sessions", "hours", "revenue"))
+    total = [0, 0.0, 0.0]
+    for key, sessions, duration, charged in rows:
+        print("{:<20}{:>10}{:>14.2f}{:>14.2f}".format(
+            ReportStore.format_group(group_by, key), sessions, duration / 3600, charged))
+        total[0] += sessions
+        total[1] += duration
+        total[2] += charged
+    print("{:<20}{:>10}{:>14.2f}{:>14.2f}".format("total", total[0], total[1] / 3600, total[2]))
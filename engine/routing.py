@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+class ChannelRoute:
+    """Channel of engine on plugin and device"""
+
+    __slots__ = ("channel", "plugin", "plugin_channel", "device", "device_channel")
+
+    def __init__(self, channel, plugin, plugin_channel, device, device_channel):
+        """
+        :param channel  Channel number in engine (UI)
+        :param plugin  Plugin of channel
+        :param plugin_channel  Channel number in plugin
+        :param device  Device of plugin
+        :param device_channel  Channel (relay) number on device
+        """
+        self.channel = channel
+        self.plugin = plugin
+        self.plugin_channel = plugin_channel
+        self.device = device
+        self.device_channel = device_channel
+
+    def info(self):
+        """Plugin, device and local channel (text)"""
+        return self.plugin.get_info()["plugin_name"] + " - " + str(self.device) + \
+            " - channel: " + str(self.device_channel)
+
+
+class ChannelRegistry:
+    """
+    Global channels of all activated plugins, plugins channels numbered one after other
+    Both directions are lookups: channel -> route by list index, (plugin, plugin channel) -> channel by dict
+    Registry not changed after creation, channels rebuild creates new registry
+    """
+
+    def __init__(self, routes=()):
+        self.routes = list(routes)
+        self.__channels = {(id(r.plugin), r.plugin_channel): r.channel for r in self.routes}
+
+    @staticmethod
+    def from_plugins(plugins):
+        """
+        Registry by channels of plugins
+        :param plugins  Activated plugins in order of channels
+        """
+        routes = []
+        for plugin in plugins:
+            channels_info = plugin.get_channels_info()
+            for plugin_channel in sorted(channels_info):
+                dev, device_channel = channels_info[plugin_channel][:2]
+                routes.append(ChannelRoute(len(routes), plugin, plugin_channel, dev, device_channel))
+        return ChannelRegistry(routes)
+
+    def route(self, channel):
+        """:except IndexError  Unknown channel"""
+        if channel < 0:
+            raise IndexError("Channel {} not found".format(channel))
+        return self.routes[channel]
+
+    def channel_of(self, plugin, plugin_channel):
+        """Channel of engine by plugin channel, None if channel not routed"""
+        return self.__channels.get((id(plugin), plugin_channel))
+
+    def group(self, channels):
+        """
+        Group switches by plugins, ordered by devices in plugin,
+        so plugin merges switches of device into one write
+        :param channels  Dict {channel: state, ...}
+        :return: dict {plugin: {plugin channel: state, ...}, ...}
+        """
+        by_device = {}
+        for channel, state in channels.items():
+            route = self.route(channel)
+            by_device.setdefault((id(route.plugin), id(route.device)), []).append((route, state))
+        by_plugin = {}
+        for routes in by_device.values():
+            changes = by_plugin.setdefault(routes[0][0].plugin, {})
+            for route, state in routes:
+                changes[route.plugin_channel] = state
+        return by_plugin
+
+    def __len__(self):
+        return len(self.routes)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+
+
+class Session:
+    """
+    Timekeeping of one channel session by monotonic clock
+    Session stores start time, accumulated pauses and paid time,
+    all values (elapsed, remaining, deadline) computed on demand,
+    so event loop stalls don't stretch the session
+    """
+
+    # Max session length (seconds)
+    MAX_TIME = 24 * 3600
+
+    def __init__(self, limit=None, clock=time.monotonic):
+        """
+        Create not started session
+        :param limit  Paid time (seconds), None - free session, time counted up to MAX_TIME
+        :param clock  Monotonic clock function
+        """
+        self.clock = clock
+        self.limit = limit
+        # Clock values of start, current pause and stop
+        self.started_at = None
+        self.paused_at = None
+        self.stopped_at = None
+        # Total time in finished pauses
+        self.paused_total = 0.0
+        # Wall time of session start, for reports
+        self.start_time = None
+
+    @staticmethod
+    def resumed(limit, elapsed, paused=False, start_time=None, clock=time.monotonic):
+        """
+        Create started session, for continue session after restart
+        :param limit  Paid time (seconds), None - free session
+        :param elapsed  Already elapsed time (seconds)
+        :param paused  Session in pause
+        :param start_time  Wall time of session start
+        """
+        session = Session(limit, clock)
+        now = clock()
+        session.started_at = now - elapsed
+        session.start_time = start_time if start_time is not None else time.time() - elapsed
+        if paused:
+            session.paused_at = now
+        return session
+
+    def start(self):
+        self.started_at = self.clock()
+        self.start_time = time.time()
+
+    def pause(self):
+        if self.running():
+            self.paused_at = self.clock()
+
+    def resume(self):
+        if self.paused():
+            self.paused_total += self.clock() - self.paused_at
+            self.paused_at = None
+
+    def stop(self):
+        """Stop session, elapsed time frozen"""
+        if self.started_at is not None and self.stopped_at is None:
+            self.resume()
+            self.stopped_at = self.clock()
+
+    def started(self):
+        return self.started_at is not None
+
+    def running(self):
+        return self.started() and self.paused_at is None and self.stopped_at is None
+
+    def paused(self):
+        return self.paused_at is not None and self.stopped_at is None
+
+    def add_time(self, seconds):
+        """Add paid time (seconds), for free session nothing to do"""
+        if self.limit is not None:
+            self.limit += seconds
+
+    def elapsed(self, now=None):
+        """Active (without pauses) time of session (seconds, float)"""
+        if self.started_at is None:
+            return 0.0
+        if self.stopped_at is not None:
+            now = self.stopped_at
+        elif self.paused_at is not None:
+            now = self.paused_at
+        elif now is None:
+            now = self.clock()
+        return max(0.0, now - self.started_at - self.paused_total)
+
+    def remaining(self, now=None):
+        """Remaining time of session (seconds, float)"""
+        limit = Session.MAX_TIME if self.limit is None else self.limit
+        return max(0.0, limit - self.elapsed(now))
+
+    def deadline(self):
+        """Clock value when session time is up, None if session not running"""
+        if not self.running():
+            return None
+        limit = Session.MAX_TIME if self.limit is None else self.limit
+        return self.started_at + self.paused_total + limit
+
+    def expired(self, now=None):
+        return self.started() and self.remaining(now) == 0
+
+    def time(self, now=None):
+        """
+        Time for display (seconds, int)
+        Free session - elapsed time, paid session - remaining time
+        """
+        if self.limit is None:
+            return int(self.elapsed(now))
+        return math.ceil(self.remaining(now))
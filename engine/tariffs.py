@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import re
+import sys
+import time
+
+from array import array
+
+import pt
+from engine.money import Rate
+
+
+class Tariff:
+    """
+    Tariff: price by hour, may depend on weekday and time of day
+    Prices and rates (price by second) of all minutes of week precomputed, so lookup is one index
+    Config format: "<price>[; <rule>; ...]", rule: "[<days>] [HH:MM-HH:MM] = <price>",
+    days: mon..sun, lists and ranges: "sat,sun", "mon-fri"; later rules override earlier,
+    e.g. "80; mon-fri 18:00-23:00 = 100; sat,sun = 120"
+    """
+
+    DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+    DAY_MINUTES = 24 * 60
+    WEEK_MINUTES = 7 * DAY_MINUTES
+
+    RULE_RE = re.compile(r"^\s*(?P<days>[a-z,\-]+)?\s*(?:(?P<start>\d{1,2}:\d{2})\s*-\s*(?P<end>\d{1,2}:\d{2}))?"
+                         r"\s*=\s*(?P<price>[\d.]+)\s*$")
+
+    def __init__(self, name, price, rules=()):
+        """
+        :param name  Tariff name
+        :param price  Base price by hour
+        :param rules  List [(weekdays set 0..6, start minute, end minute, price), ...]
+        """
+        self.name = name
+        self.price = price
+        self.rules = list(rules)
+        self.__prices = array("d", [price]) * Tariff.WEEK_MINUTES
+        for days, start, end, rule_price in self.rules:
+            for day in days:
+                first = day * Tariff.DAY_MINUTES + start
+                # Range after midnight continued in next day
+                last = day * Tariff.DAY_MINUTES + (end if end > start else end + Tariff.DAY_MINUTES)
+                for minute in range(first, last):
+                    self.__prices[minute % Tariff.WEEK_MINUTES] = rule_price
+        # Rate by second of each minute, one Rate for each price
+        rates = {p: Rate(p) for p in set(self.__prices)}
+        self.__rates = [rates[p] for p in self.__prices]
+
+    @staticmethod
+    def parse(name, text):
+        """
+        Tariff from config value
+        :except ValueError  Wrong format
+        """
+        parts = text.split(";")
+        price = float(parts[0])
+        if not math.isfinite(price) or price < 0:
+            raise ValueError("Wrong tariff price '{}'".format(parts[0].strip()))
+        rules = []
+        for part in parts[1:]:
+            if not part.strip():
+                continue
+            m = Tariff.RULE_RE.match(part.lower())
+            if not m:
+                raise ValueError("Wrong tariff rule '{}'".format(part.strip()))
+            days = Tariff.parse_days(m.group("days")) if m.group("days") else set(range(7))
+            start, end = 0, Tariff.DAY_MINUTES
+            if m.group("start"):
+                start, end = Tariff.parse_minute(m.group("start")), Tariff.parse_minute(m.group("end"))
+            rule_price = float(m.group("price"))
+            if not math.isfinite(rule_price):
+                raise ValueError("Wrong tariff price '{}'".format(m.group("price")))
+            rules.append((days, start, end, rule_price))
+        return Tariff(name, price, rules)
+
+    @staticmethod
+    def parse_days(text):
+        days = set()
+        for item in text.split(","):
+            first, _, last = item.strip().partition("-")
+            if first not in Tariff.DAYS or (last and last not in Tariff.DAYS):
+                raise ValueError("Wrong weekday '{}'".format(item))
+            i, j = Tariff.DAYS.index(first), Tariff.DAYS.index(last or first)
+            days.update(d % 7 for d in range(i, (j if j >= i else j + 7) + 1))
+        return days
+
+    @staticmethod
+    def parse_minute(text):
+        hours, minutes = text.split(":")
+        minute = int(hours) * 60 + int(minutes)
+        if minute > Tariff.DAY_MINUTES or int(minutes) >= 60:
+            raise ValueError("Wrong time '{}'".format(text))
+        return minute
+
+    @staticmethod
+    def week_minute(ts=None):
+        t = time.localtime(ts)
+        return t.tm_wday * Tariff.DAY_MINUTES + t.tm_hour * 60 + t.tm_min
+
+    def price_at(self, ts=None):
+        """Price by hour at wall time ts, default - now"""
+        if not self.rules:
+            return self.price
+        return self.__prices[Tariff.week_minute(ts)]
+
+    def rate_at(self, ts=None):
+        """Rate (price by second) at wall time ts, default - now"""
+        return self.__rates[Tariff.week_minute(ts) if self.rules else 0]
+
+
+class TariffTable:
+    """
+    Tariffs of [Tariffs] config section, parsed and validated once, shared by all channels
+    Table not changed after creation, reload creates new table
+    """
+
+    def __init__(self, tariffs=()):
+        """
+        :param tariffs  Tariff's in order of config
+        """
+        self.tariffs = {t.name: t for t in tariffs}
+
+    @staticmethod
+    def from_config(config):
+        """Table by config, wrong tariffs skipped"""
+        tariffs = []
+        if config.has_section(pt.TARIFFS_CONF_SECTION):
+            for name, value in config[pt.TARIFFS_CONF_SECTION].items():
+                try:
+                    tariffs.append(Tariff.parse(name, value))
+                except ValueError as e:
+                    print("TariffTable: tariff '{}' skipped: {}".format(name, e), file=sys.stderr)
+        return TariffTable(tariffs)
+
+    def get(self, name):
+        return self.tariffs.get(name)
+
+    def names(self):
+        return list(self.tariffs)
+
+    def prices(self, ts=None):
+        """:return: dict {name: price by hour at ts, ...}"""
+        return {name: t.price_at(ts) for name, t in self.tariffs.items()}
+
+    def __contains__(self, name):
+        return name in self.tariffs
+
+    def __len__(self):
+        return len(self.tariffs)
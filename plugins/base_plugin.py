@@ -24,6 +24,7 @@ class PTBasePlugin(metaclass=ABCMeta):
     def __init__(self):
         super().__init__()
         self.__activated = False
+        self.__switch_listener = None
 
     @abstractmethod
     def get_info(self):
@@ -63,11 +64,35 @@ class PTBasePlugin(metaclass=ABCMeta):
     @abstractmethod
     def switch(self, channel, state):
         """Switch channel on/off
+        Method must return right away, without waiting for device.
+        Result of switching reported later by switch_done()
         :param: channel Channel to switch int
         :param: state State of chanel bool
         :raises SwitchException, Exception"""
         pass
 
+    def switch_many(self, channels):
+        """Switch some channels at once
+        Plugins may override it for merging changes into less device writes.
+        Results reported by switch_done() for each channel
+        :param: channels Dict {channel: state, ...}
+        :raises SwitchException, Exception"""
+        for channel, state in channels.items():
+            self.switch(channel, state)
+
+    def set_switch_listener(self, listener):
+        """Set listener for results of switching
+        :param: listener Callable(channel: int, state: bool, error: Exception or None)"""
+        self.__switch_listener = listener
+
+    def switch_done(self, channel, state, error=None):
+        """Report result of switching to listener, may be called from any thread
+        :param: channel Switched channel int
+        :param: state State of chanel bool
+        :param: error None on success or exception"""
+        if self.__switch_listener:
+            self.__switch_listener(channel, state, error)
+
     @abstractmethod
     def activate(self):
         """
@@ -78,6 +103,13 @@ class PTBasePlugin(metaclass=ABCMeta):
         """
         return False
 
+    def activation_errors(self):
+        """
+        Errors of last activation, when plugin activated partially
+        :return: dict {device name: error str, ...}
+        """
+        return {}
+
     @abstractmethod
     def deactivate(self):
         """
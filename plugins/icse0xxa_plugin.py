@@ -1,24 +1,31 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from devices.icse0xxa import ICSE0XXADevice
 from plugins.base_plugin import PTBasePlugin, ActivateException, SwitchException, NoDevicesException
 from PySide.QtGui import (QFrame, QHBoxLayout, QVBoxLayout, QListView, QStandardItemModel, QStandardItem,
                           QPushButton, QLabel, QIcon, QApplication, QMessageBox, QPixmap)
-from PySide.QtCore import QSize, QModelIndex, Qt
+from PySide.QtCore import QSize, QModelIndex, Qt, QCoreApplication
 
 # Windows PortStateNotificatorWin
 from ctypes import *
 from PySide.QtCore import QObject, Signal
-from win32.lib import win32con
-from win32 import win32gui
-from win32 import win32api
-
-# Linux PortStateNotificatorWin
-import os
-if os.name == "linux":
-    import pyudev
+if sys.platform == "win32":
+    from win32.lib import win32con
+    from win32 import win32gui
+    from win32 import win32api
+
+# Linux PortStateNotificatorLinux
+from PySide.QtCore import QSocketNotifier
+pyudev = None
+if sys.platform.startswith("linux"):
+    try:
+        import pyudev
+    except ImportError:
+        pass
 
 """
 Classes for listen enable/disable ports to re-init icse00xa module 
@@ -30,12 +37,20 @@ Classes for listen enable/disable ports to re-init icse00xa module
 class ICSE0XXAPlugin(PTBasePlugin):
     """Plugin for control ICSE0XXA devices"""
 
+    # Max time for initialization of one device (seconds)
+    INIT_TIMEOUT = 3.0
+
     def __init__(self):
         super().__init__()
         # Structure of __channels : {global number of channel: [device, local number of channel], ...}
         self.__channels = {}
+        # Devices failed on last activation: {device name: error str, ...}
+        self.__failed = {}
         self.__activated = False
         self.settings = None
+        # Hot-plug listener, created on first activation in Qt main thread
+        self.__notificator = None
+        self.__ui_call = None
         self.__dev_list = self.load_devs_from_config()
 
     def set_devices(self, devs):
@@ -64,45 +79,174 @@ class ICSE0XXAPlugin(PTBasePlugin):
 
     def get_channels_count(self):
         self.__check_activated()
-        count = 0
-        for d in self.__dev_list:
-            count += d.relays_count()
-        return count
+        return len(self.__channels)
 
     def get_channels_info(self):
         return self.__channels
 
     def switch(self, channel, state):
+        self.switch_many({channel: state})
+
+    def switch_many(self, channels):
         self.__check_activated()
-        if channel + 1 > len(self.__channels):
-            raise SwitchException(
-                "Channel {}  biggest of total channels {} "
-                "on connected devices.".format(channel + 1, len(self.__channels))
-            )
-        dev, ch = self.__channels[channel]
-        dev.switch_relay(ch, state)
+        # Group changes by devices:
+        # {dev: [{local channel: state, ...}, {global channel: state, ...}], ...}
+        by_device = {}
+        for channel, state in channels.items():
+            if channel + 1 > len(self.__channels):
+                raise SwitchException(
+                    "Channel {}  biggest of total channels {} "
+                    "on connected devices.".format(channel + 1, len(self.__channels))
+                )
+            dev, ch = self.__channels[channel]
+            changes, switched = by_device.setdefault(dev, [{}, {}])
+            changes[ch] = state
+            switched[channel] = state
+        for dev, (changes, switched) in by_device.items():
+            try:
+                dev.switch_relays_async(changes,
+                                        lambda error, switched=switched: self.__report_switched(switched, error))
+            except Exception as e:
+                # Device not ready (init not finished), other devices switched
+                self.__report_switched(switched, e)
+
+    def __report_switched(self, channels, error):
+        for channel, state in channels.items():
+            self.switch_done(channel, state, error)
 
     def activate(self):
         if len(self.__dev_list) == 0:
             raise NoDevicesException("Activation error: No devices!")
+        # Ports renamed after replug or reboot
+        self.__dev_list = ICSE0XXADevice.rebind_ports(self.__dev_list)
+
+        # Init devices at once, each device in own thread
+        self.__failed = {}
+        executor = ThreadPoolExecutor(max_workers=len(self.__dev_list))
+        futures = [executor.submit(d.init_device) for d in self.__dev_list]
+        done, not_done = wait(futures, timeout=ICSE0XXAPlugin.INIT_TIMEOUT)
+        executor.shutdown(wait=False)
+        initialized = []
+        for d, f in zip(self.__dev_list, futures):
+            if f in not_done:
+                self.__failed[d.name()] = "device not responding for {} s".format(ICSE0XXAPlugin.INIT_TIMEOUT)
+                f.add_done_callback(lambda f, d=d: self.__init_finished_late(d, f))
+            elif f.exception():
+                self.__failed[d.name()] = str(f.exception())
+                if d.id() in ICSE0XXADevice.MODELS:
+                    # Reinitialized on replug
+                    d.set_unplugged()
+            else:
+                initialized.append(d)
+                print("ICSE0XXAPlugin.activate():", d, "initialized")
+        for name, error in self.__failed.items():
+            print("ICSE0XXAPlugin.activate():", name, "failed:", error)
+
+        if not initialized:
+            raise ActivateException(
+                "Activation error: No one device initialized!\n" +
+                "\n".join("{}: {}".format(name, error) for name, error in self.__failed.items())
+            )
 
-        # Init devices
-        for d in self.__dev_list:
-            d.init_device()
-            print("ICSE0XXAPlugin.activate():", d, "initialized")
-            # DEBUG. Delete this below and uncomment above
-            # d._ICSE0XXADevice__initialized = True
-
+        # Failed devices keep their channels, so channels numbers of devices don't depend on failures,
+        # switches of failed device reported as failed until device reinitialized on replug
+        self.__channels = {}
         relay = 0
         for d in self.__dev_list:
-            for r in range(0, d.relays_count()):
+            if d.id() not in ICSE0XXADevice.MODELS:
+                continue
+            for r in range(0, ICSE0XXADevice.RELAYS[d.id()]):
                 self.__channels[r + relay] = [d, r]
             relay += r + 1
-        self.__activated = len(self.__dev_list) > 0
+        self.__activated = True
+        self.__watch_ports()
         return self.__activated
 
+    def __init_finished_late(self, dev, future):
+        """Init of device not responded in INIT_TIMEOUT finished, called from init thread"""
+        if future.exception() is None:
+            print("ICSE0XXAPlugin.activate():", dev, "initialized late")
+        elif self.__activated and dev.id() in ICSE0XXADevice.MODELS:
+            dev.set_unplugged()
+        else:
+            # Don't leave port opened
+            dev.close()
+
+    def __watch_ports(self):
+        """
+        Listen ports state for hot-plug, notifications need Qt event loop,
+        activation may run out of UI thread, so notificator created in Qt main thread
+        """
+        if self.__ui_call is not None or QCoreApplication.instance() is None:
+            return
+        self.__ui_call = UiThreadCall()
+        self.__ui_call.call.emit(self.__create_notificator)
+
+    def __create_notificator(self):
+        try:
+            self.__notificator = port_state_notificator()
+        except Exception as e:
+            print("ICSE0XXAPlugin: ports state not watched:", e, file=sys.stderr)
+            return
+        if self.__notificator is not None:
+            self.__notificator.state_changed.connect(self.port_state_changed)
+
+    def port_state_changed(self, port, connected):
+        """
+        Port connected or disconnected (hot-plug), only device on this port handled:
+        on unplug device marked disconnected, on replug device initialized again and relays restored,
+        other devices and ports not touched
+        :param port  Port name
+        :param connected  Port state
+        """
+        if not self.__activated:
+            return
+        dev = next((d for d, r in self.__channels.values() if d.port() == port), None)
+        if dev is None and connected:
+            dev = self.__moved_device(port)
+            if dev is not None:
+                print("ICSE0XXAPlugin:", dev, "moved to", port, "reinitialize")
+                dev.reinit_async(lambda error, dev=dev: self.__device_replugged(dev, error), port=port)
+            return
+        if dev is None:
+            return
+        try:
+            if not connected:
+                print("ICSE0XXAPlugin:", dev, "disconnected")
+                dev.set_unplugged()
+                return
+            print("ICSE0XXAPlugin:", dev, "connected, reinitialize")
+            dev.reinit_async(lambda error, dev=dev: self.__device_replugged(dev, error))
+        except Exception as e:
+            # Init of device on activation not finished yet
+            print("ICSE0XXAPlugin: {} on port {}: {}".format(dev, port, e), file=sys.stderr)
+
+    def __moved_device(self, port):
+        """Unplugged device last known on port by port identity cache (port renamed on replug), or None"""
+        entry = ICSE0XXADevice.IDENTITY_CACHE.lookup(ICSE0XXADevice.port_info(port))
+        if entry is None:
+            return None
+        return next((d for d, r in self.__channels.values()
+                     if d.unplugged() and d.port() == entry["port"] and d.id() == entry["model"]), None)
+
+    def __device_replugged(self, dev, error):
+        """Result of device reinit, called from device I/O thread"""
+        if error:
+            print("ICSE0XXAPlugin: {} not reinitialized: {}".format(dev, error), file=sys.stderr)
+            return
+        # Relays restored by register, switches failed while device unplugged done now
+        register = dev.relays_register()
+        for channel, (d, r) in list(self.__channels.items()):
+            if d is dev:
+                self.switch_done(channel, bool(register & (1 << r)))
+
+    def activation_errors(self):
+        return self.__failed
+
     def deactivate(self):
         # del devices & close ports
+        for d in self.__dev_list:
+            d.close()
         self.__dev_list = []
         self.__channels = {}
         self.__activated = False
@@ -220,7 +364,11 @@ class Settings(QFrame):
     def find_devices(self):
         self.st_lb.setText("Выполняется поиск...")
         QApplication.processEvents()
-        devs = ICSE0XXADevice.find_devices()
+        devs = []
+        for d in ICSE0XXADevice.iter_find_devices():
+            devs.append(d)
+            self.st_lb.setText("Выполняется поиск... найдено: {}".format(len(devs)))
+            QApplication.processEvents()
         if len(devs) == 0:
             self.st_lb.setText("Устройств не найдено")
             QMessageBox.warning(
@@ -283,6 +431,19 @@ class Settings(QFrame):
             print(e)
 
 
+class UiThreadCall(QObject):
+    """Call function in Qt main thread from any thread, by queued signal"""
+    call = Signal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.moveToThread(QCoreApplication.instance().thread())
+        self.call.connect(self.run, Qt.QueuedConnection)
+
+    def run(self, func):
+        func()
+
+
 # PortStateNotificator #################################################################################################
 
 # Windows
@@ -364,7 +525,7 @@ class PortStateNotificatorWin(QObject):
 
         # print("hwnd = {}, msg = {}, wparam = {}, lparam = {}".format(hwnd, msg, wparam, lparam))
 
-        if wparam == DBT_DEVICEARRIVAL or wparam == DBT_DEVICEREMOVECOMPLETE and \
+        if (wparam == DBT_DEVICEARRIVAL or wparam == DBT_DEVICEREMOVECOMPLETE) and \
                 dev_broadcast_hdr.dbch_devicetype == DBT_DEVTYPE_PORT:
             dev_broadcast_port = DEV_BROADCAST_PORT.from_address(lparam)
             port_name = dev_broadcast_port.dbcp_name
@@ -381,26 +542,44 @@ class PortStateNotificatorWin(QObject):
 class PortStateNotificatorLinux(QObject):
     """
     Signal emit when ports state changed
-    :param str - port name
+    :param str - port name, emitted for device node and each of its links (/dev/serial/by-id/...)
     :param bool - connect state
+    udev events read in Qt event loop when monitor socket readable, never blocks
     """
     state_changed = Signal(str, bool)
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, parent=None):
+        super().__init__(parent)
 
         self.context = pyudev.Context()
-        self.monitor = pyudev.Monitor.from_netlink(context)
-        self.monitor.filter_by(subsystem='usb')
-
-        self.listen_state()
-
-    def listen_state(self):
-        for device in iter(self.monitor.poll, None):
-            if device.action == 'add':
-                print('{} connected'.format(device))
-                # do something very interesting here.
-                self.state_changed.emit(device, True)
-            elif device.action == 'del':
-                self.state_changed.emit(device, False)
-                print('{} disconnected'.format(device))
\ No newline at end of file
+        self.monitor = pyudev.Monitor.from_netlink(self.context)
+        self.monitor.filter_by(subsystem="tty")
+        self.monitor.start()
+
+        self.notifier = QSocketNotifier(self.monitor.fileno(), QSocketNotifier.Read, self)
+        self.notifier.activated.connect(self.read_events)
+
+    def read_events(self, fd=None):
+        """Read all received udev events, without waiting"""
+        while True:
+            device = self.monitor.poll(timeout=0)
+            if device is None:
+                break
+            if device.action not in ("add", "remove") or not device.device_node:
+                continue
+            connected = device.action == "add"
+            print("{} {}".format(device.device_node, "connected" if connected else "disconnected"))
+            for port in [device.device_node] + list(device.device_links):
+                self.state_changed.emit(port, connected)
+
+
+def port_state_notificator():
+    """
+    Ports state notificator of current platform
+    :return: PortStateNotificatorWin, PortStateNotificatorLinux or None if platform not supported
+    """
+    if sys.platform == "win32":
+        return PortStateNotificatorWin()
+    if pyudev is not None:
+        return PortStateNotificatorLinux()
+    return None
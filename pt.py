@@ -3,13 +3,17 @@
 
 import os
 import sys
+import signal
+import argparse
 import configparser
 
-from PySide.QtGui import QApplication, QIcon
+from engine.config_store import config_text, write_config_text
 
 
 START_DIR = os.getcwd()
 MAIN_CONF_FILE = "main.conf"
+JOURNAL_DIR = "journal"
+REPORTS_DB = "reports.db"
 VERSION = "1.0.0"
 
 APP_MAIN_SECTION = "Main"
@@ -26,13 +30,14 @@ def read_config(filename=MAIN_CONF_FILE):
 
 
 def write_config(c: configparser.ConfigParser, filename=MAIN_CONF_FILE):
-    with open(filename, "w", encoding="utf-8") as f:
-        c.write(f)
+    """Write config now, atomically. Use SessionEngine.config_store in application"""
+    write_config_text(config_text(c), filename)
     print("Config writen")
 
 
 def set_ui_settings(config):
     """Set some UI settings (font, style, etc, ...)"""
+    from PySide.QtGui import QApplication
     # Style
     QApplication.setStyle(config.get(APP_MAIN_SECTION, "ui_style", fallback=""))
     # Font
@@ -41,10 +46,113 @@ def set_ui_settings(config):
     QApplication.setFont(f)
 
 
+def journal_dir(config):
+    return config.get(APP_MAIN_SECTION, "journal_dir", fallback=JOURNAL_DIR)
+
+
+def start_api(engine, config):
+    """
+    Start local control API, if "api_address" set in [Main]:
+    port on localhost, "host:port" or Unix socket path
+    :return: ApiServer or None
+    """
+    address = config.get(APP_MAIN_SECTION, "api_address", fallback="")
+    if not address:
+        return None
+    from engine.api import ApiServer
+    api = ApiServer(engine, ApiServer.parse_address(address))
+    api.start()
+    return api
+
+
+def open_reports(config):
+    """Open reports database over sessions journal"""
+    from engine.journal import SessionJournal
+    from engine.reports import ReportStore
+    journal = SessionJournal(journal_dir(config))
+    os.makedirs(journal.directory, exist_ok=True)
+    return ReportStore(os.path.join(journal.directory, REPORTS_DB), journal)
+
+
+def report(config, args):
+    """Print revenue report (--report)"""
+    from engine.reports import print_report, parse_date
+    store = open_reports(config)
+    try:
+        print_report(store, parse_date(args.report[0]), parse_date(args.report[1]),
+                     None if args.channel is None else args.channel - 1, args.tariff, args.group)
+    finally:
+        store.close()
+
+
+def headless(config, simulate=None):
+    """
+    Run session engine without UI (--headless), until SIGINT or SIGTERM
+    :param simulate  Virtual ICSE0XXA boards spec (--simulate), used instead of devices from config
+    """
+    from engine.engine import SessionEngine
+    engine = SessionEngine(config)
+    engine.open()
+    engine.load_plugins()
+    if simulate:
+        from devices.simulator import SimulatedBus
+        bus = SimulatedBus.from_spec(simulate)
+        bus.install()
+        for plugin in engine.plugins:
+            if hasattr(plugin, "set_devices"):
+                plugin.set_devices(bus.devices())
+        print("headless: simulated boards:", len(bus.boards))
+    for plugin, errors in engine.activate_plugins_on_start().items():
+        for e in errors:
+            print("ERR: activate {}: {}".format(plugin, e), file=sys.stderr)
+    engine.build_channels()
+    print("headless: {} channel(s)".format(len(engine.channels)))
+    api = start_api(engine, config)
+
+    signal.signal(signal.SIGINT, lambda signum, frame: engine.shutdown())
+    signal.signal(signal.SIGTERM, lambda signum, frame: engine.shutdown())
+    try:
+        engine.run_forever()
+    finally:
+        if api:
+            api.stop()
+        engine.config_store.save()
+        engine.close()
+        for plugin in engine.activated_plugins():
+            plugin.deactivate()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="pt.py", description="PowerTime")
+    parser.add_argument("--report", nargs=2, metavar=("FROM", "TO"),
+                        help="print revenue report for sessions started in [FROM, TO), "
+                             "format: YYYY-MM-DD or \"YYYY-MM-DD HH:MM\"")
+    parser.add_argument("--channel", type=int, help="report only this channel (from 1)")
+    parser.add_argument("--tariff", help="report only this tariff")
+    parser.add_argument("--group", choices=("day", "hour", "channel", "tariff"), default="day",
+                        help="report grouping")
+    parser.add_argument("--headless", action="store_true",
+                        help="run sessions engine without UI, plugins from [Plugins] activated")
+    parser.add_argument("--simulate", metavar="MODEL:COUNT,...",
+                        help="with --headless: use virtual ICSE0XXA boards, e.g. ICSE014A:16,ICSE012A:2")
+    return parser.parse_known_args(argv)[0]
+
+
 if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    config = read_config(MAIN_CONF_FILE)
+
+    if args.report:
+        report(config, args)
+        sys.exit(0)
+
+    if args.headless:
+        headless(config, args.simulate)
+        sys.exit(0)
+
+    from PySide.QtGui import QApplication, QIcon
     from ui.main import MainWindow
 
-    config = read_config(MAIN_CONF_FILE)
     app = QApplication(sys.argv)
 
     # Set some UI settings
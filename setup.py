@@ -3,7 +3,7 @@ from setuptools import setup
 setup(
     name='PowerTime',
     version='1.0.0',
-    packages=['ui', 'res', 'devices', 'plugins'],
+    packages=['ui', 'res', 'devices', 'plugins', 'engine'],
     url='',
     license='LGPL',
     author='drunia',
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+
+from PySide.QtCore import Qt, QAbstractListModel, QModelIndex
+from PySide.QtGui import QAbstractScrollArea, QMessageBox
+
+from engine.engine import ControlMode
+from ui.timer_control import TimerCashControl
+
+
+class ChannelModel(QAbstractListModel):
+    """
+    Channels of SessionEngine for views
+    State kept in engine channels (Channel with __slots__), model only exposes it to views
+    """
+
+    # Channel state dict (Channel.state())
+    StateRole = Qt.UserRole
+
+    def __init__(self, engine, channel_name="Канал "):
+        """
+        :param engine  SessionEngine
+        :param channel_name  Title of channel before number
+        """
+        super().__init__()
+        self.engine = engine
+        self.channel_name = channel_name
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.engine.channels)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.engine.channels):
+            return None
+        ch = self.engine.channels[index.row()]
+        if role == Qt.DisplayRole:
+            return self.title(ch.number)
+        if role == Qt.ToolTipRole:
+            return ch.info
+        if role == ChannelModel.StateRole:
+            return ch.state()
+        return None
+
+    def title(self, channel):
+        return self.channel_name.strip() + " " + str(channel + 1)
+
+    def reset(self):
+        """Channels rebuilt by engine"""
+        self.beginResetModel()
+        self.endResetModel()
+
+    def channel_changed(self, channel):
+        index = self.index(channel)
+        self.dataChanged.emit(index, index)
+
+
+class ChannelGrid(QAbstractScrollArea):
+    """
+    Virtualized grid of ChannelModel channels
+    TimerCashControl's created only for visible cells and rebound to other channels on scroll,
+    so count of widgets depends on window size, not on channels count
+    """
+
+    # Cell size limits, by TimerCashControl size limits
+    CELL_MIN_WIDTH = 320
+    CELL_MAX_WIDTH = 480
+    CELL_HEIGHT = 320
+    SPACING = 6
+
+    def __init__(self, parent, model):
+        """
+        :param parent  Window with SessionEngine in engine and ConfigParser in config
+        :param model  ChannelModel
+        """
+        super().__init__(parent)
+        self.model = model
+        # Created controls, bound and free
+        self.controls = []
+        # Bound controls: {channel: TimerCashControl, ...}
+        self.bound = {}
+        self.cols = 1
+        self.cell_width = ChannelGrid.CELL_MIN_WIDTH
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.model.modelReset.connect(self.reset)
+
+    @property
+    def row_height(self):
+        return ChannelGrid.CELL_HEIGHT + ChannelGrid.SPACING
+
+    def control(self, channel):
+        """Control of channel, None if channel not visible"""
+        return self.bound.get(channel)
+
+    def reset(self):
+        """Channels rebuilt, all controls bound again"""
+        for control in self.bound.values():
+            control.unbind()
+            control.hide()
+        self.bound.clear()
+        self.relayout()
+
+    def relayout(self):
+        """Columns and scroll range by channels count and viewport size"""
+        count = self.model.rowCount()
+        width = self.viewport().width()
+        spacing = ChannelGrid.SPACING
+        cols = 4 if (count // 5) > 0 else 2
+        cols = max(1, min(cols, (width - spacing) // (ChannelGrid.CELL_MIN_WIDTH + spacing)))
+        self.cols = cols
+        self.cell_width = max(ChannelGrid.CELL_MIN_WIDTH,
+                              min(ChannelGrid.CELL_MAX_WIDTH, (width - spacing) // cols - spacing))
+        rows = math.ceil(count / cols)
+        height = rows * self.row_height + spacing
+        bar = self.verticalScrollBar()
+        bar.setRange(0, max(0, height - self.viewport().height()))
+        bar.setPageStep(self.viewport().height())
+        bar.setSingleStep(self.row_height // 4)
+        self.update_controls()
+
+    def update_controls(self):
+        """Bind controls to visible channels, place controls by scroll position"""
+        count = self.model.rowCount()
+        scroll = self.verticalScrollBar().value()
+        first_row = scroll // self.row_height
+        last_row = (scroll + self.viewport().height()) // self.row_height
+        visible = range(min(count, first_row * self.cols), min(count, (last_row + 1) * self.cols))
+
+        # Free controls of hidden channels
+        for channel in [ch for ch in self.bound if ch not in visible]:
+            control = self.bound.pop(channel)
+            control.unbind()
+            control.hide()
+        free = [c for c in self.controls if c.channel is None]
+
+        spacing = ChannelGrid.SPACING
+        left = max(spacing, (self.viewport().width() - self.cols * (self.cell_width + spacing) + spacing) // 2)
+        for channel in visible:
+            control = self.bound.get(channel)
+            if control is None:
+                if free:
+                    control = free.pop()
+                else:
+                    control = TimerCashControl(self.viewport(), channel)
+                    self.controls.append(control)
+                self.bind(control, channel)
+                self.bound[channel] = control
+            row, col = divmod(channel, self.cols)
+            control.setGeometry(left + col * (self.cell_width + spacing),
+                                spacing + row * self.row_height - scroll,
+                                self.cell_width, ChannelGrid.CELL_HEIGHT)
+            control.show()
+
+    def bind(self, control, channel):
+        index = self.model.index(channel)
+        control.bind(channel)
+        control.tittle_lb.setText(self.model.data(index, Qt.DisplayRole))
+        control.tittle_lb.setToolTip(self.model.data(index, Qt.ToolTipRole))
+
+    def channel_event(self, event, channel, data):
+        """Engine event of channel, in UI thread"""
+        if channel >= self.model.rowCount():
+            return
+        self.model.channel_changed(channel)
+        control = self.bound.get(channel)
+        if control:
+            control.engine_event(event, data)
+        elif event == "time_out" and data["mode"] != ControlMode.FREE.name:
+            # Channel not visible
+            QMessageBox.information(self, self.model.title(channel), "Время вышло!", QMessageBox.Ok)
+
+    def update_tariffs(self, tariffs):
+        for control in self.controls:
+            control.update_tariffs(tariffs)
+
+    def scrollContentsBy(self, dx, dy):
+        self.update_controls()
+
+    def resizeEvent(self, evt):
+        super().resizeEvent(evt)
+        self.relayout()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+from PySide.QtCore import QObject, QTimer
+
+
+class ClockDriver(QObject):
+    """
+    One timer for all TimerCashControl's
+    Ticks dispatched only to subscribed (running or paused) controls
+    """
+
+    # Tick interval (ms)
+    INTERVAL = 250
+
+    _instance = None
+
+    @staticmethod
+    def instance():
+        """Shared clock driver"""
+        if ClockDriver._instance is None:
+            ClockDriver._instance = ClockDriver()
+        return ClockDriver._instance
+
+    def __init__(self, interval=INTERVAL):
+        super().__init__()
+        # Subscribed controls, dict used as ordered set
+        self.__controls = {}
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self._tick)
+        self.reset_stats()
+
+    def subscribe(self, control):
+        """Dispatch ticks to control, control must have _timer_event()"""
+        self.__controls[control] = None
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def unsubscribe(self, control):
+        self.__controls.pop(control, None)
+        if not self.__controls:
+            self.timer.stop()
+
+    def subscribers(self):
+        return len(self.__controls)
+
+    def _tick(self):
+        started = time.perf_counter()
+        for control in list(self.__controls):
+            control._timer_event()
+        cost = time.perf_counter() - started
+        self.__ticks += 1
+        self.__total_cost += cost
+        self.__last_cost = cost
+        self.__max_cost = max(self.__max_cost, cost)
+
+    def stats(self):
+        """
+        Cost of ticks dispatching since last reset_stats()
+        :return: dict {ticks: int, subscribers: int, last_ms: float, avg_ms: float, max_ms: float}
+        """
+        return {
+            "ticks": self.__ticks,
+            "subscribers": self.subscribers(),
+            "last_ms": self.__last_cost * 1000,
+            "avg_ms": (self.__total_cost / self.__ticks * 1000) if self.__ticks else 0.0,
+            "max_ms": self.__max_cost * 1000
+        }
+
+    def reset_stats(self):
+        self.__ticks = 0
+        self.__total_cost = 0.0
+        self.__last_cost = 0.0
+        self.__max_cost = 0.0
+
@@ -2,11 +2,26 @@
 # -*- coding: utf-8 -*-
 
 import os
+import threading
 
 from PySide.QtGui import *
-from PySide.QtCore import Qt, QSize
+from PySide.QtCore import Qt, QSize, QObject, Signal
 from ui.timer_control import *
 from ui.settings import Settings
+from ui.channel_grid import ChannelModel, ChannelGrid
+from engine.engine import SessionEngine
+
+
+class EngineBridge(QObject):
+    """
+    Deliver engine events from engine and plugins I/O threads into UI thread
+    :param str - event
+    :param object - channel number or None
+    :param object - event data dict
+    """
+    engine_event = Signal(str, object, object)
+    # Background task done: callback(future), future
+    task_done = Signal(object, object)
 
 
 class MainWindow(QMainWindow):
@@ -16,19 +31,32 @@ class MainWindow(QMainWindow):
         super().__init__()
 
         self.config = config
-        self.loaded_plugins = []
-        self.plugin_controls = []
         self.settings = None
 
-        self.plugins = self.find_plugins()
-        self._load_plugins()
+        # Sessions, plugins and relays in engine, window is a client of engine
+        self.engine = SessionEngine(config)
+        self.engine.open()
+        self.engine_bridge = EngineBridge()
+        # Queued: engine events handled in UI thread, out of engine lock
+        self.engine_bridge.engine_event.connect(self.engine_event, Qt.QueuedConnection)
+        self.engine.add_listener(self.engine_bridge.engine_event.emit)
+        self.engine_bridge.task_done.connect(lambda done, future: done(future), Qt.QueuedConnection)
+        self.loaded_plugins = self.engine.load_plugins()
+        # Sessions expiry
+        self.engine_thread = threading.Thread(target=self.engine.run_forever, name="SessionEngine", daemon=True)
+        self.engine_thread.start()
+        # Local control API
+        self.api = None
+        try:
+            self.api = pt.start_api(self.engine, config)
+        except Exception as e:
+            print("ERR: start_api():", e)
 
         self._setup_ui()
 
         if config.has_section(pt.APP_MAIN_SECTION):
             if config.getboolean(pt.APP_MAIN_SECTION, "activate_plugin_on_start", fallback=False):
                 self._activate_plugins_on_start()
-                self.add_plugin_controls()
 
     def _setup_ui(self):
         self.setWindowTitle("PowerTime")
@@ -56,22 +84,24 @@ class MainWindow(QMainWindow):
         self.menu_settings.aboutToShow.connect(self._init_settings)
         menubar.addMenu(self.menu_settings)
 
+        # Control menu
+        self.menu_control = QMenu("Управление", self)
+        stop_all_action = QAction("Остановить все", self)
+        stop_all_action.setStatusTip("Завершить сеансы на всех каналах")
+        stop_all_action.triggered.connect(self.stop_all)
+        self.menu_control.addAction(stop_all_action)
+        menubar.addMenu(self.menu_control)
+
         # Devices menu (plugins)
         self.menu_devices = QMenu("Модули устройств", self)
         self.menu_devices.addActions(self._build_devices_actions())
         self.menu_devices.aboutToShow.connect(self.devices_menu_show)
         menubar.addMenu(self.menu_devices)
 
-        # Central widget
-        self.control_frame = QFrame()
-        self.control_frame.setLayout(QGridLayout())
-
-        self.scroll_area = QScrollArea(self.centralWidget())
-        self.scroll_area.setWidgetResizable(True)
-
-        scroll_vbox_lay = QVBoxLayout(self.scroll_area.viewport())
-        scroll_vbox_lay.addWidget(self.control_frame, alignment=Qt.AlignCenter)
-        self.setCentralWidget(self.scroll_area)
+        # Central widget: grid with controls of visible channels only
+        self.channel_model = ChannelModel(self.engine)
+        self.channel_grid = ChannelGrid(self, self.channel_model)
+        self.setCentralWidget(self.channel_grid)
 
         # Statusbar
         self.statusBar().showMessage("Вeрсия: " + QApplication.applicationVersion())
@@ -79,56 +109,56 @@ class MainWindow(QMainWindow):
 
         self.show()
 
+    def run_in_background(self, func, done):
+        """
+        Run func out of UI thread, plugin hung in func doesn't freeze window
+        :param func  Callable without arguments
+        :param done  Callable(future), called in UI thread when func finished
+        :return: concurrent.futures.Future of func result
+        """
+        future = self.engine.run_async(func)
+        future.add_done_callback(lambda f: self.engine_bridge.task_done.emit(done, f))
+        return future
+
     def add_plugin_controls(self):
         """Add switchable controls for controlling active plugin"""
-        all_channels_info = {}
-        for plugin in self._get_activated_plugins():
-            for k, v in plugin.get_channels_info().items():
-                info = v.copy()
-                info.append(plugin)
-                all_channels_info[k] = info
-        channels = len(all_channels_info)
-
-        # DEBUG
-        #channels = 4
-
-        cols = 4 if (channels // 5) > 0 else 2
-        print("total channels:", channels)
-
-        # Delete all old controls
-        for c in self.plugin_controls:
-            c.close()
-        self.plugin_controls.clear()
-
-        for channel in range(channels):
-            control = TimerCashControl(self, channel)
-            self.control_frame.layout().addWidget(control, (channel // cols), channel % cols)
-            self.plugin_controls.append(control)
-            control.switched.connect(self.switch_event)
-            if all_channels_info:
-                # Set the plugin info on tittle
-                ch_info = all_channels_info[channel]
-                plugin_info = ch_info[2].get_info()["plugin_name"] + \
-                              " - " + str(ch_info[0]) + " - channel: " + str(ch_info[1])
-                control.tittle_lb.setToolTip(plugin_info)
-                if self.config.has_option(pt.APP_MAIN_SECTION, "default_channel_name"):
-                    control.set_control_tittle(self.config.get(pt.APP_MAIN_SECTION, "default_channel_name"))
-        self.scroll_area.setWidget(self.control_frame)
-
-    def switch_event(self, control, state: bool):
-        try:
-            plugin = self.loaded_plugins[0]
-            plugin.switch(control.channel, state)
-        except Exception as e:
-            print(e)
+        self.engine.build_channels()
+        if self.config.has_option(pt.APP_MAIN_SECTION, "default_channel_name"):
+            self.channel_model.channel_name = self.config.get(pt.APP_MAIN_SECTION, "default_channel_name")
+        # Grid rebinds its controls to new channels
+        self.channel_model.reset()
+
+    def stop_all(self):
+        """Stop sessions on all channels"""
+        if all(ch.stopped() for ch in self.engine.channels):
+            return
+        if QMessageBox.question(self, "Остановить все", "Завершить сеансы на всех каналах?",
+                                QMessageBox.Yes | QMessageBox.No) == QMessageBox.No:
+            return
+        self.engine.stop_all()
+
+    def engine_event(self, event, channel, data):
+        """Engine event in UI thread"""
+        if event == "switch_result":
+            self.switch_result_event(data["plugin"], channel, data["state"], data["error"], data["plugin_channel"])
+        elif event == "tariffs":
+            self.channel_grid.update_tariffs(data)
+        elif channel is not None:
+            self.channel_grid.channel_event(event, channel, data)
+
+    def switch_result_event(self, plugin, channel, state, error, plugin_channel=None):
+        if error:
+            if channel is None:
+                # Channel of plugin not shown
+                msg = "Ошибка переключения канала {} модуля: {}".format(plugin_channel + 1, error)
+            else:
+                msg = "Ошибка переключения канала {}: {}".format(channel + 1, error)
+            self.statusBar().showMessage(msg, 10000)
+            print("ERR: switch_result_event():", plugin.get_info()["plugin_name"], msg)
 
     def _get_activated_plugins(self):
         """Returned activated plugins list"""
-        l = []
-        for p in self.loaded_plugins:
-            if p.get_info()["activated"]:
-                l.append(p)
-        return l
+        return self.engine.activated_plugins()
 
     def save_config(self):
         import pt
@@ -149,15 +179,16 @@ class MainWindow(QMainWindow):
                     self.config.add_section(pt.PLUGINS_CONF_SECTION)
                 self.config[pt.PLUGINS_CONF_SECTION][plugin.get_info()["plugin_name"]] = \
                     str(plugin.get_info()["activated"])
-        try:
-            pt.write_config(self.config)
-        except Exception as e:
-            print(e)
+        # Written in background, on close engine waits for writing
+        self.engine.config_store.save()
         del pt
 
     def closeEvent(self, e):
         # Save settings, when main window close
         self.save_config()
+        if self.api:
+            self.api.stop()
+        self.engine.close()
 
     def devices_menu_show(self):
         for action in self.menu_devices.actions():
@@ -167,57 +198,24 @@ class MainWindow(QMainWindow):
             else:
                 action.setIcon(QIcon("./res/off.ico"))
 
-    def find_plugins(self, plugins_dir="./plugins"):
-        """Search device-plugins in modules dir
-        :return list[Plugin_Class...,]"""
-        import pkgutil
-        import inspect
-        plugins = []
-        # Find modules with classes inherited from PTBasePlugin
-        mod_info_list = list(pkgutil.iter_modules([plugins_dir]))
-        for module in mod_info_list:
-            m = __import__("plugins." + module[1], fromlist=['object'])
-            classlist = inspect.getmembers(m, inspect.isclass)
-            for cls in classlist:
-                bases = cls[1].__mro__
-                for b in bases:
-                    if b.__name__ == "PTBasePlugin" and not cls[1].__name__ == "PTBasePlugin":
-                        print("{}(): Plugin class finded: {}".format(inspect.stack()[0][3], cls[1].__name__))
-                        plugins.append(cls[1])
-                        break
-        del pkgutil
-        del inspect
-        print("find_plugins():", len(plugins))
-        return plugins
-
-    def _load_plugins(self):
-        for plugin, plug_num in zip(self.plugins, range(len(self.plugins))):
-            print("load plugin:", plug_num, plugin.__name__)
-            self.loaded_plugins.append(plugin())
-
     # Activates plugin from main.conf file
     def _activate_plugins_on_start(self):
-        import pt
-        if self.config.has_section(pt.PLUGINS_CONF_SECTION):
-            for plugin, active_state in self.config[pt.PLUGINS_CONF_SECTION].items():
-                if str(active_state).lower() == "true":
-                    errors = []
-                    for p in self.loaded_plugins:
-                        if p.get_info()["plugin_name"] == plugin:
-                            try:
-                                print("_activate_plugins_on_start():", plugin)
-                                p.activate()
-                            except Exception as e:
-                                errors.append(e)
-                    # Show errors
-                    if errors:
-                        err_str = ""
-                        for e in errors:
-                            err_str += plugin + ": " + str(e) + "\n"
-                        err_str = err_str[:-1]
-                        QMessageBox.critical(self, "Активация " + plugin, err_str, QMessageBox.Ok)
-                        print("ERR: _activate_plugins_on_start():", err_str)
-        del pt
+        self.statusBar().showMessage("Активация модулей...")
+        self.run_in_background(self.engine.activate_plugins_on_start, self._plugins_activated_on_start)
+
+    def _plugins_activated_on_start(self, future):
+        """Activation on start finished, in UI thread"""
+        self.statusBar().clearMessage()
+        try:
+            errors = future.result()
+        except Exception as e:
+            errors = {"": [str(e)]}
+        for plugin, plugin_errors in errors.items():
+            # Show errors
+            err_str = "\n".join(plugin + ": " + e for e in plugin_errors)
+            QMessageBox.critical(self, "Активация " + plugin, err_str, QMessageBox.Ok)
+            print("ERR: _activate_plugins_on_start():", err_str)
+        self.add_plugin_controls()
 
     def _build_devices_actions(self):
         """
@@ -332,19 +330,14 @@ class PluginSettings(QDialog):
     def activate_plugin(self):
         try:
             if not self.plugin.get_info()["activated"]:
-                if not self.plugin.devices():
-                    self.plugin.load_devs_from_config()
-                self.plugin.activate()
-                self.activate_btn.setIcon(QIcon("./res/on.ico"))
-                self.activate_btn.setText("Деактивировать")
-                print(self.plugin.get_info()["plugin_name"],
-                      "activate successfully, plugin with ", self.plugin.get_channels_count(), "relays")
-                # Add plugin devices to listview
-                self.plugin.settings.build_dev_list(self.plugin.devices())
+                # Plugin activated out of UI thread, result in plugin_activated()
+                self.activate_btn.setEnabled(False)
+                self.activate_btn.setText("Активация...")
+                self.parent().run_in_background(self.__activate, self.plugin_activated)
             else:
                 # Check if plugin used in this time
-                for p_control in self.parent().plugin_controls:
-                    if not p_control.stopped:
+                for ch in self.parent().engine.channels:
+                    if not ch.stopped():
                         if QMessageBox.warning(
                                 self, "Внимание!",
                                 "В данный момент плагин находится в использовании.\n"
@@ -352,17 +345,62 @@ class PluginSettings(QDialog):
                                 "Все равно продолжить ?",
                                 QMessageBox.Yes | QMessageBox.No
                                 ) == QMessageBox.No:
+                            self.activate_btn.setChecked(True)
                             return
-                self.plugin.deactivate()
-                self.activate_btn.setIcon(QIcon("./res/off.ico"))
-                self.activate_btn.setText("Активировать")
-                print(self.plugin.get_info()["plugin_name"], "deactivated")
-            # Rebuild timer controls
-            print("Rebuild timer controls")
-            self.parent().add_plugin_controls()
+                self.activate_btn.setEnabled(False)
+                self.parent().run_in_background(self.plugin.deactivate, self.plugin_deactivated)
         except Exception as e:
             QMessageBox.critical(self, "Ошибка активации", str(e), QMessageBox.Ok)
 
+    def __activate(self):
+        """Activate plugin, called out of UI thread"""
+        if not self.plugin.devices():
+            self.plugin.load_devs_from_config()
+        self.plugin.activate()
+
+    def plugin_activated(self, future):
+        """Activation finished, in UI thread"""
+        self.activate_btn.setEnabled(True)
+        try:
+            future.result()
+            self.activate_btn.setIcon(QIcon("./res/on.ico"))
+            self.activate_btn.setText("Деактивировать")
+            print(self.plugin.get_info()["plugin_name"],
+                  "activate successfully, plugin with ", self.plugin.get_channels_count(), "relays")
+            # Add plugin devices to listview
+            if self.plugin.settings:
+                self.plugin.settings.build_dev_list(self.plugin.devices())
+            # Partially activated
+            errors = self.plugin.activation_errors()
+            if errors:
+                QMessageBox.warning(
+                    self, "Ошибка активации",
+                    "Не удалось инициализировать устройства:\n" +
+                    "\n".join("{}: {}".format(dev_name, error) for dev_name, error in errors.items()),
+                    QMessageBox.Ok)
+        except Exception as e:
+            self.activate_btn.setIcon(QIcon("./res/off.ico"))
+            self.activate_btn.setText("Активировать")
+            self.activate_btn.setChecked(False)
+            QMessageBox.critical(self, "Ошибка активации", str(e), QMessageBox.Ok)
+        # Rebuild timer controls
+        print("Rebuild timer controls")
+        self.parent().add_plugin_controls()
+
+    def plugin_deactivated(self, future):
+        """Deactivation finished, in UI thread"""
+        self.activate_btn.setEnabled(True)
+        self.activate_btn.setIcon(QIcon("./res/off.ico"))
+        self.activate_btn.setText("Активировать")
+        try:
+            future.result()
+            print(self.plugin.get_info()["plugin_name"], "deactivated")
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка деактивации", str(e), QMessageBox.Ok)
+        # Rebuild timer controls
+        print("Rebuild timer controls")
+        self.parent().add_plugin_controls()
+
     def closeEvent(self, e):
         """On plugin settings close"""
         pass
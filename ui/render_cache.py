@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from PySide.QtCore import Qt, QSize, QPointF
+from PySide.QtGui import QPixmap, QFont, QFontMetrics
+
+
+class LcdRenderCache:
+    """
+    Render cache of QLCDNumber with caption and mode icon
+    Icons loaded and scaled once for all controls,
+    caption font and geometry computed once per widget size
+    """
+
+    # Size of mode icon (pixels)
+    ICON_SIZE = 32
+    # Point size of caption font
+    CAPTION_POINT_SIZE = 10
+
+    # Scaled pixmaps: {(file, size): QPixmap, ...}
+    __pixmaps = {}
+
+    def __init__(self, caption, icon_file):
+        """
+        :param caption  Caption text in bottom left corner
+        :param icon_file  Mode icon file
+        """
+        self.caption = caption
+        self.icon = LcdRenderCache.pixmap(icon_file)
+        self.size = None
+        self.font = None
+        self.caption_pos = QPointF()
+        self.digit_width = 0.0
+        self.digit_height = 0.0
+
+    @staticmethod
+    def pixmap(filename, size=ICON_SIZE):
+        """Pixmap of file scaled to size x size, shared by all callers"""
+        key = (filename, size)
+        pixmap = LcdRenderCache.__pixmaps.get(key)
+        if pixmap is None:
+            pixmap = QPixmap(filename)
+            if not pixmap.isNull():
+                pixmap = pixmap.scaled(size, size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            LcdRenderCache.__pixmaps[key] = pixmap
+        return pixmap
+
+    def layout(self, lcd):
+        """
+        Update geometry by current size of lcd
+        :return: self
+        """
+        size = lcd.size()
+        if self.size is None or size != self.size:
+            self.size = QSize(size)
+            self.font = QFont(lcd.font())
+            self.font.setPointSize(LcdRenderCache.CAPTION_POINT_SIZE)
+            half_height = QFontMetrics(self.font).height() / 2
+            self.caption_pos = QPointF(half_height, size.height() - half_height)
+            self.digit_width = size.width() / lcd.digitCount()
+            self.digit_height = size.height() / 2
+        return self
+
+    def draw_caption(self, painter):
+        painter.setFont(self.font)
+        painter.drawText(self.caption_pos, self.caption)
+
+    def draw_icon(self, painter):
+        painter.drawPixmap(5, 5, self.icon)
@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import time
 import pt
 
 from PySide.QtGui import (QWidget, QApplication, QTabWidget, QFrame, QVBoxLayout, QHBoxLayout,
                           QCheckBox, QFormLayout, QSpinBox, QLineEdit, QMessageBox, QPushButton,
-                          QSizePolicy, QStyleFactory, QComboBox)
-from PySide.QtCore import Qt
+                          QSizePolicy, QStyleFactory, QComboBox, QDateEdit, QTableWidget,
+                          QTableWidgetItem, QLabel, QHeaderView)
+from PySide.QtCore import Qt, QDate
+from engine.reports import ReportStore
+from engine.metrics import METRICS
+from ui.clock import ClockDriver
 
 
 class Settings(QWidget):
@@ -18,7 +23,9 @@ class Settings(QWidget):
         self.tab_names = (
             ("Общие", General),
             ("Тарификация", Tariffication),
-            ("Печать квитанций", Printing)
+            ("Печать квитанций", Printing),
+            ("Отчеты", Reports),
+            ("Метрики", Metrics)
         )
         self._setup_ui()
 
@@ -53,6 +60,7 @@ class Settings(QWidget):
             self.tabs.widget(tab_index).set_config()
         pt.set_ui_settings(self.config)
         self.parent().save_config()
+        self.parent().engine.reload_tariffs()
 
     def show(self, tab_index):
         super().show()
@@ -176,6 +184,172 @@ class Printing(QFrame):
         pass
 
 
+class Reports(QFrame):
+    """Revenue reports tab"""
+
+    GROUPS = (("По дням", "day"), ("По часам", "hour"), ("По каналам", "channel"), ("По тарифам", "tariff"))
+
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self.store = None
+        self._setup_ui()
+        self.load_config()
+
+    def _setup_ui(self):
+        today = QDate.currentDate()
+        self.from_date = QDateEdit(today.addDays(-today.day() + 1))
+        self.from_date.setCalendarPopup(True)
+        self.to_date = QDateEdit(today)
+        self.to_date.setCalendarPopup(True)
+
+        # Channel, 0 - all channels
+        self.channel_sb = QSpinBox()
+        self.channel_sb.setMinimum(0)
+        self.channel_sb.setMaximum(999)
+        self.channel_sb.setSpecialValueText("Все")
+
+        self.tariff_cb = QComboBox()
+        self.group_cb = QComboBox()
+        for name, group in Reports.GROUPS:
+            self.group_cb.addItem(name, group)
+
+        self.build_btn = QPushButton("Сформировать")
+        self.build_btn.clicked.connect(self.build_report)
+
+        self.table = QTableWidget(0, 4)
+        self.table.setHorizontalHeaderLabels(["", "Сеансов", "Часов", "Выручка"])
+        self.table.horizontalHeader().setResizeMode(QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.total_lb = QLabel()
+
+        form_lay = QFormLayout()
+        form_lay.addRow("С", self.from_date)
+        form_lay.addRow("По (включительно)", self.to_date)
+        form_lay.addRow("Канал", self.channel_sb)
+        form_lay.addRow("Тариф", self.tariff_cb)
+        form_lay.addRow("Группировка", self.group_cb)
+        form_lay.addRow(self.build_btn)
+
+        root_lay = QHBoxLayout(self)
+        root_lay.addLayout(form_lay)
+        table_lay = QVBoxLayout()
+        table_lay.addWidget(self.table)
+        table_lay.addWidget(self.total_lb, alignment=Qt.AlignRight)
+        root_lay.addLayout(table_lay, 1)
+
+    def load_config(self):
+        """Load config data into form for edit"""
+        self.tariff_cb.clear()
+        self.tariff_cb.addItem("Все", None)
+        if self.config.has_section(pt.TARIFFS_CONF_SECTION):
+            for tariff in self.config[pt.TARIFFS_CONF_SECTION]:
+                self.tariff_cb.addItem(tariff, tariff)
+
+    def set_config(self):
+        """Store data into config, no save!"""
+        pass
+
+    def build_report(self):
+        try:
+            if not self.store:
+                self.store = pt.open_reports(self.config)
+            self.store.update()
+            start = time.mktime(self.from_date.date().toPython().timetuple())
+            end = time.mktime(self.to_date.date().addDays(1).toPython().timetuple())
+            channel = self.channel_sb.value() - 1 if self.channel_sb.value() > 0 else None
+            tariff = self.tariff_cb.itemData(self.tariff_cb.currentIndex())
+            group = self.group_cb.itemData(self.group_cb.currentIndex())
+            rows = self.store.summary(start, end, channel, tariff, group)
+        except Exception as e:
+            print("Reports.build_report():", e)
+            QMessageBox.critical(self, "Отчеты", "Ошибка при формировании отчета:\n" + str(e), QMessageBox.Ok)
+            return
+        self.table.setHorizontalHeaderItem(0, QTableWidgetItem(self.group_cb.currentText()))
+        self.table.setRowCount(len(rows))
+        total_sessions, total_cash = 0, 0.0
+        for row, (key, sessions, duration, charged) in enumerate(rows):
+            values = (ReportStore.format_group(group, key), str(sessions),
+                      "{:.2f}".format(duration / 3600), "{:.2f}".format(charged))
+            for col, value in enumerate(values):
+                self.table.setItem(row, col, QTableWidgetItem(value))
+            total_sessions += sessions
+            total_cash += charged
+        self.total_lb.setText("Всего сеансов: {}, выручка: {:.2f} грн.".format(total_sessions, total_cash))
+
+
+class Metrics(QFrame):
+    """Hot paths metrics tab"""
+
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self._setup_ui()
+        self.load_config()
+        self.refresh()
+
+    def _setup_ui(self):
+        self.enabled_chb = QCheckBox("Собирать метрики")
+        self.enabled_chb.toggled.connect(self.enable)
+
+        self.refresh_btn = QPushButton("Обновить")
+        self.refresh_btn.clicked.connect(self.refresh)
+        self.reset_btn = QPushButton("Сбросить")
+        self.reset_btn.clicked.connect(self.reset)
+
+        self.table = QTableWidget(0, 5)
+        self.table.setHorizontalHeaderLabels(["Метрика", "Количество", "Среднее, мс", "p99, мс", "Макс, мс"])
+        self.table.horizontalHeader().setResizeMode(QHeaderView.Stretch)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.clock_lb = QLabel()
+
+        buttons_lay = QHBoxLayout()
+        buttons_lay.addWidget(self.enabled_chb)
+        buttons_lay.addStretch(1)
+        buttons_lay.addWidget(self.refresh_btn)
+        buttons_lay.addWidget(self.reset_btn)
+
+        root_lay = QVBoxLayout(self)
+        root_lay.addLayout(buttons_lay)
+        root_lay.addWidget(self.table)
+        root_lay.addWidget(self.clock_lb)
+
+    def load_config(self):
+        """Load config data into form for edit"""
+        self.enabled_chb.setChecked(METRICS.enabled)
+
+    def set_config(self):
+        """Store data into config, no save!"""
+        if not self.config.has_section(pt.APP_MAIN_SECTION):
+            self.config.add_section(pt.APP_MAIN_SECTION)
+        self.config[pt.APP_MAIN_SECTION]["metrics"] = str(self.enabled_chb.isChecked())
+
+    def enable(self, enabled):
+        METRICS.enabled = enabled
+
+    def reset(self):
+        METRICS.reset()
+        ClockDriver.instance().reset_stats()
+        self.refresh()
+
+    def refresh(self):
+        rows = METRICS.snapshot()
+        self.table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for col, value in enumerate(values):
+                if value is None:
+                    text = ""
+                elif isinstance(value, float):
+                    text = "{:.3f}".format(value)
+                else:
+                    text = str(value)
+                self.table.setItem(row, col, QTableWidgetItem(text))
+        stats = ClockDriver.instance().stats()
+        self.clock_lb.setText(
+            "Такт: {ticks} тактов, каналов: {subscribers}, среднее: {avg_ms:.3f} мс, "
+            "макс: {max_ms:.3f} мс".format(**stats))
+
+
 if __name__ == "__main__":
     import os
 
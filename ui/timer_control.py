@@ -2,24 +2,19 @@
 # -*- coding: utf-8 -*-
 import datetime
 import enum
+import time
 import pt
 
 from configparser import ConfigParser
-from PySide.QtCore import Qt, QTimer, Signal
+from PySide.QtCore import Qt, Signal
 from PySide.QtGui import (QPaintEvent, QPainter, QPixmap, QPalette, QColor, QLabel, QFrame,
                           QLCDNumber, QComboBox, QPushButton, QVBoxLayout, QHBoxLayout, QMessageBox, QToolTip,
                           QApplication, QWidget, QDialog)
-
-
-class ControlMode(enum.Enum):
-    """Enumeration for control modes"""
-    # Control modes:
-    # FREE - work max to 24 hours
-    # CASH - calculate time by taked cash
-    # TIME - calculating time
-    TIME = 0
-    CASH = 1
-    FREE = 2
+from ui.clock import ClockDriver
+from ui.render_cache import LcdRenderCache
+from engine.engine import ControlMode
+from engine.metrics import timed
+from engine.money import Money
 
 
 class EditTimeMode(enum.Enum):
@@ -30,7 +25,11 @@ class EditTimeMode(enum.Enum):
 
 
 class TimerCashControl(QFrame):
-    """ Control for channel"""
+    """
+    Control for channel
+    Channel state kept in SessionEngine, control sends user actions to engine
+    and displays state on engine events (engine_event())
+    """
 
     """ 
     Switch signal
@@ -49,26 +48,19 @@ class TimerCashControl(QFrame):
     def __init__(self, parent, num_channel: int):
         """
         Create control UI by channel
-        :param parent: Parent component
+        :param parent: Parent component, window of parent with SessionEngine in engine and config
         :param num_channel: Number of switchable channel (from active plugin)
         """
         super().__init__(parent)
 
-        # current control mode
-        self.mode = ControlMode.FREE
-        # all time on current session for audit
-        self.session_time = 0
-        self.time = 0
-        self.cash = 0
-        self.price = 80
+        self.engine = self.window().engine
+        # Cash for display (Money)
+        self.cash = Money(0)
+        # Cash text while edited by user, None - not edited
+        self.cash_text = None
         self.channel = num_channel
         # can displayed time (for blinking time in pause)
         self.displayed = True
-        # timer paused
-        self.paused = False
-        # timer stopped
-        self.stopped = True
-        self.timer_id = 0
         self.edit_time_mode = EditTimeMode.NO_EDIT
         # Edit peace of time
         self.tmp_edit_time = {
@@ -81,27 +73,27 @@ class TimerCashControl(QFrame):
 
         # last second for indicating (blinking) control mode
         self.time_repaint_mode = datetime.datetime.now().second
+        # Last displayed values (time state, cash state), for repaint only on changes, None - repaint all
+        self.displayed_values = None
+        # Blinking mode icons while displayed
+        self.time_blink = False
+        self.cash_blink = False
 
         # Tariffs
-        self.config = self.parent().config
-        if self.config.has_section(pt.TARIFFS_CONF_SECTION):
-            self.tariffs = self.config[pt.TARIFFS_CONF_SECTION]
-        else:
-            self.tariffs = {}
+        self.config = self.window().config
+        self.tariffs = self.engine.tariffs()
 
-        # Timer
-        self.timer = QTimer()
-        self.timer.timerEvent = self._timer_event
-        self.timer_id = self.timer.start(100)
+        # Ticks from shared clock, while control running or paused
+        self.clock = ClockDriver.instance()
 
-        # Icons
-        self.cash_pixmap = QPixmap("./res/cash.png")
-        self.time_pixmap = QPixmap("./res/clock.png")
+        # Captions, icons and geometry of displays
+        self.time_render = LcdRenderCache("Время", "./res/clock.png")
+        self.cash_render = LcdRenderCache("Деньги", "./res/cash.png")
 
         # UI
         self._init_ui()
         self.set_control_tittle()
-        self.display()
+        self.refresh()
 
         # Test timeout signal
         self.switched.connect(
@@ -112,9 +104,129 @@ class TimerCashControl(QFrame):
         # Test change signal
         self.changed.connect(
             lambda *x:
-            print("Change signal:", "channel =", x[0].channel, "state =", x[1])
+            print("Change signal:", "channel =", self.channel, "old time =", x[0], "new time =", x[1])
         )
 
+    @property
+    def ch(self):
+        """Engine channel of control"""
+        return self.engine.channels[self.channel]
+
+    @property
+    def session(self):
+        return self.ch.session
+
+    @property
+    def mode(self):
+        return self.ch.mode
+
+    @mode.setter
+    def mode(self, value):
+        self.engine.set_mode(self.channel, value)
+
+    @property
+    def price(self):
+        return self.ch.price
+
+    @property
+    def rate(self):
+        return self.ch.rate
+
+    @property
+    def stopped(self):
+        return self.ch.stopped()
+
+    @property
+    def paused(self):
+        return self.ch.paused()
+
+    @property
+    def time(self):
+        """Time for display: remaining in paid session, elapsed in free session, or time set while stopped"""
+        return self.ch.time()
+
+    @time.setter
+    def time(self, value):
+        self.engine.set_time(self.channel, value)
+
+    @property
+    def session_time(self):
+        """All time on current session for audit"""
+        return self.ch.session_time()
+
+    def bind(self, channel):
+        """Show other channel in this control, controls reused by channel grid"""
+        self.unbind()
+        self.channel = channel
+        self.set_control_tittle()
+        self.displayed = True
+        self.refresh()
+
+    def unbind(self):
+        """Detach control from channel, editing of channel finished"""
+        if self.channel is None:
+            return
+        for lcd in (self.time_display, self.cash_display):
+            if lcd.hasFocus():
+                lcd.clearFocus()
+        if self.add_dialog:
+            self.add_dialog.close()
+            self.add_dialog = None
+        self.clock.unsubscribe(self)
+        self.displayed_values = None
+        self.channel = None
+
+    # Add paid time to running session
+    def add_time(self, seconds, cash=None):
+        self.engine.add_time(self.channel, seconds, cash)
+
+    def engine_event(self, event, data):
+        """
+        Channel changed in engine, called in UI thread
+        :param event  Engine event: start, pause, resume, add_time, add_cash, stop, time_out, restore, preset, tariff
+        :param data  Channel state on event
+        """
+        if event in ("start", "resume"):
+            self.switched.emit(self, True)
+        elif event in ("pause", "stop", "time_out"):
+            self.switched.emit(self, False)
+        elif event in ("add_time", "add_cash") and data["new_time"] > data["old_time"]:
+            # Send change session signal
+            self.changed.emit(data["old_time"], data["new_time"])
+        self.refresh()
+        if event == "time_out" and data["mode"] != ControlMode.FREE.name:
+            self.notify_time_out()
+
+    def refresh(self):
+        """Update controls by channel state"""
+        stopped, paused = self.stopped, self.paused
+        index = self.tariff_cb.findText(self.ch.tariff)
+        if index >= 0 and index != self.tariff_cb.currentIndex():
+            self.tariff_cb.blockSignals(True)
+            self.tariff_cb.setCurrentIndex(index)
+            self.tariff_cb.blockSignals(False)
+        self.tariff_cb.setDisabled(not stopped)
+        editable = stopped and self.price > 0
+        self.time_display.setFocusPolicy(Qt.ClickFocus if editable else Qt.NoFocus)
+        self.cash_display.setFocusPolicy(Qt.ClickFocus if editable else Qt.NoFocus)
+        if stopped:
+            self.start_btn.setText("Старт")
+            self.clock.unsubscribe(self)
+            self.displayed = True
+            # Close add cash/time dialog if opened
+            if self.add_dialog:
+                self.add_dialog.close()
+                self.add_dialog = None
+        else:
+            self.start_btn.setText("Возобновить" if paused else "Пауза")
+            self.clock.subscribe(self)
+            self.displayed = self.displayed or not paused
+        # Cash edited by user
+        if self.cash_display.hasFocus():
+            return
+        self.displayed_values = None
+        self.display()
+
     def _init_ui(self):
         # Set minimum size
         self.setMinimumSize(320, 300)
@@ -153,7 +265,7 @@ class TimerCashControl(QFrame):
         # $Cash
         self.cash_display = QLCDNumber()
         self.cash_display.setDigitCount(8)
-        self.cash_display.display(self.cash)
+        self.cash_display.display(str(self.cash))
         self.cash_display.setSegmentStyle(QLCDNumber.Flat)
         self.cash_display.paintEvent = self._cash_paint_event
         self.cash_display.setAutoFillBackground(True)
@@ -180,22 +292,7 @@ class TimerCashControl(QFrame):
         f = self.tariff_cb.font()
         f.setPointSize(12)
         self.tariff_cb.setFont(f)
-        for o, v in self.tariffs.items():
-            try:
-                self.tariff_cb.addItem(o, float(v))
-                self.tariff_cb.setItemData(self.tariff_cb.count() - 1,
-                                           " Стоимость за час: " + v + " грн.", Qt.ToolTipRole)
-            except ValueError:
-                pass
-        # Select last select tariff
-        if self.tariff_cb.count() > 0:
-            index = 0
-            if self.config.has_option(pt.TIMER_CONTROLS_SECTION, "tariff-channel-" + str(self.channel)):
-                tariff = self.config[pt.TIMER_CONTROLS_SECTION]["tariff-channel-" + str(self.channel)]
-                if self.tariff_cb.findText(tariff) >= 0:
-                    index = self.tariff_cb.findText(tariff)
-            self.tariff_cb.setCurrentIndex(index)
-            self.change_tariff_cb(index)
+        self.fill_tariffs()
         # Set slot for change events
         self.tariff_cb.currentIndexChanged.connect(self.change_tariff_cb)
 
@@ -229,112 +326,91 @@ class TimerCashControl(QFrame):
 
         root_lay.addLayout(controls_lay)
 
-    # Set price by tariff
+    def fill_tariffs(self):
+        """Tariffs combobox items by engine tariffs, channel tariff selected"""
+        self.tariff_cb.blockSignals(True)
+        self.tariff_cb.clear()
+        for o, v in self.tariffs.items():
+            self.tariff_cb.addItem(o, v)
+            self.tariff_cb.setItemData(self.tariff_cb.count() - 1,
+                                       " Стоимость за час: {:g} грн.".format(v), Qt.ToolTipRole)
+        # Select tariff of channel
+        if self.channel is not None:
+            index = self.tariff_cb.findText(self.ch.tariff)
+            if index >= 0:
+                self.tariff_cb.setCurrentIndex(index)
+        self.tariff_cb.blockSignals(False)
+
+    def update_tariffs(self, tariffs):
+        """Tariffs reloaded by engine"""
+        self.tariffs = tariffs
+        self.fill_tariffs()
+        if self.channel is not None:
+            self.refresh()
+
+    # Set price by tariff, engine saves tariff to config
     def change_tariff_cb(self, index):
-        print("Channel:", self.channel, "tariff changed to:", self.tariff_cb.currentText())
-        self.price = self.tariff_cb.itemData(index, Qt.UserRole)
-        # Check admin tariff
-        if self.price == 0:
-            self.time_display.setFocusPolicy(Qt.NoFocus)
-            self.cash_display.setFocusPolicy(Qt.NoFocus)
-            self.cash = 0
-            self.time = 0
-        else:
-            self.time_display.setFocusPolicy(Qt.ClickFocus)
-            self.cash_display.setFocusPolicy(Qt.ClickFocus)
-        # Save tariff to config
-        if not self.config.has_section(pt.TIMER_CONTROLS_SECTION):
-            self.config.add_section(pt.TIMER_CONTROLS_SECTION)
-        self.config[pt.TIMER_CONTROLS_SECTION]["tariff-channel-" + str(self.channel)] = \
-            self.tariff_cb.currentText()
+        self.engine.set_tariff(self.channel, self.tariff_cb.currentText())
 
-        self.display()
+    def closeEvent(self, evt):
+        self.clock.unsubscribe(self)
+        super().closeEvent(evt)
 
-    # Timer
-    def _timer_event(self, evt):
+    # Timer (tick from ClockDriver)
+    # Time computed by session clock, ticks only refresh display
+    # Session end handled by engine
+    @timed("timer_event")
+    def _timer_event(self, evt=None):
         if self.stopped:
             self.displayed = True
             return
         if self.paused:
-            self.displayed = not self.displayed
+            # Blink twice per second, independent of tick rate
+            self.displayed = int(time.monotonic() * 2) % 2 == 0
         else:
-            # Audit session
-            if self.time > self.session_time:
-                # Send change session signal
-                if self.session_time > 0 and self.mode != ControlMode.FREE:
-                    self.changed.emit(self.session_time, self.time)
-                self.session_time = self.time
-
             self.displayed = True
-            if self.mode == ControlMode.FREE:
-                self.time += 1
-                if self.time == (24 * 3600):
-                    self.stop()
-            elif self.time == 0:
-                # Time  is UP!
-                self.time_out()
-            else:
-                self.time -= 1
         self.display()
 
-    def time_out(self):
-        # Close add cash/time dialog if opened
-        if self.add_dialog:
-            self.add_dialog.close()
-        self.stop()
+    # Session deadline reached, session stopped by engine
+    def notify_time_out(self):
         QMessageBox.information(
-            self.parent(), self.tittle_lb.text(),
+            self.window(), self.tittle_lb.text(),
             "Время вышло!",
             QMessageBox.Ok
         )
 
     # Set control tittle
     def set_control_tittle(self, tittle="Канал "):
-        self.tittle_lb.setText(tittle + " " + str(self.channel + 1))
+        self.tittle_lb.setText(tittle.strip() + " " + str(self.channel + 1))
 
     # Display time & cash
     def display(self):
-        self.cash = round(self.time * (self.price / 3600), 2)
+        self.cash = self.ch.cash()
         # Time
         if self.displayed:
             str_time = "{:0>8}".format(str(datetime.timedelta(seconds=self.time)))
         else:
             str_time = ""
-        # Cash
-        str_cash = "{:.2f}".format(self.cash)
-        # Display values
-        self.time_display.display(str_time)
-        self.time_display.update()
-        self.cash_display.display(str_cash)
-        self.cash_display.update()
-
-        # print("self.session_time:", self.session_time, "self.mode =", self.mode)
+        # Blinking icon to indicate control mode when 5 minutes left
+        mode = self.mode
+        warn = mode != ControlMode.FREE and int(time.time()) % 2 and not self.stopped and not self.paused
+        self.time_blink = bool(warn and self.time < 5 * 60)
+        self.cash_blink = bool(warn and self.cash < self.rate.cash(5 * 60))
+        # Repaint only display with changed text or blink state, cash formatted only on change
+        time_state = (str_time, mode, self.time_blink)
+        cash_state = (self.cash, mode, self.cash_blink)
+        old_time_state, old_cash_state = self.displayed_values or (None, None)
+        self.displayed_values = (time_state, cash_state)
+        if time_state != old_time_state:
+            self.time_display.display(str_time)
+            self.time_display.update()
+        if cash_state != old_cash_state:
+            self.cash_display.display(str(self.cash))
+            self.cash_display.update()
 
     # Start / Pause timer
     def start(self):
-        self.time_display.setFocusPolicy(Qt.NoFocus)
-        self.cash_display.setFocusPolicy(Qt.NoFocus)
-
-        if self.stopped:
-            self.stopped = False
-            self.start_btn.setText("Пауза")
-            self.switched.emit(self, True)
-            self.session_time = 0
-            if self.cash == 0 and self.time == 0:
-                self.mode = ControlMode.FREE
-            self.tariff_cb.setDisabled(True)
-            return
-
-        if self.paused:
-            self.start_btn.setText("Пауза")
-            self.paused = False
-            self.switched.emit(self, True)
-        else:
-            self.start_btn.setText("Возобновить")
-            self.paused = True
-            self.switched.emit(self, False)
-
-        self.display()
+        self.engine.toggle(self.channel)
 
     # Stop timer
     def stop(self):
@@ -342,79 +418,45 @@ class TimerCashControl(QFrame):
             return
         if (self.cash or self.time) and \
                 QMessageBox.No == QMessageBox.question(
-            self.parent(), self.tittle_lb.text(), "Завершить текущий сеанс?",
+            self.window(), self.tittle_lb.text(), "Завершить текущий сеанс?",
             QMessageBox.Yes | QMessageBox.No):
             return
+        self.stop_session()
 
-        # Check admin tariff
-        if self.price > 0:
-            self.time_display.setFocusPolicy(Qt.ClickFocus)
-            self.cash_display.setFocusPolicy(Qt.ClickFocus)
-
-        self.start_btn.setText("Старт")
-
-        # Set default mode to FREE
-        self.mode = ControlMode.FREE
-
-        self.displayed = True
-        self.paused = False
-        self.stopped = True
-        self.tariff_cb.setDisabled(False)
-
-        # Before clear self.cash & self.time we send signal
-        # for calculating difference for cash back in main app
-        self.switched.emit(self, False)
-
-        self.cash = 0
-        self.time = 0
-        self.display()
+    # Stop timer without asking
+    def stop_session(self):
+        self.engine.stop(self.channel)
 
     # Paint cash icon in QLCDNumber
+    @timed("paint_cash")
     def _cash_paint_event(self, evt: QPaintEvent):
+        render = self.cash_render.layout(self.cash_display)
         p = QPainter(self.cash_display)
-        # Fixed font size
-        f = p.font()
-        f.setPointSize(10)
-        p.setFont(f)
-        w, h = 0, self.cash_display.height() - (p.fontMetrics().height() / 2)
-        p.drawText((p.fontMetrics().height() / 2), h, "Деньги")
-
-        # Blinking icon to indicate control mode when cash < by 5 min for price
-        if not self.stopped and not self.paused and \
-                self.cash < (self.price / 3600 * (5 * 60)) and \
-                self.mode != ControlMode.FREE and \
-                datetime.datetime.now().second % 2:
-            QLCDNumber.paintEvent(self.cash_display, evt)
-            return
+        render.draw_caption(p)
 
-        if self.mode != ControlMode.TIME:
-            w, h = 32, 32
-            p.drawPixmap(5, 5, w, h, self.cash_pixmap)
+        # Blinking icon (state by display()) when cash < by 5 min for price
+        if self.mode != ControlMode.TIME and not self.cash_blink:
+            render.draw_icon(p)
+        p.end()
 
         QLCDNumber.paintEvent(self.cash_display, evt)
 
     # Paint clock icon in QLCDNumber
+    @timed("paint_time")
     def _time_paint_event(self, evt: QPaintEvent):
+        render = self.time_render.layout(self.time_display)
         p = QPainter(self.time_display)
-        # Fixed font size
-        f = p.font()
-        f.setPointSize(10)
-        p.setFont(f)
         p.setRenderHints(p.renderHints() | QPainter.Antialiasing)
-        w, h = 0, self.time_display.height() - (p.fontMetrics().height() / 2)
-        p.drawText((p.fontMetrics().height() / 2), h, "Время")
+        render.draw_caption(p)
 
-        # Blinking icon to indicate control mode when 5 minutes left
-        if not self.stopped and not self.paused and \
-                self.time < (5 * 60) and \
-                self.mode != ControlMode.FREE and \
-                datetime.datetime.now().second % 2:
+        # Blinking icon (state by display()) when 5 minutes left
+        if self.time_blink:
+            p.end()
             QLCDNumber.paintEvent(self.time_display, evt)
             return
 
         if self.mode != ControlMode.CASH:
-            w, h = 32, 32
-            p.drawPixmap(5, 5, w, h, self.time_pixmap)
+            render.draw_icon(p)
 
         # Edit time
         if self.edit_time_mode != EditTimeMode.NO_EDIT:
@@ -428,14 +470,14 @@ class TimerCashControl(QFrame):
             pen.setCapStyle(Qt.FlatCap)
             pen.setJoinStyle(Qt.RoundJoin)
             p.setPen(pen)
-            dig_width = self.time_display.width() / self.time_display.digitCount()
-            dig_height = self.time_display.height() / 2
+            dig_width, dig_height = render.digit_width, render.digit_height
             margin = dig_width / 4
             x1 = (dig_width * pos_num) - margin
             y1 = (dig_height / 2) - margin
             x2 = (dig_width * 2) + margin * 2
             y2 = dig_height + margin * 2
             p.drawRoundedRect(x1, y1, x2, y2, 5.0, 5.0)
+        p.end()
 
         QLCDNumber.paintEvent(self.time_display, evt)
 
@@ -444,16 +486,11 @@ class TimerCashControl(QFrame):
         palette = self.cash_display.palette()
         palette.setColor(QPalette.Background, QColor(255, 255, 255))
         self.cash_display.setPalette(palette)
-        try:
-            if float(self.cash).is_integer():
-                self.cash = str(int(float(self.cash)))
-            else:
-                self.cash = str(round(self.cash, 2))
-        except Exception as e:
-            print(e)
+        self.cash_text = self.cash.edit_text()
         # Set control mode by cash
         self.mode = ControlMode.CASH
-        self.cash_display.display(self.cash)
+        self.displayed_values = None
+        self.cash_display.display(self.cash_text)
         self.time_display.update()
 
     # Cash display lost focus
@@ -462,29 +499,25 @@ class TimerCashControl(QFrame):
         pallete.setColor(QPalette.Background, self.default_background_display_color)
         self.cash_display.setPalette(pallete)
 
-        self.cash = float(self.cash)
-        if self.cash == 0:
+        cash = Money.parse(self.cash_text)
+        self.cash_text = None
+        if cash == 0:
             self.mode = ControlMode.FREE
 
-        # Check max cash by 24 hours
-        max_cash = ((24 * 3600) - 1) * (self.price / 3600)
-        if self.cash > max_cash:
-            self.cash = max_cash
-
-        # Calculate time by cash
-        self.time = round(self.cash / self.price * 3600)
+        # Engine calculates time by cash, max cash by 24 hours
+        self.engine.set_cash(self.channel, cash)
         self.display()
         self.start_btn.setFocus()
 
     # Cash display key pressed
     def _cash_key_pressed(self, evt):
-        # In edit mode , we work ONLY with str type self.cash
+        # In edit mode cash edited as text in self.cash_text
         if evt.key() in (Qt.Key_Enter, Qt.Key_Return, Qt.Key_Escape):
             self.cash_display.clearFocus()
             return
         if (Qt.Key_0 <= evt.key() <= Qt.Key_9) or \
                 (evt.key() == Qt.Key_Period or evt.key() == Qt.Key_Backspace):
-            cash = str(self.cash)
+            cash = self.cash_text
             if evt.key() == Qt.Key_Backspace and len(cash) > 0:
                 cash = cash[:-1]
             elif len(cash) == 1 and cash[0] == "0" and \
@@ -502,10 +535,11 @@ class TimerCashControl(QFrame):
                 pass
             else:
                 cash += evt.text()
-            self.cash = cash if len(cash) > 0 else "0"
+            self.cash_text = cash if len(cash) > 0 else "0"
         if evt.key() == Qt.Key_Delete:
-            self.cash = "0"
-        self.cash_display.display(self.cash)
+            self.cash_text = "0"
+        self.displayed_values = None
+        self.cash_display.display(self.cash_text)
 
     # Cash display mouse move
     def _cash_mouse_move(self, evt):
@@ -642,8 +676,11 @@ class AddDialog(QDialog):
     def __init__(self, parent):
         super().__init__(parent)
         self.icon = None
+        # Inputted time (seconds)
         self.inputted_value = 0
-        self.add_cash = 0
+        # Inputted cash text
+        self.inputted_text = "0"
+        self.add_cash = Money(0)
         self.edit_time_mode = EditTimeMode.HOURS
         if parent.mode == ControlMode.TIME:
             self.icon = QPixmap("./res/clock.png")
@@ -710,14 +747,14 @@ class AddDialog(QDialog):
         display_str = "Err"
         if self.parent().mode == ControlMode.TIME:
             display_str = "{:0>8}".format(str(datetime.timedelta(seconds=self.inputted_value)))
-            self.add_cash = str(round((self.inputted_value / 3600) * self.parent().price, 2))
-            self.res_lb.setText("Деньги: " + self.add_cash)
+            self.add_cash = self.parent().rate.cash(self.inputted_value)
+            self.res_lb.setText("Деньги: " + str(self.add_cash))
         elif self.parent().mode == ControlMode.CASH:
-            self.add_cash = self.inputted_value
+            self.add_cash = Money.parse(self.inputted_text)
             self.res_lb.setText("Время: {:0>8}".format(
-                str(datetime.timedelta(seconds=round(float(self.inputted_value) / self.parent().price * 3600)))
+                str(datetime.timedelta(seconds=self.parent().rate.seconds(self.add_cash)))
             ))
-            display_str = self.inputted_value
+            display_str = self.inputted_text
         self.input_lcd.display(display_str)
 
     def _input_key_press(self, evt):
@@ -781,31 +818,32 @@ class AddDialog(QDialog):
 
         # Cash
         elif self.parent().mode == ControlMode.CASH:
-            self.inputted_value = str(self.inputted_value)
             # 0..9
             if Qt.Key_0 <= evt.key() <= Qt.Key_9 or evt.key() == Qt.Key_Period:
-                if "." in self.inputted_value and evt.key() == Qt.Key_Period:
+                if "." in self.inputted_text and evt.key() == Qt.Key_Period:
                     return
-                if len(self.inputted_value) == 0 or self.inputted_value == "0":
+                if len(self.inputted_text) == 0 or self.inputted_text == "0":
                     if evt.key() == Qt.Key_Period:
-                        self.inputted_value = "0."
+                        self.inputted_text = "0."
                     else:
-                        self.inputted_value = evt.text()
+                        self.inputted_text = evt.text()
                 else:
-                    if "." in self.inputted_value and \
-                            len(self.inputted_value) - self.inputted_value.index(".") > 2:
+                    if "." in self.inputted_text and \
+                            len(self.inputted_text) - self.inputted_text.index(".") > 2:
                         return
-                    self.inputted_value = self.inputted_value + evt.text()
-                if self.parent().cash + float(self.inputted_value) > 24 * self.parent().price:
-                    self.inputted_value = str(round((24 * self.parent().price) - self.parent().cash, 2))
+                    self.inputted_text = self.inputted_text + evt.text()
+                # Check cash overflow by 24 hours
+                max_cash = self.parent().rate.cash(24 * 3600)
+                if self.parent().cash + Money.parse(self.inputted_text) > max_cash:
+                    self.inputted_text = (max_cash - self.parent().cash).edit_text()
             # Backspace
-            if evt.key() == Qt.Key_Backspace and len(self.inputted_value) > 0:
-                self.inputted_value = self.inputted_value[:-1]
+            if evt.key() == Qt.Key_Backspace and len(self.inputted_text) > 0:
+                self.inputted_text = self.inputted_text[:-1]
             # Delete
             if evt.key() == Qt.Key_Delete:
-                self.inputted_value = "0"
-            if len(self.inputted_value) == 0:
-                self.inputted_value = "0"
+                self.inputted_text = "0"
+            if len(self.inputted_text) == 0:
+                self.inputted_text = "0"
         self._display()
 
     def _input_lcd_paint(self, evt):
@@ -829,11 +867,11 @@ class AddDialog(QDialog):
 
     def _add_btn_click(self):
         if self.parent().mode == ControlMode.CASH:
-            self.time = round(float(self.inputted_value) / self.parent().price * 3600)
+            self.time = self.parent().rate.seconds(self.add_cash)
             if self.time < self.min_add_time:
                 QMessageBox.warning(self, "Добавить деньги",
-                                    "Минимальная сумма для добавления: " + str(
-                                        round(self.parent().price / 60 * 5, 2)) + " грн.")
+                                    "Минимальная сумма для добавления: " +
+                                    str(self.parent().rate.cash(self.min_add_time)) + " грн.")
                 return
         else:
             self.time = self.inputted_value
@@ -842,19 +880,22 @@ class AddDialog(QDialog):
                                     "Минимальное время для добавления: 5 минут")
                 return
         if QMessageBox.question(self, "Оплата",
-                                "Доплата в размере " + self.add_cash + " грн получена?",
+                                "Доплата в размере " + str(self.add_cash) + " грн получена?",
                                 QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
-            self.parent().time += self.time
+            self.parent().add_time(self.time, self.add_cash)
         self.close()
 
 
 if __name__ == "__main__":
     import os, pt
+    from engine.engine import SessionEngine, Channel
 
     os.chdir("..")
     app = QApplication([])
     mw = QWidget()
     mw.config = pt.read_config()
+    mw.engine = SessionEngine(mw.config)
+    mw.engine.channels = [Channel(0), Channel(1)]
     w = TimerCashControl(mw, 1)
     mw.show()
     app.exec_()